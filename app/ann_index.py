@@ -0,0 +1,449 @@
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from app.local_index import matches_filter, normalize_metric, parse_upsert_vectors, top_k_rows
+
+logger = logging.getLogger(__name__)
+
+
+def _default_subquantizers(dimension: int) -> int:
+    # 4 dims per one-byte code keeps recall high on sentence-embedding sizes
+    for sub_dim in (4, 2, 3, 1):
+        if dimension % sub_dim == 0:
+            return dimension // sub_dim
+    return dimension
+
+
+def _sq_dists(x: np.ndarray, centroids: np.ndarray, c_norms: np.ndarray) -> np.ndarray:
+    # ||x - c||^2 without the ||x||^2 term, which does not change the argmin
+    return c_norms[None, :] - 2.0 * (x @ centroids.T)
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, block: int = 16384) -> np.ndarray:
+    c_norms = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(x.shape[0], dtype=np.int32)
+    for i in range(0, x.shape[0], block):
+        out[i : i + block] = _sq_dists(x[i : i + block], centroids, c_norms).argmin(axis=1)
+    return out
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 15, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means on float32 rows; empty clusters are re-seeded."""
+    rng = np.random.default_rng(seed)
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    k = min(k, x.shape[0])
+    centroids = x[rng.choice(x.shape[0], size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        starts = (np.cumsum(counts) - counts)[~empty]
+        sums = np.add.reduceat(x[np.argsort(assign, kind="stable")], starts, axis=0)
+        centroids[~empty] = sums / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = x[rng.choice(x.shape[0], size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+class _Column:
+    """Growable array with amortised appends; may start from a read-only memmap."""
+
+    def __init__(self, shape_tail, dtype, base: Optional[np.ndarray] = None):
+        self.shape_tail = tuple(shape_tail)
+        self.dtype = np.dtype(dtype)
+        self._buf = base if base is not None else np.empty((0,) + self.shape_tail, dtype=self.dtype)
+        self.n = self._buf.shape[0]
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._buf[: self.n]
+
+    def append(self, block: np.ndarray) -> None:
+        need = self.n + block.shape[0]
+        if self._buf.shape[0] < need or not self._buf.flags.writeable:
+            grown = np.empty((max(need, 2 * self.n, 1024),) + self.shape_tail, dtype=self.dtype)
+            grown[: self.n] = self._buf[: self.n]
+            self._buf = grown
+        self._buf[self.n : need] = block
+        self.n = need
+
+    def writable(self) -> np.ndarray:
+        if not self._buf.flags.writeable:
+            self._buf = np.array(self._buf[: self.n])
+        return self._buf[: self.n]
+
+
+class IVFPQIndex:
+    """Approximate nearest-neighbour index: inverted file + product quantization.
+
+    Follows the same `upsert`/`query`/`delete` contract as `LocalIndex`, so it
+    can back `retrieve_documents` for corpora too large for exact search.
+
+    - Vectors are assigned to one of `nlist` coarse k-means cells and their
+      residual is compressed to `m` one-byte codes. A query scans only the
+      `nprobe` closest cells (the recall/latency knob) using lookup tables.
+    - `refine_factor` re-scores `top_k * refine_factor` candidates against the
+      stored float16 vectors (`store_vectors=True`); 0 disables it.
+    - Until `train()` runs (automatically once `train_threshold` vectors are
+      present) queries fall back to exact search over the stored vectors.
+    - Deletes are tombstones; `compact()` drops them and runs automatically
+      when they exceed `compact_ratio` of the rows.
+    - `save()` writes `.npy` files that `IVFPQIndex.open()` maps with `mmap_mode="r"`.
+    """
+
+    accepts_numpy = True
+
+    def __init__(
+        self,
+        dimension: int,
+        metric: str = "cosine",
+        nlist: int = 1024,
+        m: Optional[int] = None,
+        nprobe: int = 16,
+        refine_factor: int = 8,
+        store_vectors: bool = True,
+        train_threshold: Optional[int] = None,
+        compact_ratio: float = 0.2,
+        path: Optional[str] = None,
+        seed: int = 0,
+    ):
+        self.dimension = dimension
+        self.metric = normalize_metric(metric)
+        self.nlist = nlist
+        self.m = m or _default_subquantizers(dimension)
+        if dimension % self.m:
+            raise ValueError(f"dimension {dimension} is not divisible by m={self.m}")
+        self.nprobe = nprobe
+        self.refine_factor = refine_factor
+        self.store_vectors = store_vectors
+        self.train_threshold = train_threshold if train_threshold is not None else max(39 * nlist, 10000)
+        self.compact_ratio = compact_ratio
+        self.path = path
+        self.seed = seed
+        self._lock = threading.RLock()
+
+        self.centroids: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None
+        self._codes = _Column((self.m,), np.uint8)
+        self._lists = _Column((), np.int32)
+        self._norms = _Column((), np.float32)
+        self._raw = _Column((dimension,), np.float16)
+        self._valid = _Column((), bool)
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._row_of: Dict[str, int] = {}
+        self._order = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._sealed = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def _rows(self) -> int:
+        return len(self._ids)
+
+    # -- encoding -------------------------------------------------------------
+
+    def _prepare(self, values: Any) -> np.ndarray:
+        values = np.ascontiguousarray(values, dtype=np.float32)
+        if values.ndim == 1:
+            values = values[None, :]
+        if values.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {values.shape[1]} does not match index dimension {self.dimension}")
+        if self.metric == "cosine":
+            norms = np.linalg.norm(values, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            values = values / norms
+        return values
+
+    def _encode(self, x: np.ndarray):
+        lists = _assign(x, self.centroids)
+        residual = x - self.centroids[lists]
+        dsub = self.codebooks.shape[2]
+        codes = np.empty((x.shape[0], self.m), dtype=np.uint8)
+        for s in range(self.m):
+            codes[:, s] = _assign(residual[:, s * dsub : (s + 1) * dsub], self.codebooks[s])
+        return codes, lists
+
+    def train(self, sample_size: Optional[int] = None) -> None:
+        """Fit the coarse quantizer and PQ codebooks on the stored vectors and encode them."""
+        with self._lock:
+            live = np.flatnonzero(self._valid.data)
+            if not live.size:
+                raise ValueError("Cannot train an empty index")
+            if self._raw.n < self._rows:
+                raise ValueError("Retraining needs the raw vectors; construct with store_vectors=True")
+            rng = np.random.default_rng(self.seed)
+            cap = sample_size or max(64 * self.nlist, 256 * 64)
+            sample_rows = np.sort(rng.choice(live, size=min(cap, live.size), replace=False))
+            sample = self._raw.data[sample_rows].astype(np.float32)
+
+            nlist = max(1, min(self.nlist, sample.shape[0] // 39 or 1))
+            self.centroids = kmeans(sample, nlist, seed=self.seed)
+            residual = sample - self.centroids[_assign(sample, self.centroids)]
+            dsub = self.dimension // self.m
+            self.codebooks = np.stack([
+                kmeans(residual[:, s * dsub : (s + 1) * dsub], 256, seed=self.seed + s) for s in range(self.m)
+            ])
+
+            codes = np.empty((self._rows, self.m), dtype=np.uint8)
+            lists = np.zeros(self._rows, dtype=np.int32)
+            for i in range(0, self._rows, 65536):
+                block = self._raw.data[i : i + 65536].astype(np.float32)
+                codes[i : i + 65536], lists[i : i + 65536] = self._encode(block)
+            self._codes = _Column((self.m,), np.uint8, base=codes)
+            self._lists = _Column((), np.int32, base=lists)
+            if not self.store_vectors:
+                self._raw = _Column((self.dimension,), np.float16)
+            self._rebuild_lists()
+            logger.info("Trained IVF-PQ index: %d vectors, nlist=%d, m=%d", live.size, nlist, self.m)
+
+    def _rebuild_lists(self) -> None:
+        lists = self._lists.data
+        self._order = np.argsort(lists, kind="stable")
+        counts = np.bincount(lists, minlength=self.centroids.shape[0])
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._sealed = lists.shape[0]
+
+    # -- Pinecone-compatible API ---------------------------------------------
+
+    def upsert(self, vectors: Iterable[Any], **kwargs) -> Dict[str, int]:
+        """Insert or overwrite `(id, values, metadata)` tuples (or Pinecone dicts)."""
+        # an id repeated within the batch keeps its last vector, as if upserted one by one
+        items = list({vid: (vid, v, meta) for vid, v, meta in parse_upsert_vectors(vectors)}.values())
+        if not items:
+            return {"upserted_count": 0}
+        x = self._prepare(np.stack([np.asarray(v, dtype=np.float32) for _, v, _ in items]))
+        with self._lock:
+            for vid, _, _ in items:
+                self._tombstone(vid)
+            first = self._rows
+            self._norms.append(np.einsum("ij,ij->i", x, x))
+            self._valid.append(np.ones(len(items), dtype=bool))
+            if self.store_vectors or not self.trained:
+                self._raw.append(x.astype(np.float16))
+            if self.trained:
+                codes, lists = self._encode(x)
+                self._codes.append(codes)
+                self._lists.append(lists)
+            for i, (vid, _, meta) in enumerate(items):
+                self._ids.append(vid)
+                self._metadata.append(dict(meta))
+                self._row_of[vid] = first + i
+
+            if not self.trained and len(self._row_of) >= self.train_threshold:
+                self.train()
+            elif self.trained and self._rows - self._sealed > max(65536, self._sealed // 20):
+                self._rebuild_lists()
+        return {"upserted_count": len(items)}
+
+    def _tombstone(self, vid: str) -> bool:
+        row = self._row_of.pop(vid, None)
+        if row is None:
+            return False
+        self._valid.writable()[row] = False
+        self._ids[row] = None
+        self._metadata[row] = {}
+        return True
+
+    def delete(self, ids: Optional[Sequence[str]] = None, delete_all: bool = False, **kwargs) -> Dict[str, Any]:
+        """Tombstone `ids`; compacts once tombstones exceed `compact_ratio`."""
+        with self._lock:
+            targets = list(self._row_of) if delete_all else list(ids or [])
+            for vid in targets:
+                self._tombstone(vid)
+            if self._rows and 1 - len(self._row_of) / self._rows > self.compact_ratio:
+                self.compact()
+        return {}
+
+    def compact(self) -> None:
+        """Drop tombstoned rows from every column and rebuild the inverted lists."""
+        with self._lock:
+            keep = np.flatnonzero(self._valid.data)
+            self._norms = _Column((), np.float32, base=self._norms.data[keep])
+            self._valid = _Column((), bool, base=np.ones(keep.size, dtype=bool))
+            if self._raw.n:
+                self._raw = _Column((self.dimension,), np.float16, base=self._raw.data[keep])
+            if self.trained:
+                self._codes = _Column((self.m,), np.uint8, base=self._codes.data[keep])
+                self._lists = _Column((), np.int32, base=self._lists.data[keep])
+            self._ids = [self._ids[r] for r in keep]
+            self._metadata = [self._metadata[r] for r in keep]
+            self._row_of = {vid: i for i, vid in enumerate(self._ids)}
+            if self.trained:
+                self._rebuild_lists()
+
+    def _probe_rows(self, probes: np.ndarray) -> np.ndarray:
+        parts = [self._order[self._offsets[l] : self._offsets[l + 1]] for l in probes]
+        if self._sealed < self._rows:
+            tail = np.arange(self._sealed, self._rows)
+            parts.append(tail[np.isin(self._lists.data[tail], probes)])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def _exact(self, q: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        ip = self._raw.data[rows].astype(np.float32) @ q
+        if self.metric == "euclidean":
+            return float(q @ q) - 2.0 * ip + self._norms.data[rows]
+        return ip
+
+    def query_batch(
+        self,
+        vectors: Any,
+        top_k: int = 10,
+        include_metadata: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        nprobe: Optional[int] = None,
+        refine_factor: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Approximate top-k for each query; `nprobe`/`refine_factor` override the defaults."""
+        largest = self.metric != "euclidean"
+        nprobe = nprobe or self.nprobe
+        refine = self.refine_factor if refine_factor is None else refine_factor
+        with self._lock:
+            if not self._row_of:
+                return [{"matches": []} for _ in range(len(vectors))]
+            queries = self._prepare(vectors)
+            valid = self._valid.data
+
+            if self.trained:
+                coarse = queries @ self.centroids.T
+                probe_scores = coarse
+                if self.metric == "euclidean":
+                    probe_scores = np.einsum("ij,ij->i", self.centroids, self.centroids)[None, :] - 2.0 * coarse
+                probes = top_k_rows(probe_scores, nprobe, largest=largest)
+                dsub = self.dimension // self.m
+                luts = np.einsum("bsd,skd->bsk", queries.reshape(len(queries), self.m, dsub), self.codebooks)
+                sub = np.arange(self.m)
+
+            responses = []
+            for qi, q in enumerate(queries):
+                if self.trained:
+                    rows = self._probe_rows(probes[qi])
+                else:
+                    rows = np.arange(self._rows)
+                rows = rows[valid[rows]]
+                if filter:
+                    rows = rows[[matches_filter(self._metadata[r], filter) for r in rows]] if rows.size else rows
+                if not rows.size:
+                    responses.append({"matches": []})
+                    continue
+
+                if self.trained:
+                    ip = coarse[qi, self._lists.data[rows]] + luts[qi][sub, self._codes.data[rows]].sum(axis=1)
+                    scores = ip if largest else float(q @ q) - 2.0 * ip + self._norms.data[rows]
+                    depth = top_k * refine if refine and self._raw.n else top_k
+                    best = top_k_rows(scores[None, :], depth, largest=largest)[0]
+                    rows, scores = rows[best], scores[best]
+                    if refine and self._raw.n:
+                        scores = self._exact(q, rows)
+                else:
+                    scores = self._exact(q, rows)
+                best = top_k_rows(scores[None, :], top_k, largest=largest)[0]
+
+                matches = []
+                for b in best:
+                    r = rows[b]
+                    match = {"id": self._ids[r], "score": float(scores[b])}
+                    if include_metadata:
+                        match["metadata"] = dict(self._metadata[r])
+                    matches.append(match)
+                responses.append({"matches": matches})
+            return responses
+
+    def query(
+        self,
+        vector: Any = None,
+        top_k: int = 10,
+        include_metadata: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Pinecone-style single query: `{"matches": [{"id", "score", "metadata"}]}`."""
+        return self.query_batch([vector], top_k=top_k, include_metadata=include_metadata, filter=filter)[0]
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "dimension": self.dimension,
+                "metric": self.metric,
+                "total_vector_count": len(self._row_of),
+                "tombstones": self._rows - len(self._row_of),
+                "trained": self.trained,
+                "nlist": 0 if self.centroids is None else self.centroids.shape[0],
+                "m": self.m,
+            }
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    # -- persistence ------------------------------------------------------------
+
+    _PARAMS = ("dimension", "metric", "nlist", "m", "nprobe", "refine_factor", "store_vectors",
+               "train_threshold", "compact_ratio", "seed")
+
+    def save(self, path: Optional[str] = None) -> str:
+        """Write the index to `path` (default: the path it was opened with)."""
+        path = path or self.path
+        if not path:
+            raise ValueError("No path given to save the index to")
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            if self.trained and self._sealed < self._rows:
+                self._rebuild_lists()
+            arrays = {
+                "norms": self._norms.data,
+                "valid": self._valid.data,
+                "raw": self._raw.data,
+            }
+            if self.trained:
+                arrays.update(
+                    centroids=self.centroids, codebooks=self.codebooks, codes=self._codes.data,
+                    lists=self._lists.data, order=self._order, offsets=self._offsets,
+                )
+            for name, arr in arrays.items():
+                tmp = os.path.join(path, f"{name}.tmp.npy")
+                np.save(tmp, np.ascontiguousarray(arr))
+                os.replace(tmp, os.path.join(path, f"{name}.npy"))
+            with open(os.path.join(path, "ids.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump({"params": {p: getattr(self, p) for p in self._PARAMS}, "ids": self._ids, "metadata": self._metadata}, f)
+            os.replace(os.path.join(path, "ids.json.tmp"), os.path.join(path, "ids.json"))
+        self.path = path
+        return path
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True, **overrides) -> "IVFPQIndex":
+        """Load an index written by `save`, memory-mapping the large arrays."""
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        params = dict(state["params"], **overrides)
+        index = cls(path=path, **params)
+        mode = "r" if mmap else None
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+
+        index._ids = state["ids"]
+        index._metadata = state["metadata"]
+        index._row_of = {vid: i for i, vid in enumerate(index._ids) if vid is not None}
+        index._norms = _Column((), np.float32, base=load("norms"))
+        index._valid = _Column((), bool, base=load("valid"))
+        index._raw = _Column((index.dimension,), np.float16, base=load("raw"))
+        if os.path.exists(os.path.join(path, "centroids.npy")):
+            index.centroids = np.asarray(load("centroids"))
+            index.codebooks = np.asarray(load("codebooks"))
+            index._codes = _Column((index.m,), np.uint8, base=load("codes"))
+            index._lists = _Column((), np.int32, base=load("lists"))
+            index._order = load("order")
+            index._offsets = np.asarray(load("offsets"))
+            index._sealed = index._lists.n
+        return index
+
+
+__all__ = ["IVFPQIndex", "kmeans"]
@@ -0,0 +1,97 @@
+import os
+import asyncio
+import inspect
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Generic, Iterable, Optional, TypeVar
+
+_DONE = object()
+
+T = TypeVar("T")
+
+
+class ProcessSingleton(Generic[T]):
+    """Process-wide object built by `factory` on first `get()`.
+
+    A forked child starts without it and builds its own on first use: thread
+    pools, HTTP sessions and database connections must not be inherited
+    across `fork` (their threads are gone and their sockets are shared).
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def get(self) -> T:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def _reset(self) -> None:
+        self._value = None
+        self._lock = threading.Lock()
+
+
+_executor: ProcessSingleton[ThreadPoolExecutor] = ProcessSingleton(
+    lambda: ThreadPoolExecutor(
+        max_workers=int(os.getenv("ASYNC_BLOCKING_WORKERS", "32")), thread_name_prefix="async-blocking"
+    )
+)
+
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    """Bounded pool for blocking work (client I/O, local models) called from async code.
+
+    Sized by `ASYNC_BLOCKING_WORKERS` (default 32) so many concurrent requests
+    share a fixed number of threads instead of one each.
+    """
+    return _executor.get()
+
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking call on the shared executor without blocking the event loop.
+
+    The call runs in a copy of the caller's context, so spans it opens nest
+    under the caller's span.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_blocking_executor(), functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+async def call_maybe_async(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Await `fn(*args)` if it is a coroutine function, otherwise run it on the executor."""
+    if inspect.iscoroutinefunction(fn) or inspect.iscoroutinefunction(getattr(fn, "__call__", None)):
+        return await fn(*args, **kwargs)
+    return await run_blocking(fn, *args, **kwargs)
+
+
+async def iterate_blocking(iterable: Iterable[Any]) -> AsyncIterator[Any]:
+    """Consume a blocking iterator (e.g. an SDK stream) from async code, one item per executor hop.
+
+    Closing this iterator early (e.g. a client disconnecting) closes `iterable` too.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            item = await run_blocking(next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            try:
+                await run_blocking(close)
+            except ValueError:
+                # cancelled mid-`next`: the generator is still running on the executor
+                pass
+
+
+__all__ = ["ProcessSingleton", "get_blocking_executor", "run_blocking", "call_maybe_async", "iterate_blocking"]
@@ -0,0 +1,107 @@
+import weakref
+import functools
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+_MISSING = object()
+
+# attributes that name what an object is backed by, in the order they are reported
+_NAME_ATTRS = ("path", "index_name", "name", "model", "model_name", "embedding_model_name")
+_object_tokens: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+_token_lock = threading.Lock()
+_next_token = itertools.count(1)
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used mapping with hit/miss counters."""
+
+    def __init__(self, max_items: int = 1024):
+        if max_items < 1:
+            raise ValueError("max_items must be >= 1")
+        self.max_items = max_items
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def identity_key(obj: Any) -> str:
+    """A string identifying `obj` in cache keys; unlike `id()` it is never reused.
+
+    - Functions are named by module, qualname and code location, so a lambda
+      rebuilt on every request keeps its key; bound methods add their object's
+      key and `functools.partial` its arguments.
+    - Objects with a string `path`, `index_name`, `name`, `model`, `model_name`
+      or `embedding_model_name` are named by their type and those values.
+    - Anything else gets a per-object token that lives as long as the object.
+    """
+    if obj is None:
+        return ""
+    if isinstance(obj, functools.partial):
+        args = [identity_key(a) if callable(a) else repr(a) for a in obj.args]
+        return f"partial({identity_key(obj.func)}, {args!r}, {sorted(obj.keywords.items())!r})"
+    func = getattr(obj, "__func__", obj)
+    code = getattr(func, "__code__", None)
+    if code is not None:
+        name = f"{getattr(func, '__module__', '')}.{func.__qualname__}@{code.co_filename}:{code.co_firstlineno}"
+        owner = getattr(obj, "__self__", None)
+        return f"{name}[{identity_key(owner)}]" if owner is not None else name
+    kind = f"{type(obj).__module__}.{type(obj).__qualname__}"
+    named = [f"{attr}={getattr(obj, attr)}" for attr in _NAME_ATTRS if isinstance(getattr(obj, attr, None), str)]
+    if named:
+        return f"{kind}({', '.join(named)})"
+    try:
+        with _token_lock:
+            token = _object_tokens.setdefault(obj, next(_next_token))
+    except TypeError:
+        # neither hashable nor weakly referenceable: the best left is the address
+        token = id(obj)
+    return f"{kind}#{token}"
+
+
+__all__ = ["LRUCache", "identity_key"]
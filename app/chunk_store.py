@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from app.async_utils import ProcessSingleton
+
+# Metadata fields that hold chunk text (the ones `docs_from_response` reads).
+TEXT_FIELDS = ("text", "content", "page_content")
+
+# Stay under SQLite's default limit on bound parameters per statement.
+_MAX_PARAMS = 900
+
+
+def without_text(metadata: Optional[Dict]) -> Dict:
+    """Copy of `metadata` without the text fields, for indexes backed by a chunk store."""
+    return {k: v for k, v in (metadata or {}).items() if k not in TEXT_FIELDS}
+
+
+class ChunkStore:
+    """Local chunk text keyed by vector id, in one SQLite file.
+
+    With a chunk store the vector index only carries ids and small filter
+    fields; retrieval fetches the text of the candidates it keeps with one
+    `get_many` call instead of pulling it through `include_metadata`.
+    `path=None` keeps the store in memory. Safe to share between threads.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        if path:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, source_id TEXT, text TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source_id)")
+        self._conn.commit()
+
+    def add_documents(self, docs: Iterable[Dict], ids: Sequence[str]) -> None:
+        """Store the `text` of each doc under its id (replacing older text)."""
+        rows = [(doc_id, d.get("source_id"), d.get("text", "")) for doc_id, d in zip(ids, docs)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (id, source_id, text) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def get(self, doc_id: str) -> Optional[str]:
+        return self.get_many([doc_id]).get(doc_id)
+
+    def get_many(self, ids: Sequence[str]) -> Dict[str, str]:
+        """Texts of `ids` that are stored, as `{id: text}`, in as few queries as possible."""
+        ids = list(dict.fromkeys(ids))
+        out: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(ids), _MAX_PARAMS):
+                part = ids[i : i + _MAX_PARAMS]
+                marks = ",".join("?" * len(part))
+                out.update(self._conn.execute(f"SELECT id, text FROM chunks WHERE id IN ({marks})", part))
+        return out
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        with self._lock:
+            for i in range(0, len(ids), _MAX_PARAMS):
+                part = ids[i : i + _MAX_PARAMS]
+                self._conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(part))})", part)
+            self._conn.commit()
+
+    def ids_for_source(self, source_id: str) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT id FROM chunks WHERE source_id = ?", (source_id,))]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM chunks WHERE id = ?", (doc_id,)).fetchone() is not None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_default_store = ProcessSingleton(lambda: ChunkStore(os.environ["CHUNK_STORE_PATH"]))
+
+
+def get_default_chunk_store() -> Optional[ChunkStore]:
+    """Return the process-wide chunk store at `CHUNK_STORE_PATH`, or None when it is not set."""
+    if not os.getenv("CHUNK_STORE_PATH"):
+        return None
+    return _default_store.get()
+
+
+def hydrate(docs: List[Dict], chunk_store: Optional[ChunkStore]) -> List[Dict]:
+    """Fill in `text` for result dicts that have none, with one bulk read from `chunk_store`."""
+    if chunk_store is None:
+        return docs
+    missing = [d["id"] for d in docs if not d.get("text") and d.get("id") is not None]
+    if missing:
+        texts = chunk_store.get_many(missing)
+        for d in docs:
+            if not d.get("text") and d.get("id") in texts:
+                d["text"] = texts[d["id"]]
+    return docs
+
+
+__all__ = ["ChunkStore", "TEXT_FIELDS", "get_default_chunk_store", "hydrate", "without_text"]
@@ -12,12 +12,16 @@ except Exception:
 @dataclass
 class Config:
     gemini_api_key: str
-    pinecone_api_key: str
+    pinecone_api_key: Optional[str]
     pinecone_environment: Optional[str]
     pinecone_index: str
     hf_embedding_model: str
     hf_api_key: Optional[str]
     pinecone_metric: str
+    embedding_device: Optional[str] = None
+    embedding_precision: str = "float32"
+    vector_backend: str = "pinecone"
+    local_index_path: Optional[str] = None
 
 
 def load_config() -> Config:
@@ -29,7 +33,7 @@ def load_config() -> Config:
 
     Required env vars:
     - `GEMINI_API_KEY` (for Gemini LLM calls)
-    - `PINECONE_API_KEY` (for Pinecone)
+    - `PINECONE_API_KEY` (for Pinecone; not needed with a local `VECTOR_BACKEND`)
 
     Optional env vars:
     - `PINECONE_ENVIRONMENT` or `PINECONE_ENV`
@@ -37,6 +41,10 @@ def load_config() -> Config:
     - `HF_EMBEDDING_MODEL` (defaults to `sentence-transformers/all-MiniLM-L6-v2`)
     - `HUGGINGFACE_API_KEY`
     - `PINECONE_METRIC`
+    - `EMBEDDING_DEVICE` (defaults to CUDA when available, else CPU)
+    - `EMBEDDING_PRECISION` (`float32`, `float16`, `bfloat16` or `int8` for the ONNX backend; defaults to `float32`)
+    - `VECTOR_BACKEND` (`pinecone`, `local` or `ivfpq`; defaults to `pinecone`)
+    - `LOCAL_INDEX_PATH` (directory for the local backend; in-memory if unset)
 
     Raises `EnvironmentError` if required vars are missing.
     """
@@ -50,11 +58,12 @@ def load_config() -> Config:
 
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     pinecone_api_key = os.getenv("PINECONE_API_KEY")
+    vector_backend = os.getenv("VECTOR_BACKEND", "pinecone").lower()
 
     missing = []
     if not gemini_api_key:
         missing.append("GEMINI_API_KEY")
-    if not pinecone_api_key:
+    if not pinecone_api_key and vector_backend == "pinecone":
         missing.append("PINECONE_API_KEY")
     if missing:
         raise EnvironmentError(f"Missing required environment variables: {', '.join(missing)}")
@@ -64,6 +73,9 @@ def load_config() -> Config:
     hf_embedding_model = os.getenv("HF_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
     hf_api_key = os.getenv("HUGGINGFACE_API_KEY")
     pinecone_metric = os.getenv("PINECONE_METRIC", "cosine")
+    local_index_path = os.getenv("LOCAL_INDEX_PATH")
+    embedding_device = os.getenv("EMBEDDING_DEVICE")
+    embedding_precision = os.getenv("EMBEDDING_PRECISION", "float32")
 
     return Config(
         gemini_api_key=gemini_api_key,
@@ -73,6 +85,10 @@ def load_config() -> Config:
         hf_embedding_model=hf_embedding_model,
         hf_api_key=hf_api_key,
         pinecone_metric=pinecone_metric,
+        embedding_device=embedding_device,
+        embedding_precision=embedding_precision,
+        vector_backend=vector_backend,
+        local_index_path=local_index_path,
     )
 
 
@@ -0,0 +1,173 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.async_utils import ProcessSingleton
+from app.embeddings import embed_texts_array, get_embedding_model
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _Request:
+    __slots__ = ("text", "future", "enqueued")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class EmbeddingBatcher:
+    """Coalesce single-text embedding requests into batched `encode` calls.
+
+    Callers on any thread (or asyncio task via `embed_async`) submit one text
+    and receive a future. A background worker collects requests for up to
+    `max_wait_ms` or until `max_batch_size` items are queued, embeds them with
+    one `embed_texts_array` call and resolves each caller's future with its
+    row of the batch matrix (a float32 `np.ndarray`).
+
+    - `model` defaults to the shared model from `get_embedding_model`.
+    - `stats()` reports queue depth, a batch-size histogram and wait times.
+    """
+
+    def __init__(self, model: Optional[Any] = None, max_batch_size: int = 32, max_wait_ms: float = 3.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._requests = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._closed = False
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue `text` for embedding and return a future resolving to its vector."""
+        if self._closed:
+            raise RuntimeError("EmbeddingBatcher is closed")
+        self._ensure_worker()
+        req = _Request(text)
+        self._queue.put(req)
+        return req.future
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Blocking helper: embed `text` as part of the next batch."""
+        return self.submit(text).result(timeout=timeout)
+
+    async def embed_async(self, text: str) -> np.ndarray:
+        """Awaitable variant of `embed` that does not block the event loop."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self, first: _Request) -> List[_Request]:
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # put it back so the run loop exits after this batch
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [r for r in self._collect(item) if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._requests += len(batch)
+                for r in batch:
+                    waited = started - r.enqueued
+                    self._wait_total += waited
+                    self._wait_max = max(self._wait_max, waited)
+
+            try:
+                model = self.model if self.model is not None else get_embedding_model()
+                vectors = embed_texts_array([r.text for r in batch], model=model, batch_size=len(batch))
+            except Exception as exc:
+                logger.exception("Batched embedding of %d texts failed", len(batch))
+                for r in batch:
+                    r.future.set_exception(exc)
+                continue
+            for r, vec in zip(batch, vectors):
+                r.future.set_result(vec)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, batch-size histogram and wait-time statistics."""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": batches,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "mean_batch_size": self._requests / batches if batches else 0.0,
+                "mean_wait_ms": 1000.0 * self._wait_total / self._requests if self._requests else 0.0,
+                "max_wait_ms": 1000.0 * self._wait_max,
+            }
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stop the worker after already-queued requests have been served."""
+        self._closed = True
+        if self._worker is not None:
+            self._queue.put(_STOP)
+            self._worker.join(timeout)
+
+
+_default_batcher = ProcessSingleton(
+    lambda: EmbeddingBatcher(
+        max_batch_size=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32")),
+        max_wait_ms=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "3")),
+    )
+)
+
+
+def get_default_batcher() -> EmbeddingBatcher:
+    """Return the process-wide batcher configured from the environment.
+
+    - `EMBEDDING_BATCH_WAIT_MS` (defaults to `3`)
+    - `EMBEDDING_BATCH_MAX_SIZE` (defaults to `32`)
+    """
+    return _default_batcher.get()
+
+
+def microbatch_enabled() -> bool:
+    """Whether `EMBEDDING_MICROBATCH` asks for queries without an explicit model to go through the batcher."""
+    return os.getenv("EMBEDDING_MICROBATCH", "").lower() in ("1", "true", "yes")
+
+
+__all__ = ["EmbeddingBatcher", "get_default_batcher", "microbatch_enabled"]
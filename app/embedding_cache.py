@@ -0,0 +1,264 @@
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.async_utils import ProcessSingleton
+from app.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFC, trimmed, whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    """Content address of `text` embedded with `model_name`."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model_name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+class _DiskTier:
+    """Append-only vector file plus an offset index, read through `np.memmap`.
+
+    Layout of `path`:
+    - `meta.json`: `{"dim": ..., "dtype": ...}` written with the first vector
+    - `vectors.bin`: fixed-size rows of `dtype`
+    - `index.tsv`: one `key<TAB>row` line per stored vector
+
+    Vector bytes are flushed before their index line, so a crash can at worst
+    leave an orphan row that is never referenced. Several processes may share
+    one directory: writes hold an exclusive lock on `write.lock`, take their
+    row numbers from the vector file's size and pick up the index lines the
+    other writers appended since.
+    """
+
+    def __init__(self, path: str, dtype: str = "float32"):
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unsupported cache dtype '{dtype}'; expected one of {sorted(_DTYPES)}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = np.dtype(_DTYPES[dtype])
+        self.dim: Optional[int] = None
+        self.offsets: Dict[str, int] = {}
+        self._rows = 0
+        self._mmap: Optional[np.memmap] = None
+        self._vectors_path = os.path.join(path, "vectors.bin")
+        self._index_path = os.path.join(path, "index.tsv")
+        self._meta_path = os.path.join(path, "meta.json")
+        self._lock_path = os.path.join(path, "write.lock")
+        self._index_pos = 0
+        self._load()
+
+    @property
+    def row_bytes(self) -> int:
+        return (self.dim or 0) * self.dtype.itemsize
+
+    def _load_meta(self) -> None:
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = int(meta["dim"])
+        self.dtype = np.dtype(meta["dtype"])
+
+    def _load(self) -> None:
+        if not os.path.exists(self._meta_path):
+            return
+        self._load_meta()
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._rows = self._complete_rows()
+            self._read_index()
+
+    def _complete_rows(self) -> int:
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        rows = size // self.row_bytes
+        if size != rows * self.row_bytes:
+            # drop a torn trailing row from an interrupted write (callers hold the write lock)
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(rows * self.row_bytes)
+        return rows
+
+    def _ends_with_newline(self) -> bool:
+        with open(self._index_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _read_index(self) -> None:
+        """Read the index lines appended since the last call."""
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "r", encoding="utf-8") as f:
+            f.seek(self._index_pos)
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                self._index_pos += len(line.encode("utf-8"))
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 2 or not parts[1].isdigit():
+                    continue
+                row = int(parts[1])
+                if row < self._rows:
+                    self.offsets[parts[0]] = row
+
+    def _view(self) -> np.ndarray:
+        if self._mmap is None or self._mmap.shape[0] < self._rows:
+            self._mmap = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self._rows, self.dim))
+        return self._mmap
+
+    def get(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        rows = [(k, self.offsets[k]) for k in keys if k in self.offsets]
+        if not rows:
+            return {}
+        view = self._view()
+        idx = np.fromiter((r for _, r in rows), dtype=np.int64, count=len(rows))
+        block = np.asarray(view[idx], dtype=np.float32)
+        return {k: block[i] for i, (k, _) in enumerate(rows)}
+
+    def put(self, keys: Sequence[str], vectors: np.ndarray) -> None:
+        if all(k in self.offsets for k in keys):
+            return
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.dim is None and os.path.exists(self._meta_path):
+                # another process stored the first vector
+                self._load_meta()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {vectors.shape[1]} does not match cache dim {self.dim}")
+
+            # rows written by other processes since this one last looked
+            self._rows = self._complete_rows()
+            self._read_index()
+            fresh = [i for i, k in enumerate(keys) if k not in self.offsets]
+            if not fresh:
+                return
+            block = np.ascontiguousarray(vectors[fresh], dtype=self.dtype)
+            with open(self._vectors_path, "ab") as f:
+                first = os.fstat(f.fileno()).st_size // self.row_bytes
+                f.write(block.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._index_path, "a+", encoding="utf-8") as f:
+                lines = "".join(f"{keys[i]}\t{first + n}\n" for n, i in enumerate(fresh))
+                if f.tell() and not self._ends_with_newline():
+                    # close a line torn by a crashed writer so it can't swallow ours
+                    lines = "\n" + lines
+                f.write(lines)
+            self._rows = first + len(fresh)
+            self._read_index()
+
+    def disk_bytes(self) -> int:
+        return self._rows * self.row_bytes
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache with an LRU memory tier and an optional disk tier.
+
+    - Keys are `(model name, hash of normalized text)`, so identical chunks are
+      embedded once per model no matter how often they are re-ingested or asked.
+    - `path` enables the persistent tier (survives restarts); `dtype="float16"`
+      halves its size.
+    - `stats()` reports hit rate and the embedding bytes served from cache.
+    """
+
+    def __init__(self, path: Optional[str] = None, memory_items: int = 10000, dtype: str = "float32"):
+        self.memory = LRUCache(max_items=memory_items)
+        self.disk = _DiskTier(path, dtype=dtype) if path else None
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def get_many(self, model_name: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Return cached float32 vectors for `texts` (None where missing)."""
+        keys = [cache_key(model_name, t) for t in texts]
+        out: List[Optional[np.ndarray]] = [self.memory.get(k) for k in keys]
+        mem_hits = sum(v is not None for v in out)
+
+        disk_hits = 0
+        if self.disk is not None:
+            missing = [k for k, v in zip(keys, out) if v is None]
+            if missing:
+                with self._lock:
+                    found = self.disk.get(missing)
+                for i, k in enumerate(keys):
+                    if out[i] is None and k in found:
+                        out[i] = found[k]
+                        self.memory.put(k, found[k])
+                        disk_hits += 1
+
+        with self._lock:
+            self.hits_memory += mem_hits
+            self.hits_disk += disk_hits
+            self.misses += len(keys) - mem_hits - disk_hits
+            self.bytes_saved += sum(v.nbytes for v in out if v is not None)
+        return out
+
+    def put_many(self, model_name: str, texts: Sequence[str], vectors: Any) -> None:
+        """Store `vectors` (one row per text) in both tiers."""
+        if not len(texts):
+            return
+        arr = np.asarray(vectors, dtype=np.float32)
+        keys = [cache_key(model_name, t) for t in texts]
+        for k, row in zip(keys, arr):
+            self.memory.put(k, row.copy())
+        if self.disk is not None:
+            with self._lock:
+                self.disk.put(keys, arr)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.hits_memory + self.hits_disk
+            lookups = hits + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "memory_items": len(self.memory),
+                "disk_items": len(self.disk.offsets) if self.disk is not None else 0,
+                "disk_bytes": self.disk.disk_bytes() if self.disk is not None else 0,
+            }
+
+
+# a forked worker reopens the disk tier rather than sharing the parent's handles and row counts
+_default_cache = ProcessSingleton(
+    lambda: EmbeddingCache(
+        path=os.getenv("EMBEDDING_CACHE_DIR"),
+        memory_items=int(os.getenv("EMBEDDING_CACHE_SIZE") or 10000),
+        dtype=os.getenv("EMBEDDING_CACHE_DTYPE", "float32"),
+    )
+)
+
+
+def get_default_embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide cache, or None when caching is not configured.
+
+    - `EMBEDDING_CACHE_DIR` enables the persistent tier at that directory.
+    - `EMBEDDING_CACHE_SIZE` sets the memory tier size (enables a memory-only cache on its own).
+    - `EMBEDDING_CACHE_DTYPE` (`float32` or `float16`) sets the on-disk precision.
+    """
+    if not os.getenv("EMBEDDING_CACHE_DIR") and not os.getenv("EMBEDDING_CACHE_SIZE"):
+        return None
+    return _default_cache.get()
+
+
+__all__ = ["EmbeddingCache", "cache_key", "normalize_text", "get_default_embedding_cache"]
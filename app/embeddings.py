@@ -1,40 +1,299 @@
 import os
+import time
 import logging
-from typing import List, Optional
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 
-import torch
-from sentence_transformers import SentenceTransformer
+import numpy as np
+
+from app.embedding_cache import EmbeddingCache, get_default_embedding_cache
+from app.onnx_embeddings import load_onnx_embedding_model
+from app.telemetry import current_span, traced
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# torch dtype names; torch and sentence-transformers are only imported when a model is loaded
+_PRECISIONS = ("float32", "float16", "bfloat16")
+# served by the ONNX Runtime backend on CPU instead of PyTorch
+_ONNX_PRECISIONS = ("int8",)
+
+
+def _resolve_model_name(model_name: Optional[str] = None) -> str:
+    return model_name or os.getenv("HF_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+
+
+def _resolve_device(device: Optional[str] = None) -> str:
+    device = device or os.getenv("EMBEDDING_DEVICE")
+    if device:
+        return device
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
 
-def load_embedding_model(model_name: Optional[str] = None) -> SentenceTransformer:
+def _resolve_precision(precision: Optional[str] = None) -> str:
+    precision = (precision or os.getenv("EMBEDDING_PRECISION", "float32")).lower()
+    if precision not in _PRECISIONS and precision not in _ONNX_PRECISIONS:
+        expected = list(_PRECISIONS) + list(_ONNX_PRECISIONS)
+        raise ValueError(f"Unsupported embedding precision '{precision}'; expected one of {expected}")
+    return precision
+
+
+def load_embedding_model(
+    model_name: Optional[str] = None,
+    device: Optional[str] = None,
+    precision: Optional[str] = None,
+) -> "SentenceTransformer":
     """Load a HuggingFace / sentence-transformers model for embeddings.
 
     - Reads `HF_EMBEDDING_MODEL` env var if `model_name` is not provided.
-    - Uses GPU if available.
+    - Uses GPU if available (override with `device` or `EMBEDDING_DEVICE`).
+    - `precision` (or `EMBEDDING_PRECISION`) casts the weights to `float16`/`bfloat16`;
+      `int8` loads the quantized ONNX export instead (CPU only, see `app.onnx_embeddings`).
+
+    This always instantiates a new model; use `get_embedding_model` to share one.
     """
-    model_name = model_name or os.getenv("HF_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    logger.info("Loading embedding model '%s' on device %s", model_name, device)
+    model_name = _resolve_model_name(model_name)
+    precision = _resolve_precision(precision)
+    if precision in _ONNX_PRECISIONS:
+        logger.info("Loading embedding model '%s' with ONNX Runtime on cpu (%s)", model_name, precision)
+        return load_onnx_embedding_model(model_name)
+    device = _resolve_device(device)
+    logger.info("Loading embedding model '%s' on device %s (%s)", model_name, device, precision)
+    import torch
+    from sentence_transformers import SentenceTransformer
+
     model = SentenceTransformer(model_name, device=device)
+    if precision != "float32":
+        model = model.to(getattr(torch, precision))
+    # lets `embed_texts` key cached vectors by the model (and weight precision) that produced them
+    model.embedding_model_name = model_name if precision == "float32" else f"{model_name}@{precision}"
     return model
 
 
-def embed_texts(texts: List[str], model: Optional[SentenceTransformer] = None, batch_size: int = 32) -> List[List[float]]:
-    """Return embeddings for `texts` as a list of float vectors.
+def _model_memory_bytes(model: Any) -> int:
+    """Best-effort size of the model weights and buffers in bytes."""
+    # ONNX models report their graph size instead of exposing tensors
+    total = getattr(model, "model_bytes", 0)
+    total = total if isinstance(total, int) else 0
+    for attr in ("parameters", "buffers"):
+        tensors = getattr(model, attr, None)
+        if not callable(tensors):
+            continue
+        try:
+            total += sum(t.numel() * t.element_size() for t in tensors())
+        except Exception:
+            logger.debug("Could not size %s of embedding model", attr, exc_info=True)
+    return total
+
+
+@dataclass
+class LoadedModel:
+    """A model held by `EmbeddingModelRegistry` plus its load statistics."""
+
+    model: Any
+    model_name: str
+    device: str
+    precision: str
+    load_seconds: float
+    memory_bytes: int
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    uses: int = 0
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "model_name": self.model_name,
+            "device": self.device,
+            "precision": self.precision,
+            "load_seconds": self.load_seconds,
+            "memory_bytes": self.memory_bytes,
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "uses": self.uses,
+        }
 
-    - If `model` is not provided, the default HF model will be loaded.
-    - This uses `SentenceTransformer.encode` with batching and returns Python lists.
+
+RegistryKey = Tuple[str, str, str]
+
+
+class EmbeddingModelRegistry:
+    """Thread-safe cache of loaded embedding models.
+
+    One model is kept per `(model_name, device, precision)`. Concurrent callers
+    asking for the same key wait for a single load instead of each loading a
+    copy. Models unused for longer than `idle_ttl` seconds are evicted on the
+    next `get` or explicit `evict_idle` call.
     """
-    if not texts:
-        return []
 
-    if model is None:
-        model = load_embedding_model()
+    def __init__(
+        self,
+        loader: Optional[Callable[[str, str, str], Any]] = None,
+        idle_ttl: Optional[float] = None,
+    ):
+        self._loader = loader
+        self.idle_ttl = idle_ttl
+        self._models: Dict[RegistryKey, LoadedModel] = {}
+        self._key_locks: Dict[RegistryKey, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, model_name: str, device: str, precision: str) -> Any:
+        if self._loader is not None:
+            return self._loader(model_name, device, precision)
+        # resolved at call time so `load_embedding_model` can be patched in tests
+        return load_embedding_model(model_name, device=device, precision=precision)
+
+    @staticmethod
+    def key(
+        model_name: Optional[str] = None,
+        device: Optional[str] = None,
+        precision: Optional[str] = None,
+    ) -> RegistryKey:
+        precision = _resolve_precision(precision)
+        device = "cpu" if precision in _ONNX_PRECISIONS else _resolve_device(device)
+        return (_resolve_model_name(model_name), device, precision)
+
+    def get(
+        self,
+        model_name: Optional[str] = None,
+        device: Optional[str] = None,
+        precision: Optional[str] = None,
+    ) -> Any:
+        """Return the shared model for the given key, loading it on first use."""
+        key = self.key(model_name, device, precision)
+        if self.idle_ttl is not None:
+            self.evict_idle(exclude=key)
+
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                entry.last_used = time.time()
+                entry.uses += 1
+                return entry.model
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._models.get(key)
+            if entry is None:
+                start = time.perf_counter()
+                model = self._load(*key)
+                entry = LoadedModel(
+                    model=model,
+                    model_name=key[0],
+                    device=key[1],
+                    precision=key[2],
+                    load_seconds=time.perf_counter() - start,
+                    memory_bytes=_model_memory_bytes(model),
+                )
+                logger.info(
+                    "Embedding model '%s' ready on %s (%s) in %.2fs, %.1f MiB",
+                    key[0], key[1], key[2], entry.load_seconds, entry.memory_bytes / 2**20,
+                )
+                with self._lock:
+                    self._models[key] = entry
+
+        with self._lock:
+            entry.last_used = time.time()
+            entry.uses += 1
+        return entry.model
+
+    def warmup(
+        self,
+        model_names: Optional[List[str]] = None,
+        device: Optional[str] = None,
+        precision: Optional[str] = None,
+        encode: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """Eagerly load `model_names` (default: the configured model).
+
+        With `encode=True` a dummy sentence is embedded as well so lazy
+        initialisation inside the model (kernels, tokenizer caches) happens
+        before the first real request. Returns the `stats` of the warmed models.
+        """
+        names = model_names or [None]
+        keys = []
+        for name in names:
+            model = self.get(name, device=device, precision=precision)
+            if encode:
+                model.encode(["warmup"], show_progress_bar=False)
+            keys.append(self.key(name, device, precision))
+        with self._lock:
+            return [self._models[k].info() for k in keys if k in self._models]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return load time, memory and usage information for each loaded model."""
+        with self._lock:
+            return [entry.info() for entry in self._models.values()]
+
+    def evict_idle(
+        self,
+        max_idle_seconds: Optional[float] = None,
+        exclude: Optional[RegistryKey] = None,
+    ) -> List[RegistryKey]:
+        """Drop models unused for more than `max_idle_seconds` (default `idle_ttl`)."""
+        max_idle = self.idle_ttl if max_idle_seconds is None else max_idle_seconds
+        if max_idle is None:
+            return []
+        cutoff = time.time() - max_idle
+        with self._lock:
+            evicted = [k for k, e in self._models.items() if k != exclude and e.last_used < cutoff]
+            for k in evicted:
+                del self._models[k]
+        for k in evicted:
+            logger.info("Evicted idle embedding model '%s' on %s (%s)", *k)
+        if any(k[1].startswith("cuda") for k in evicted):
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return evicted
 
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+
+def _env_idle_ttl() -> Optional[float]:
+    value = os.getenv("EMBEDDING_MODEL_IDLE_TTL")
+    return float(value) if value else None
+
+
+_default_registry = EmbeddingModelRegistry(idle_ttl=_env_idle_ttl())
+
+
+def get_embedding_registry() -> EmbeddingModelRegistry:
+    """Return the process-wide registry used when no model is passed explicitly."""
+    return _default_registry
+
+
+def get_embedding_model(
+    model_name: Optional[str] = None,
+    device: Optional[str] = None,
+    precision: Optional[str] = None,
+) -> Any:
+    """Return the process-wide shared embedding model, loading it once."""
+    return _default_registry.get(model_name, device=device, precision=precision)
+
+
+def warmup_embedding_models(
+    model_names: Optional[List[str]] = None,
+    device: Optional[str] = None,
+    precision: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Load embedding models at startup so the first query does not pay for it."""
+    return _default_registry.warmup(model_names, device=device, precision=precision)
+
+
+def _encode(model: Any, texts: List[str], batch_size: int) -> Any:
     try:
-        embeddings = model.encode(
+        return model.encode(
             texts,
             batch_size=batch_size,
             show_progress_bar=False,
@@ -43,12 +302,111 @@ def embed_texts(texts: List[str], model: Optional[SentenceTransformer] = None, b
     except Exception:
         # Fallback: try without convert_to_numpy
         logger.exception("Embedding call failed with convert_to_numpy, retrying without it")
-        embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+        return model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+
+
+def _as_array(embeddings: Any) -> np.ndarray:
+    """Coerce encoder output (ndarray, tensor, list of rows) to a contiguous float32 matrix."""
+    if hasattr(embeddings, "detach"):
+        embeddings = embeddings.detach().cpu().numpy()
+    elif isinstance(embeddings, (list, tuple)) and embeddings and hasattr(embeddings[0], "detach"):
+        embeddings = [e.detach().cpu().numpy() for e in embeddings]
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization.
+
+    Returns `(codes, scales)` such that `codes * scales[:, None]` approximates
+    `embeddings`. Row directions are preserved, so cosine ranking works on the
+    codes alone.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
 
-    # Ensure return type is List[List[float]]
-    if hasattr(embeddings, "tolist"):
-        return embeddings.tolist()
-    return [list(map(float, e)) for e in embeddings]
+
+_OUTPUT_DTYPES = ("float32", "float16")
+
+
+@traced("embed_texts")
+def embed_texts_array(
+    texts: List[str],
+    model: Optional["SentenceTransformer"] = None,
+    batch_size: int = 32,
+    cache: Optional[EmbeddingCache] = None,
+    dtype: str = "float32",
+) -> np.ndarray:
+    """Return embeddings for `texts` as one contiguous `(len(texts), dim)` array.
+
+    - Same model and cache resolution as `embed_texts`, without building
+      Python lists of floats.
+    - `dtype` is `float32` (default) or `float16`. For int8 storage pass the
+      result to `quantize_int8`, which also returns the per-row scales.
+    """
+    if dtype not in _OUTPUT_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}'; expected one of {_OUTPUT_DTYPES}")
+    if not texts:
+        return np.empty((0, 0), dtype=dtype)
+
+    if model is None:
+        model = get_embedding_model()
+    if cache is None:
+        cache = get_default_embedding_cache()
+
+    current_span().set(texts=len(texts))
+    # a model without a registry identity is never cached: another model's vectors could come back
+    model_name = getattr(model, "embedding_model_name", None)
+    if cache is None or not model_name:
+        out = _as_array(_encode(model, texts, batch_size))
+    else:
+        cached = cache.get_many(model_name, texts)
+        # encode each distinct missing text once
+        missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        current_span().set(cache_hits=len(texts) - sum(v is None for v in cached), encoded=len(missing))
+        fresh = _as_array(_encode(model, missing, batch_size)) if missing else None
+        if fresh is not None:
+            cache.put_many(model_name, missing, fresh)
+        dim = fresh.shape[1] if fresh is not None else cached[0].shape[0]
+        out = np.empty((len(texts), dim), dtype=np.float32)
+        row_of = {t: i for i, t in enumerate(missing)}
+        for i, (t, v) in enumerate(zip(texts, cached)):
+            out[i] = fresh[row_of[t]] if v is None else v
+
+    if dtype == "float16":
+        return out.astype(np.float16)
+    return out
+
+
+def embed_texts(
+    texts: List[str],
+    model: Optional["SentenceTransformer"] = None,
+    batch_size: int = 32,
+    cache: Optional[EmbeddingCache] = None,
+) -> List[List[float]]:
+    """Return embeddings for `texts` as a list of float vectors.
+
+    - If `model` is not provided, the shared model from `get_embedding_model` is used.
+    - This uses `SentenceTransformer.encode` with batching and returns Python lists;
+      prefer `embed_texts_array` for large inputs.
+    - `cache` (default: `get_default_embedding_cache()`) serves previously embedded
+      texts and only the misses are encoded. Models without an
+      `embedding_model_name` (set by `load_embedding_model`) bypass the cache.
+    """
+    if not texts:
+        return []
+    return embed_texts_array(texts, model=model, batch_size=batch_size, cache=cache).tolist()
 
 
-__all__ = ["load_embedding_model", "embed_texts"]
+__all__ = [
+    "EmbeddingModelRegistry",
+    "load_embedding_model",
+    "get_embedding_registry",
+    "get_embedding_model",
+    "warmup_embedding_models",
+    "embed_texts",
+    "embed_texts_array",
+    "quantize_int8",
+]
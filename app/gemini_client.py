@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from app.async_utils import ProcessSingleton
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GEMINI_MODEL = "gemini-1.5-flash"
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+_RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class GeminiError(RuntimeError):
+    """A Gemini request failed and should not be retried."""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class RetryableGeminiError(GeminiError):
+    """Rate limit, overload or connection failure; `retry_after` is the server's hint in seconds."""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message, status)
+        self.retry_after = retry_after
+
+
+def _response_text(payload: Dict[str, Any]) -> str:
+    parts = []
+    for candidate in payload.get("candidates") or []:
+        for part in (candidate.get("content") or {}).get("parts") or []:
+            parts.append(part.get("text", ""))
+        break
+    return "".join(parts)
+
+
+class HTTPTransport:
+    """Gemini REST (`generateContent`) over one pooled `requests.Session`.
+
+    `base_url` (or `GEMINI_BASE_URL`) can point at a local fake server in tests.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        pool_size: int = 16,
+        timeout: float = 60.0,
+        session: Optional[Any] = None,
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._requests = requests
+        self.api_key = api_key
+        self.base_url = (base_url or os.getenv("GEMINI_BASE_URL", DEFAULT_BASE_URL)).rstrip("/")
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+    def _post(self, model: str, method: str, prompt: str, temperature: float, stream: bool = False):
+        url = f"{self.base_url}/models/{model}:{method}"
+        body = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": {"temperature": temperature}}
+        params = {"alt": "sse"} if stream else None
+        # the key goes in a header: requests puts the full URL into its exception messages
+        headers = {"x-goog-api-key": self.api_key}
+        try:
+            resp = self.session.post(url, params=params, headers=headers, json=body, timeout=self.timeout, stream=stream)
+        except (self._requests.ConnectionError, self._requests.Timeout) as exc:
+            raise RetryableGeminiError(f"Gemini request failed: {type(exc).__name__}") from exc
+        if resp.status_code in _RETRYABLE_STATUS:
+            retry_after = resp.headers.get("Retry-After")
+            resp.close()
+            raise RetryableGeminiError(
+                f"Gemini returned HTTP {resp.status_code}",
+                status=resp.status_code,
+                retry_after=float(retry_after) if retry_after and retry_after.replace(".", "", 1).isdigit() else None,
+            )
+        if resp.status_code >= 400:
+            raise GeminiError(f"Gemini returned HTTP {resp.status_code}: {resp.text[:500]}", status=resp.status_code)
+        return resp
+
+    def generate(self, model: str, prompt: str, temperature: float) -> str:
+        return _response_text(self._post(model, "generateContent", prompt, temperature).json())
+
+    def stream(self, model: str, prompt: str, temperature: float) -> Iterator[str]:
+        resp = self._post(model, "streamGenerateContent", prompt, temperature, stream=True)
+        with resp:
+            for line in resp.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:"):
+                    text = _response_text(json.loads(line[5:]))
+                    if text:
+                        yield text
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available; returns the time waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return waited
+                delay = (1.0 - self._tokens) / self.rate
+            self._sleep(delay)
+            waited += delay
+
+
+class GeminiClient:
+    """Long-lived Gemini client shared by every `call_gemini` in the process.
+
+    - `transport` does the actual request (default: pooled `HTTPTransport`);
+      anything with `generate(model, prompt, temperature)` and
+      `stream(model, prompt, temperature)` works, which is how tests fake it.
+    - `RetryableGeminiError` (429/5xx/connection errors) is retried up to
+      `max_retries` times with full-jitter exponential backoff, never sooner
+      than the server's `Retry-After`.
+    - At most `max_concurrency` requests are in flight, and when
+      `requests_per_second` is set a `TokenBucket` spaces them to the quota.
+    - Identical concurrent `generate` calls (same prompt and temperature) are
+      coalesced into a single upstream request.
+    - A `stream` holds its concurrency slot only until it ends, fails or is
+      closed, and is aborted once it has been open `stream_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: Optional[str] = None,
+        transport: Optional[Any] = None,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        max_concurrency: int = 8,
+        requests_per_second: Optional[float] = None,
+        burst: Optional[float] = None,
+        coalesce: bool = True,
+        stream_timeout: Optional[float] = 120.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if transport is None:
+            if not api_key:
+                raise EnvironmentError("GEMINI_API_KEY is not set. Set it or call with mock=True for testing.")
+            transport = HTTPTransport(api_key, pool_size=max_concurrency)
+        self.transport = transport
+        self.model = (model or DEFAULT_GEMINI_MODEL).split("/")[-1]
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.coalesce = coalesce
+        self.stream_timeout = stream_timeout
+        self._sleep = sleep
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._bucket = TokenBucket(requests_per_second, burst, sleep=sleep) if requests_per_second else None
+        self._lock = threading.Lock()
+        self._inflight: Dict[Tuple[str, float], Future] = {}
+        self._upstream_calls = 0
+        self._coalesced = 0
+        self._retries = 0
+
+    def _acquire_slot(self) -> None:
+        if self._bucket is not None:
+            self._bucket.acquire()
+        self._semaphore.acquire()
+        with self._lock:
+            self._upstream_calls += 1
+
+    @contextmanager
+    def _slot(self):
+        self._acquire_slot()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    def _backoff(self, attempt: int, error: RetryableGeminiError) -> None:
+        delay = random.uniform(0.0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        if error.retry_after:
+            delay = max(delay, error.retry_after)
+        with self._lock:
+            self._retries += 1
+        logger.warning("Gemini %s, retrying in %.2fs (attempt %d/%d)", error, delay, attempt + 1, self.max_retries)
+        self._sleep(delay)
+
+    def _generate_with_retries(self, prompt: str, temperature: float) -> str:
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._slot():
+                    return self.transport.generate(self.model, prompt, temperature)
+            except RetryableGeminiError as exc:
+                if attempt == self.max_retries:
+                    raise
+                self._backoff(attempt, exc)
+
+    def generate(self, prompt: str, temperature: float = 0.0) -> str:
+        """Return the completion for `prompt`, sharing it with identical in-flight calls."""
+        if not self.coalesce:
+            return self._generate_with_retries(prompt, temperature)
+        key = (prompt, temperature)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self._coalesced += 1
+        if not owner:
+            return future.result()
+        try:
+            result = self._generate_with_retries(prompt, temperature)
+            future.set_result(result)
+            return result
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stream(self, prompt: str, temperature: float = 0.0) -> Iterator[str]:
+        """Yield completion chunks; only failures before the first chunk are retried.
+
+        Close the iterator (or wrap it in `contextlib.closing`) when stopping
+        early: that releases the slot and the upstream connection at once.
+        """
+        for attempt in range(self.max_retries + 1):
+            started = False
+            deadline = time.monotonic() + self.stream_timeout if self.stream_timeout else None
+            self._acquire_slot()
+            chunks = None
+            try:
+                chunks = iter(self.transport.stream(self.model, prompt, temperature))
+                for chunk in chunks:
+                    # also covers time spent in a slow consumer between chunks
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise GeminiError(f"Gemini stream still open after {self.stream_timeout}s")
+                    started = True
+                    yield chunk
+                return
+            except RetryableGeminiError as exc:
+                if started or attempt == self.max_retries:
+                    raise
+                error = exc
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+                self._semaphore.release()
+            self._backoff(attempt, error)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "upstream_calls": self._upstream_calls,
+                "coalesced": self._coalesced,
+                "retries": self._retries,
+                "in_flight": len(self._inflight),
+            }
+
+
+def _client_from_env() -> GeminiClient:
+    rps = os.getenv("GEMINI_RPS")
+    return GeminiClient(
+        api_key=os.getenv("GEMINI_API_KEY"),
+        model=os.getenv("GEMINI_MODEL"),
+        max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+        max_retries=int(os.getenv("GEMINI_MAX_RETRIES", "4")),
+        requests_per_second=float(rps) if rps else None,
+        stream_timeout=float(os.getenv("GEMINI_STREAM_TIMEOUT", "120")),
+    )
+
+
+_default_client = ProcessSingleton(_client_from_env)
+
+
+def get_default_gemini_client() -> GeminiClient:
+    """Return the process-wide client configured from the environment.
+
+    - `GEMINI_API_KEY` (required), `GEMINI_MODEL` (defaults to `gemini-1.5-flash`)
+    - `GEMINI_MAX_CONCURRENCY` (defaults to `8`), `GEMINI_MAX_RETRIES` (defaults to `4`)
+    - `GEMINI_RPS` requests per second for the token bucket (unlimited if unset)
+    - `GEMINI_STREAM_TIMEOUT` seconds a stream may stay open (defaults to `120`)
+    """
+    return _default_client.get()
+
+
+__all__ = [
+    "GeminiClient",
+    "GeminiError",
+    "RetryableGeminiError",
+    "HTTPTransport",
+    "TokenBucket",
+    "get_default_gemini_client",
+]
@@ -0,0 +1,532 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from app.chunk_store import ChunkStore, get_default_chunk_store, without_text
+from app.embeddings import embed_texts_array, get_embedding_model
+from app.embedding_cache import EmbeddingCache
+from app.manifest import Manifest, chunk_ids, content_hash
+from app.rag.utils import chunk_text
+from app.vectorstore import bump_corpus_version, upsert_documents, upsert_embeddings
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = (".txt", ".md", ".rst", ".csv", ".json", ".html")
+
+_STOP = object()
+
+
+def _iter_files(paths: Iterable[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def load_documents(paths: Iterable[str], skip: Optional[Set[str]] = None) -> Iterator[Dict[str, Any]]:
+    """Lazily yield `{"source_id", "text", "metadata"}` units from files and directories.
+
+    PDFs (via pypdf) yield one unit per page with `source_id` `<path>#page=<n>`;
+    text files yield one unit per file. Units whose `source_id` is in `skip`
+    are not read, and other file types are ignored.
+    """
+    skip = skip or set()
+    for path in _iter_files(paths):
+        lower = path.lower()
+        if lower.endswith(".pdf"):
+            from pypdf import PdfReader
+
+            reader = PdfReader(path)
+            for page_no, page in enumerate(reader.pages, start=1):
+                source_id = f"{path}#page={page_no}"
+                if source_id in skip:
+                    continue
+                yield {
+                    "source_id": source_id,
+                    "text": page.extract_text() or "",
+                    "metadata": {"source": path, "page": page_no},
+                }
+        elif lower.endswith(TEXT_EXTENSIONS):
+            if path in skip:
+                continue
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                yield {"source_id": path, "text": f.read(), "metadata": {"source": path}}
+        else:
+            logger.debug("Skipping unsupported file %s", path)
+
+
+def _prepare_chunks(chunks: List[Dict], doc: Dict[str, Any]) -> List[Dict]:
+    """Give chunks their deterministic ids and the metadata stored with the vectors."""
+    for c, cid in zip(chunks, chunk_ids(chunks)):
+        c["id"] = cid
+        c["metadata"] = dict(doc.get("metadata") or {}, source_id=c["source_id"], position=c["position"])
+        for key in ("start", "end", "page"):
+            if key in c:
+                c["metadata"][key] = c[key]
+        c["metadata"]["text"] = c["text"]
+    return chunks
+
+
+class _StageStats:
+    def __init__(self):
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, seconds: float) -> None:
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    def report(self) -> Dict[str, float]:
+        return {
+            "items": self.items,
+            "busy_s": self.busy,
+            "per_second": self.items / self.busy if self.busy > 0 else 0.0,
+        }
+
+
+class IngestionPipeline:
+    """Load -> chunk -> embed -> upsert with bounded queues between the stages.
+
+    - Each stage runs in its own worker threads (`chunk_workers`,
+      `embed_workers`, `upsert_workers`), so embedding overlaps with uploads.
+    - Queues hold at most `queue_size` items; a slow stage blocks the ones
+      before it, so memory stays bounded however large the input is.
+    - With `checkpoint_path`, source units (files or PDF pages) whose chunks
+      are all upserted are appended to a JSON-lines checkpoint, and a rerun
+      skips those units. A unit is only checkpointed once it is durable: every
+      `checkpoint_every` finished units, and at the end of `run`, the index is
+      saved if it has a `save()` (e.g. `IVFPQIndex`) and `lexical_index` /
+      `token_features` are saved to `lexical_index_path` /
+      `token_features_path` before the checkpoint lines are written.
+    - `run` returns a throughput report with items and items/s per stage.
+
+    Chunk ids are deterministic (`chunk_ids`). The chunk text is written to
+    `chunk_store` (default `CHUNK_STORE_PATH`) when there is one, otherwise
+    it is stored in the vector metadata so retrieval can return it.
+    """
+
+    def __init__(
+        self,
+        index,
+        model: Optional[object] = None,
+        chunk_size: int = 500,
+        overlap: int = 50,
+        embed_batch_size: int = 64,
+        upsert_batch_size: int = 100,
+        chunk_workers: int = 2,
+        embed_workers: int = 1,
+        upsert_workers: int = 2,
+        queue_size: int = 8,
+        checkpoint_path: Optional[str] = None,
+        cache: Optional[EmbeddingCache] = None,
+        lexical_index=None,
+        token_features=None,
+        chunk_store: Optional[ChunkStore] = None,
+        chunker: Callable[..., List[Dict]] = chunk_text,
+        checkpoint_every: int = 500,
+        lexical_index_path: Optional[str] = None,
+        token_features_path: Optional[str] = None,
+    ):
+        if checkpoint_path:
+            # a resumed run skips checkpointed sources, so whatever holds them must outlive this process
+            if lexical_index is not None and not lexical_index_path:
+                raise ValueError("checkpoint_path with a lexical_index needs lexical_index_path to save it to")
+            if token_features is not None and not token_features_path:
+                raise ValueError("checkpoint_path with token_features needs token_features_path to save them to")
+            if callable(getattr(index, "save", None)) and not getattr(index, "path", None):
+                raise ValueError("checkpoint_path with an in-memory index: give the index a path to save to")
+        self.index = index
+        self.model = model
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.workers = {"chunk": chunk_workers, "embed": embed_workers, "upsert": upsert_workers}
+        self.queue_size = queue_size
+        self.checkpoint_path = checkpoint_path
+        self.cache = cache
+        self.lexical_index = lexical_index
+        self.token_features = token_features
+        self.chunk_store = chunk_store if chunk_store is not None else get_default_chunk_store()
+        self.chunker = chunker
+        self.checkpoint_every = checkpoint_every
+        self.lexical_index_path = lexical_index_path
+        self.token_features_path = token_features_path
+
+    # -- checkpoint -------------------------------------------------------------
+
+    def completed_sources(self) -> Set[str]:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return set()
+        done = set()
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["source_id"])
+                except (ValueError, KeyError):
+                    # a torn last line from a crash: that source is simply redone
+                    continue
+        return done
+
+    def _mark_done(self, finished: List[tuple]) -> None:
+        if self._checkpoint is None:
+            return
+        with self._pending_lock:
+            self._unsaved.extend(finished)
+            due = len(self._unsaved) >= self.checkpoint_every
+        if due:
+            self._save_checkpoint()
+
+    def _persist(self) -> None:
+        """Save the stores that only live in memory until saved."""
+        if callable(getattr(self.index, "save", None)):
+            self.index.save()
+        if self.lexical_index is not None:
+            self.lexical_index.save(self.lexical_index_path)
+        if self.token_features is not None:
+            self.token_features.save(self.token_features_path)
+
+    def _save_checkpoint(self) -> None:
+        # sources are taken before persisting, so all of their writes are in what gets saved
+        with self._checkpoint_lock:
+            with self._pending_lock:
+                finished, self._unsaved = self._unsaved, []
+            if not finished:
+                return
+            self._persist()
+            for source_id, chunks in finished:
+                self._checkpoint.write(json.dumps({"source_id": source_id, "chunks": chunks}) + "\n")
+            self._checkpoint.flush()
+
+    # -- queue helpers ----------------------------------------------------------
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue) -> Any:
+        while not self._abort.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _STOP
+
+    def _finish(self, stage: str, downstream: Optional[queue.Queue], consumers: int) -> None:
+        # the last worker of a stage tells every worker of the next stage to stop
+        with self._finish_lock:
+            self._remaining[stage] -= 1
+            last = self._remaining[stage] == 0
+        if last and downstream is not None:
+            for _ in range(consumers):
+                self._put(downstream, _STOP)
+
+    def _guard(self, stage: str, fn: Callable[[], None], downstream: Optional[queue.Queue], consumers: int):
+        def run():
+            try:
+                fn()
+            except BaseException as exc:
+                logger.exception("Ingestion stage '%s' failed", stage)
+                self._errors.append(exc)
+                self._abort.set()
+            finally:
+                self._finish(stage, downstream, consumers)
+
+        return run
+
+    # -- stages -----------------------------------------------------------------
+
+    def _load(self, paths: Iterable[str], skip: Set[str]) -> None:
+        docs = iter(load_documents(paths, skip=skip))
+        while True:
+            start = time.perf_counter()
+            doc = next(docs, None)
+            if doc is None:
+                return
+            self._stats["load"].add(1, time.perf_counter() - start)
+            if not self._put(self._docs, doc):
+                return
+
+    def _chunk(self) -> None:
+        batch: List[Dict] = []
+        while True:
+            doc = self._get(self._docs)
+            if doc is _STOP:
+                break
+            start = time.perf_counter()
+            chunks = self.chunker(
+                doc["text"], chunk_size=self.chunk_size, overlap=self.overlap, source_id=doc["source_id"]
+            )
+            _prepare_chunks(chunks, doc)
+            self._stats["chunk"].add(len(chunks), time.perf_counter() - start)
+            with self._pending_lock:
+                self._sources_seen += 1
+                if chunks:
+                    # [chunks not yet upserted, total chunks]
+                    self._pending[doc["source_id"]] = [len(chunks), len(chunks)]
+                else:
+                    self._sources_done += 1
+            if not chunks:
+                self._mark_done([(doc["source_id"], 0)])
+            for c in chunks:
+                batch.append(c)
+                if len(batch) >= self.embed_batch_size:
+                    if not self._put(self._chunks, batch):
+                        return
+                    batch = []
+        if batch:
+            self._put(self._chunks, batch)
+
+    def _embed(self) -> None:
+        while True:
+            batch = self._get(self._chunks)
+            if batch is _STOP:
+                return
+            start = time.perf_counter()
+            vectors = embed_texts_array([c["text"] for c in batch], model=self._model, cache=self.cache)
+            self._stats["embed"].add(len(batch), time.perf_counter() - start)
+            if not self._put(self._vectors, (batch, vectors)):
+                return
+
+    def _upsert(self) -> None:
+        while True:
+            item = self._get(self._vectors)
+            if item is _STOP:
+                return
+            batch, vectors = item
+            start = time.perf_counter()
+            ids = [c["id"] for c in batch]
+            metadatas = [c["metadata"] for c in batch]
+            if self.chunk_store is not None:
+                self.chunk_store.add_documents(batch, ids=ids)
+                metadatas = [without_text(m) for m in metadatas]
+            upsert_embeddings(self.index, ids, vectors, metadatas, batch_size=self.upsert_batch_size)
+            if self.lexical_index is not None:
+                self.lexical_index.add_documents(batch, ids=ids)
+            if self.token_features is not None:
+                self.token_features.add_documents(batch, ids=ids)
+            self._stats["upsert"].add(len(batch), time.perf_counter() - start)
+
+            finished = []
+            with self._pending_lock:
+                for c in batch:
+                    counts = self._pending[c["source_id"]]
+                    counts[0] -= 1
+                    if counts[0] == 0:
+                        del self._pending[c["source_id"]]
+                        finished.append((c["source_id"], counts[1]))
+                        self._sources_done += 1
+            if finished:
+                self._mark_done(finished)
+
+    # -- driver -----------------------------------------------------------------
+
+    def run(self, paths: Iterable[str]) -> Dict[str, Any]:
+        """Ingest `paths` (files or directories); returns the throughput report."""
+        if isinstance(paths, str):
+            paths = [paths]
+        started = time.perf_counter()
+        self._model = self.model or get_embedding_model()
+        self._docs: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._chunks: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._vectors: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._abort = threading.Event()
+        self._errors: List[BaseException] = []
+        self._stats = {stage: _StageStats() for stage in ("load", "chunk", "embed", "upsert")}
+        self._pending: Dict[str, List[int]] = {}
+        self._pending_lock = threading.Lock()
+        self._finish_lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._unsaved: List[tuple] = []
+        self._sources_seen = 0
+        self._sources_done = 0
+
+        skip = self.completed_sources()
+        self._checkpoint = open(self.checkpoint_path, "a", encoding="utf-8") if self.checkpoint_path else None
+        self._remaining = {"load": 1, **self.workers}
+        plan = [
+            ("load", lambda: self._load(paths, skip), 1, self._docs, "chunk"),
+            ("chunk", self._chunk, self.workers["chunk"], self._chunks, "embed"),
+            ("embed", self._embed, self.workers["embed"], self._vectors, "upsert"),
+            ("upsert", self._upsert, self.workers["upsert"], None, None),
+        ]
+        threads = []
+        for stage, fn, count, downstream, next_stage in plan:
+            consumers = self.workers[next_stage] if next_stage else 0
+            for n in range(count):
+                t = threading.Thread(
+                    target=self._guard(stage, fn, downstream, consumers), name=f"ingest-{stage}-{n}", daemon=True
+                )
+                t.start()
+                threads.append(t)
+        try:
+            for t in threads:
+                t.join()
+            if self._checkpoint is not None:
+                self._save_checkpoint()
+        finally:
+            if self._checkpoint is not None:
+                self._checkpoint.close()
+
+        if self._stats["upsert"].items:
+            bump_corpus_version()
+        if self._errors:
+            raise self._errors[0]
+
+        elapsed = time.perf_counter() - started
+        chunks = self._stats["upsert"].items
+        return {
+            "sources": self._sources_seen,
+            "sources_completed": self._sources_done,
+            "sources_skipped": len(skip),
+            "chunks": chunks,
+            "elapsed_s": elapsed,
+            "chunks_per_second": chunks / elapsed if elapsed > 0 else 0.0,
+            "stages": {stage: stats.report() for stage, stats in self._stats.items()},
+        }
+
+
+def sync_documents(
+    sources: Iterable[Dict[str, Any]],
+    index,
+    manifest: Manifest,
+    model: Optional[object] = None,
+    chunk_size: int = 500,
+    overlap: int = 50,
+    batch_size: int = 256,
+    delete_batch_size: int = 1000,
+    cache: Optional[EmbeddingCache] = None,
+    lexical_index=None,
+    token_features=None,
+    chunk_store: Optional[ChunkStore] = None,
+    prune: bool = True,
+    chunker: Callable[..., List[Dict]] = chunk_text,
+) -> Dict[str, int]:
+    """Bring `index` in line with `sources`, writing only the delta.
+
+    - `sources` are `{"source_id", "text", "metadata"}` units (e.g. from
+      `load_documents`). A unit whose content hash (with the chunking
+      parameters) matches `manifest` is skipped without chunking or embedding.
+    - For changed units only chunks with new ids are embedded and upserted, and
+      chunk ids that disappeared are deleted.
+    - With `prune=True`, sources in the manifest but not in `sources` are
+      treated as removed, so pass the whole corpus.
+    - `chunk_store` (default `CHUNK_STORE_PATH`) holds the chunk text instead of
+      the index metadata; deleted chunks are removed from it too.
+    - Manifest entries are only updated after their writes succeed, and the
+      manifest is saved even if the sync fails part way; rerunning resumes.
+    """
+    model = model or get_embedding_model()
+    if chunk_store is None:
+        chunk_store = get_default_chunk_store()
+    report = {
+        "sources_added": 0,
+        "sources_changed": 0,
+        "sources_unchanged": 0,
+        "sources_removed": 0,
+        "chunks_upserted": 0,
+        "chunks_deleted": 0,
+        "chunks_kept": 0,
+    }
+    to_upsert: List[Dict] = []
+    to_delete: List[str] = []
+    committed: List[tuple] = []
+
+    def flush() -> None:
+        if to_upsert:
+            upsert_documents(
+                to_upsert,
+                index,
+                model=model,
+                cache=cache,
+                lexical_index=lexical_index,
+                token_features=token_features,
+                chunk_store=chunk_store,
+            )
+            report["chunks_upserted"] += len(to_upsert)
+            to_upsert.clear()
+        if to_delete:
+            for i in range(0, len(to_delete), delete_batch_size):
+                index.delete(ids=to_delete[i : i + delete_batch_size])
+            if lexical_index is not None:
+                lexical_index.delete(to_delete)
+            if token_features is not None:
+                token_features.delete(to_delete)
+            if chunk_store is not None:
+                chunk_store.delete(to_delete)
+            report["chunks_deleted"] += len(to_delete)
+            to_delete.clear()
+            bump_corpus_version()
+        for source_id, entry in committed:
+            if entry is None:
+                manifest.remove(source_id)
+            else:
+                manifest.set(source_id, *entry)
+        committed.clear()
+
+    seen: Set[str] = set()
+    try:
+        for src in sources:
+            source_id = src["source_id"]
+            seen.add(source_id)
+            doc_hash = content_hash(f"{chunk_size}:{overlap}:{src['text']}")
+            entry = manifest.get(source_id)
+            if entry is not None and entry["hash"] == doc_hash:
+                report["sources_unchanged"] += 1
+                continue
+            report["sources_changed" if entry is not None else "sources_added"] += 1
+
+            chunks = _prepare_chunks(
+                chunker(src["text"], chunk_size=chunk_size, overlap=overlap, source_id=source_id), src
+            )
+            new_ids = [c["id"] for c in chunks]
+            old_ids = set(entry["chunks"]) if entry is not None else set()
+            fresh = [c for c in chunks if c["id"] not in old_ids]
+            to_upsert.extend(fresh)
+            to_delete.extend(old_ids.difference(new_ids))
+            report["chunks_kept"] += len(chunks) - len(fresh)
+            committed.append((source_id, (doc_hash, new_ids)))
+            if len(to_upsert) >= batch_size or len(to_delete) >= delete_batch_size:
+                flush()
+
+        if prune:
+            for source_id in manifest.sources():
+                if source_id not in seen:
+                    to_delete.extend(manifest.get(source_id)["chunks"])
+                    committed.append((source_id, None))
+                    report["sources_removed"] += 1
+        flush()
+    finally:
+        if manifest.path:
+            manifest.save()
+    return report
+
+
+def sync_paths(paths: Iterable[str], index, manifest_path: str, **kwargs) -> Dict[str, int]:
+    """`sync_documents` over the files under `paths`, with the manifest at `manifest_path`."""
+    if isinstance(paths, str):
+        paths = [paths]
+    return sync_documents(load_documents(paths), index, Manifest(manifest_path), **kwargs)
+
+
+def ingest_paths(paths: Iterable[str], index, **kwargs) -> Dict[str, Any]:
+    """Convenience wrapper: `IngestionPipeline(index, **kwargs).run(paths)`."""
+    return IngestionPipeline(index, **kwargs).run(paths)
+
+
+__all__ = ["IngestionPipeline", "ingest_paths", "load_documents", "sync_documents", "sync_paths"]
@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import math
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from app.chunk_store import without_text
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased `\\w+` tokens; the same tokenization the lexical reranker uses."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _encode_varints(values: Iterable[int]) -> bytes:
+    out = bytearray()
+    for v in values:
+        while v >= 0x80:
+            out.append((v & 0x7F) | 0x80)
+            v >>= 7
+        out.append(v)
+    return bytes(out)
+
+
+def decode_varints(buf: bytes) -> np.ndarray:
+    """Vectorised LEB128 decode of a concatenation of unsigned varints."""
+    b = np.frombuffer(buf, dtype=np.uint8)
+    if not b.size:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(b < 0x80)
+    group = np.zeros(b.size, dtype=np.int64)
+    group[ends[:-1] + 1] = 1
+    group = np.cumsum(group)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shift = 7 * (np.arange(b.size) - starts[group])
+    parts = (b & 0x7F).astype(np.int64) << shift
+    return np.bincount(group, weights=parts, minlength=ends.size).astype(np.int64)
+
+
+class BM25Index:
+    """In-memory inverted index with varint-compressed postings and BM25 scoring.
+
+    - Each term's postings are `(doc gap, term frequency)` pairs stored as
+      LEB128 varints in one byte string and decoded with NumPy at query time.
+    - `add_documents` takes the same dicts as `upsert_documents` (`id`, `text`,
+      `metadata`); chunk dicts from `chunk_text` work too (`source_id:position`
+      becomes the id).
+    - Only ids and the non-text metadata fields are kept; the text of a match
+      comes from the `ChunkStore` (`hydrate` in `retrieve_documents`).
+    - Deleted or overwritten documents are tombstoned and excluded from results.
+    - `search` returns a Pinecone-style `{"matches": [...]}` response so it can be
+      fused with dense results in `retrieve_documents`.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings: Dict[str, bytearray] = {}
+        self._df: Dict[str, int] = {}
+        self._last_doc: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._lengths: List[int] = []
+        self._doc_of: Dict[str, int] = {}
+        self._total_len = 0
+        # (lengths, live mask) as arrays, rebuilt lazily after mutations
+        self._arrays: Optional[tuple] = None
+
+    def __len__(self) -> int:
+        return len(self._doc_of)
+
+    @staticmethod
+    def _doc_id(doc: Dict[str, Any]) -> str:
+        if doc.get("id"):
+            return str(doc["id"])
+        return f"{doc.get('source_id', '')}:{doc.get('position', 0)}"
+
+    def add_documents(self, docs: Iterable[Dict[str, Any]], ids: Optional[Sequence[str]] = None) -> List[str]:
+        """Index `docs`; `ids` overrides the ids derived from the dicts."""
+        added = []
+        with self._lock:
+            self._arrays = None
+            for i, doc in enumerate(docs):
+                vid = ids[i] if ids is not None else self._doc_id(doc)
+                text = doc.get("text", "")
+                self._remove(vid)
+
+                docnum = len(self._ids)
+                counts: Dict[str, int] = {}
+                tokens = tokenize(text)
+                for tok in tokens:
+                    counts[tok] = counts.get(tok, 0) + 1
+                for term, tf in counts.items():
+                    gap = docnum - self._last_doc.get(term, 0)
+                    self._postings.setdefault(term, bytearray()).extend(_encode_varints((gap, tf)))
+                    self._last_doc[term] = docnum
+                    self._df[term] = self._df.get(term, 0) + 1
+
+                self._ids.append(vid)
+                self._metadata.append(without_text(doc.get("metadata")))
+                self._lengths.append(len(tokens))
+                self._doc_of[vid] = docnum
+                self._total_len += len(tokens)
+                added.append(vid)
+        return added
+
+    def _remove(self, vid: str) -> bool:
+        docnum = self._doc_of.pop(vid, None)
+        if docnum is None:
+            return False
+        self._ids[docnum] = None
+        self._metadata[docnum] = {}
+        self._total_len -= self._lengths[docnum]
+        self._arrays = None
+        return True
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """Tombstone `ids`; returns how many were present."""
+        with self._lock:
+            return sum(self._remove(vid) for vid in ids)
+
+    def _term_postings(self, term: str):
+        data = decode_varints(bytes(self._postings[term]))
+        return np.cumsum(data[0::2]), data[1::2]
+
+    def search(self, query: str, top_k: int = 10) -> Dict[str, Any]:
+        """Score documents for `query` with BM25 and return the best `top_k`."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            n_live = len(self._doc_of)
+            if not n_live or not terms:
+                return {"matches": []}
+            if self._arrays is None:
+                self._arrays = (
+                    np.asarray(self._lengths, dtype=np.float32),
+                    np.fromiter((vid is not None for vid in self._ids), dtype=bool, count=len(self._ids)),
+                )
+            lengths, live = self._arrays
+            avgdl = max(self._total_len / n_live, 1e-9)
+            norm = self.k1 * (1.0 - self.b + self.b * lengths / avgdl)
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            for term in terms:
+                if term not in self._postings:
+                    continue
+                docs, tfs = self._term_postings(term)
+                # df still counts tombstoned documents; clamp so idf stays positive
+                df = min(self._df[term], n_live)
+                idf = math.log(1.0 + (n_live - df + 0.5) / (df + 0.5))
+                scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm[docs])
+
+            scores[~live] = 0.0
+            candidates = np.flatnonzero(scores > 0)
+            if candidates.size > top_k:
+                candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return {
+                "matches": [
+                    {"id": self._ids[d], "score": float(scores[d]), "metadata": dict(self._metadata[d])}
+                    for d in candidates
+                ]
+            }
+
+    # -- persistence ------------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """Write postings, lexicon and document table under directory `path`."""
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            lexicon = {}
+            offset = 0
+            with open(os.path.join(path, "postings.bin"), "wb") as f:
+                for term, buf in self._postings.items():
+                    f.write(buf)
+                    lexicon[term] = [offset, len(buf), self._df[term], self._last_doc[term]]
+                    offset += len(buf)
+            with open(os.path.join(path, "lexicon.json"), "w", encoding="utf-8") as f:
+                json.dump({"k1": self.k1, "b": self.b, "terms": lexicon}, f)
+            with open(os.path.join(path, "docs.jsonl"), "w", encoding="utf-8") as f:
+                for vid, length, meta in zip(self._ids, self._lengths, self._metadata):
+                    f.write(json.dumps({"id": vid, "len": length, "metadata": meta}) + "\n")
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(os.path.join(path, "lexicon.json"), "r", encoding="utf-8") as f:
+            lexicon = json.load(f)
+        index = cls(k1=lexicon["k1"], b=lexicon["b"])
+        with open(os.path.join(path, "postings.bin"), "rb") as f:
+            blob = f.read()
+        for term, (offset, length, df, last) in lexicon["terms"].items():
+            index._postings[term] = bytearray(blob[offset : offset + length])
+            index._df[term] = df
+            index._last_doc[term] = last
+        with open(os.path.join(path, "docs.jsonl"), "r", encoding="utf-8") as f:
+            for docnum, line in enumerate(f):
+                rec = json.loads(line)
+                index._ids.append(rec["id"])
+                index._lengths.append(rec["len"])
+                index._metadata.append(without_text(rec["metadata"]))
+                if rec["id"] is not None:
+                    index._doc_of[rec["id"]] = docnum
+                    index._total_len += rec["len"]
+        return index
+
+
+__all__ = ["BM25Index", "tokenize", "decode_varints"]
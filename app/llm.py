@@ -1,42 +1,60 @@
-import os
+import re
 import logging
-from typing import Optional
+from typing import AsyncIterator, Iterator, Union
+
+from app.async_utils import iterate_blocking, run_blocking
+from app.gemini_client import get_default_gemini_client
+from app.telemetry import current_span, traced
 
 logger = logging.getLogger(__name__)
 
 
-def call_gemini(prompt: str, temperature: float = 0.0, stream: bool = False, mock: bool = False) -> str:
+_MOCK_RESPONSE = "MOCK_RESPONSE: This is a mocked Gemini answer.\nSources: [Source: mock-doc-1]"
+
+
+def _mock_chunks(text: str) -> Iterator[str]:
+    # split after each whitespace run so the chunks join back to `text`
+    yield from (chunk for chunk in re.split(r"(?<=\s)(?=\S)", text) if chunk)
+
+
+@traced("call_gemini")
+def call_gemini(
+    prompt: str, temperature: float = 0.0, stream: bool = False, mock: bool = False
+) -> Union[str, Iterator[str]]:
     """Call Gemini (Google) generative model.
 
     - If `mock=True`, returns a canned response useful for tests.
-    - Otherwise attempts to use `google.generativeai` (official SDK). If not
-      available or `GEMINI_API_KEY` missing, raises an informative error.
+    - Otherwise the request goes through the process-wide `GeminiClient`
+      (pooled connections, retries with backoff, quota limiting, coalescing of
+      identical concurrent prompts). Raises if `GEMINI_API_KEY` is missing.
+    - With `stream=True` an iterator of text chunks is returned instead; the
+      mock response is streamed word by word.
     """
+    current_span().set(prompt_chars=len(prompt), stream=stream)
     if mock:
-        return (
-            "MOCK_RESPONSE: This is a mocked Gemini answer.\nSources: [Source: mock-doc-1]"
-        )
+        return _mock_chunks(_MOCK_RESPONSE) if stream else _MOCK_RESPONSE
+
+    client = get_default_gemini_client()
+    if stream:
+        return client.stream(prompt, temperature=temperature)
+    return client.generate(prompt, temperature=temperature)
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise EnvironmentError("GEMINI_API_KEY is not set. Set it or call with mock=True for testing.")
 
-    # Prefer official google generative ai package if present
+async def call_gemini_async(prompt: str, temperature: float = 0.0, mock: bool = False) -> str:
+    """Awaitable `call_gemini`; the blocking request runs on the shared executor."""
+    if mock:
+        return call_gemini(prompt, temperature=temperature, mock=True)
+    return await run_blocking(call_gemini, prompt, temperature=temperature)
+
+
+async def stream_gemini_async(prompt: str, temperature: float = 0.0, mock: bool = False) -> AsyncIterator[str]:
+    """Async iterator over `call_gemini(stream=True)` chunks; the stream is read on the executor."""
+    chunks = iterate_blocking(call_gemini(prompt, temperature=temperature, stream=True, mock=mock))
     try:
-        import google.generativeai as genai  # type: ignore
-
-        genai.configure(api_key=api_key)
-        # use a reasonable default model name; users can change via env if desired
-        model = os.getenv("GEMINI_MODEL", "models/text-bison-001")
-        resp = genai.generate_text(model=model, input=prompt)
-        # resp may be a complex object; try to extract text
-        if hasattr(resp, "text"):
-            return resp.text
-        # fallback: string representation
-        return str(resp)
-    except Exception:
-        logger.exception("Failed to call google.generativeai; ensure it's installed and GEMINI_API_KEY is set")
-        raise
-
-
-__all__ = ["call_gemini"]
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+
+__all__ = ["call_gemini", "call_gemini_async", "stream_gemini_async"]
@@ -0,0 +1,377 @@
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("cosine", "dotproduct", "euclidean")
+_METRIC_ALIASES = {"dot": "dotproduct", "dot_product": "dotproduct", "l2": "euclidean"}
+
+
+def normalize_metric(metric: str) -> str:
+    metric = _METRIC_ALIASES.get(metric.lower(), metric.lower())
+    if metric not in METRICS:
+        raise ValueError(f"Unsupported metric '{metric}'; expected one of {METRICS}")
+    return metric
+
+
+def parse_upsert_vectors(vectors: Iterable[Any]):
+    """Yield `(id, values, metadata)` from Pinecone-style tuples or dicts."""
+    for v in vectors:
+        if isinstance(v, dict):
+            yield v["id"], v["values"], v.get("metadata") or {}
+        elif len(v) == 3:
+            yield v[0], v[1], v[2] or {}
+        else:
+            yield v[0], v[1], {}
+
+
+def matches_filter(metadata: Dict[str, Any], flt: Optional[Dict[str, Any]]) -> bool:
+    """Subset of Pinecone metadata filters: equality, `$eq`, `$ne`, `$in`, `$nin`."""
+    if not flt:
+        return True
+    for field, cond in flt.items():
+        value = metadata.get(field)
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, arg in cond.items():
+            if op == "$eq" and value != arg:
+                return False
+            if op == "$ne" and value == arg:
+                return False
+            if op == "$in" and value not in arg:
+                return False
+            if op == "$nin" and value in arg:
+                return False
+    return True
+
+
+def top_k_rows(scores: np.ndarray, k: int, largest: bool = True) -> np.ndarray:
+    """Indices of the `k` best entries of each row of `scores`, best first."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    keyed = -scores if largest else scores
+    if k < n:
+        part = np.argpartition(keyed, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), (scores.shape[0], n))
+    order = np.take_along_axis(keyed, part, axis=1).argsort(axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+class LocalIndex:
+    """In-process vector index implementing the parts of `pinecone.Index` we use.
+
+    - `upsert(vectors=...)`, `query(vector=..., top_k=..., include_metadata=...)`,
+      `delete(ids=...)` and `describe_index_stats()` follow the Pinecone client.
+    - `query_batch` scores many queries with one matrix product.
+    - `metric` is `cosine`, `dotproduct` or `euclidean` (scores are squared
+      distances, smallest first, like Pinecone).
+    - With `path`, vectors live in an append-only float32 file read through
+      `np.memmap`; ids and metadata go to an append-only operation log. Deletes
+      and overwrites leave tombstones until `compact()` is called.
+    """
+
+    accepts_numpy = True
+
+    def __init__(self, path: Optional[str] = None, dimension: Optional[int] = None, metric: str = "cosine"):
+        self.path = path
+        self.metric = normalize_metric(metric)
+        self.dimension = dimension
+        self._lock = threading.RLock()
+        self._row_of: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._valid = np.zeros(0, dtype=bool)
+        self._matrix = np.zeros((0, dimension or 0), dtype=np.float32)
+        self._buffer: Optional[np.ndarray] = None
+        self._rows = 0
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    # -- persistence -----------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _write_meta(self) -> None:
+        with open(self._file("meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dimension": self.dimension, "metric": self.metric}, f)
+
+    def _load(self) -> None:
+        meta_path = self._file("meta.json")
+        if not os.path.exists(meta_path):
+            if self.dimension:
+                self._write_meta()
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if normalize_metric(meta["metric"]) != self.metric:
+            raise ValueError(f"Index at {self.path} uses metric '{meta['metric']}', not '{self.metric}'")
+        self.dimension = int(meta["dimension"])
+
+        row_bytes = self.dimension * 4
+        size = os.path.getsize(self._file("vectors.f32")) if os.path.exists(self._file("vectors.f32")) else 0
+        file_rows = size // row_bytes
+        if size != file_rows * row_bytes:
+            # drop a torn trailing row so later appends stay aligned
+            with open(self._file("vectors.f32"), "r+b") as f:
+                f.truncate(file_rows * row_bytes)
+
+        if os.path.exists(self._file("log.jsonl")):
+            with open(self._file("log.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # torn final line from an interrupted write
+                        continue
+                    if op["op"] == "upsert" and op["row"] < file_rows:
+                        self._record_upsert(op["id"], op["row"], op.get("metadata") or {})
+                    elif op["op"] == "delete":
+                        self._record_delete(op["id"])
+        # rows written without a log line (crash between the two writes) stay unreferenced
+        self._rows = file_rows
+        self._pad(file_rows)
+        self._remap()
+
+    def _remap(self) -> None:
+        if self._rows:
+            self._matrix = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(self._rows, self.dimension))
+        else:
+            self._matrix = np.zeros((0, self.dimension or 0), dtype=np.float32)
+        self._sq_norms = self._row_norms(self._matrix) if self.metric == "euclidean" else self._sq_norms
+
+    @staticmethod
+    def _row_norms(matrix: np.ndarray, block: int = 65536) -> np.ndarray:
+        out = np.empty(matrix.shape[0], dtype=np.float32)
+        for i in range(0, matrix.shape[0], block):
+            m = np.asarray(matrix[i : i + block])
+            out[i : i + block] = np.einsum("ij,ij->i", m, m)
+        return out
+
+    def _append_log(self, ops: List[Dict[str, Any]]) -> None:
+        with open(self._file("log.jsonl"), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(op) + "\n" for op in ops))
+
+    # -- bookkeeping -------------------------------------------------------
+
+    def _pad(self, rows: int) -> None:
+        """Make room for `rows` rows in the id, metadata and validity tables."""
+        if len(self._ids) < rows:
+            extra = rows - len(self._ids)
+            self._ids.extend([None] * extra)
+            self._metadata.extend({} for _ in range(extra))
+        if self._valid.shape[0] < rows:
+            grown = np.zeros(max(rows, 2 * self._valid.shape[0]), dtype=bool)
+            grown[: self._valid.shape[0]] = self._valid
+            self._valid = grown
+
+    def _record_upsert(self, vid: str, row: int, metadata: Dict[str, Any]) -> None:
+        old = self._row_of.get(vid)
+        if old is not None:
+            self._valid[old] = False
+            self._ids[old] = None
+            self._metadata[old] = {}
+        self._pad(row + 1)
+        self._ids[row] = vid
+        self._metadata[row] = metadata
+        self._valid[row] = True
+        self._row_of[vid] = row
+
+    def _record_delete(self, vid: str) -> bool:
+        row = self._row_of.pop(vid, None)
+        if row is None:
+            return False
+        self._valid[row] = False
+        self._ids[row] = None
+        self._metadata[row] = {}
+        return True
+
+    def _prepare(self, values: np.ndarray) -> np.ndarray:
+        values = np.ascontiguousarray(values, dtype=np.float32)
+        if values.ndim == 1:
+            values = values[None, :]
+        if self.dimension is None:
+            self.dimension = values.shape[1]
+            if self.path:
+                self._write_meta()
+        if values.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {values.shape[1]} does not match index dimension {self.dimension}")
+        if self.metric == "cosine":
+            norms = np.linalg.norm(values, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            values = values / norms
+        return values
+
+    # -- Pinecone-compatible API ------------------------------------------
+
+    def upsert(self, vectors: Iterable[Any], **kwargs) -> Dict[str, int]:
+        """Insert or overwrite `(id, values, metadata)` tuples (or Pinecone dicts)."""
+        items = list(parse_upsert_vectors(vectors))
+        if not items:
+            return {"upserted_count": 0}
+        block = self._prepare(np.stack([np.asarray(v, dtype=np.float32) for _, v, _ in items]))
+        with self._lock:
+            first = self._rows
+            if self.path:
+                with open(self._file("vectors.f32"), "ab") as f:
+                    f.write(block.tobytes())
+                self._append_log([
+                    {"op": "upsert", "id": vid, "row": first + i, "metadata": meta}
+                    for i, (vid, _, meta) in enumerate(items)
+                ])
+            for i, (vid, _, meta) in enumerate(items):
+                self._record_upsert(vid, first + i, dict(meta))
+            self._rows += len(items)
+            if self.path:
+                self._matrix = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(self._rows, self.dimension))
+            else:
+                self._append_in_memory(block)
+            if self.metric == "euclidean":
+                self._sq_norms = np.concatenate([self._sq_norms[:first], self._row_norms(block)])
+        return {"upserted_count": len(items)}
+
+    def _append_in_memory(self, block: np.ndarray) -> None:
+        # amortised doubling: `_buffer` keeps spare capacity, `_matrix` views the filled rows
+        used = self._matrix.shape[0]
+        need = used + block.shape[0]
+        if self._buffer is None or self._buffer.shape[0] < need:
+            grown = np.empty((max(need, 2 * used, 1024), block.shape[1]), dtype=np.float32)
+            if used:
+                grown[:used] = self._matrix
+            self._buffer = grown
+        self._buffer[used:need] = block
+        self._matrix = self._buffer[:need]
+
+    def delete(self, ids: Optional[Sequence[str]] = None, delete_all: bool = False, **kwargs) -> Dict[str, Any]:
+        """Tombstone `ids` (or everything with `delete_all=True`)."""
+        with self._lock:
+            targets = list(self._row_of) if delete_all else list(ids or [])
+            deleted = [vid for vid in targets if self._record_delete(vid)]
+            if self.path and deleted:
+                self._append_log([{"op": "delete", "id": vid} for vid in deleted])
+        return {}
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        scores = queries @ np.asarray(self._matrix).T
+        if self.metric == "euclidean":
+            q_norms = np.einsum("ij,ij->i", queries, queries)
+            scores = q_norms[:, None] - 2.0 * scores + self._sq_norms[None, : self._rows]
+        return scores
+
+    def query_batch(
+        self,
+        vectors: Any,
+        top_k: int = 10,
+        include_metadata: bool = False,
+        include_values: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Run many queries with one matrix product; returns one response per query."""
+        largest = self.metric != "euclidean"
+        with self._lock:
+            if not self._rows:
+                return [{"matches": []} for _ in range(len(vectors))]
+            queries = self._prepare(np.asarray(vectors, dtype=np.float32))
+            mask = self._valid[: self._rows].copy()
+            if filter:
+                mask &= np.fromiter(
+                    (matches_filter(m, filter) for m in self._metadata[: self._rows]), dtype=bool, count=self._rows
+                )
+            scores = self._scores(queries)
+            scores[:, ~mask] = -np.inf if largest else np.inf
+            best = top_k_rows(scores, min(top_k, int(mask.sum())), largest=largest)
+
+            responses = []
+            for qi, rows in enumerate(best):
+                matches = []
+                for r in rows:
+                    m = {"id": self._ids[r], "score": float(scores[qi, r])}
+                    if include_metadata:
+                        m["metadata"] = dict(self._metadata[r])
+                    if include_values:
+                        m["values"] = np.asarray(self._matrix[r]).tolist()
+                    matches.append(m)
+                responses.append({"matches": matches})
+            return responses
+
+    def query(
+        self,
+        vector: Any = None,
+        top_k: int = 10,
+        include_metadata: bool = False,
+        include_values: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Pinecone-style single query: `{"matches": [{"id", "score", "metadata"}]}`."""
+        return self.query_batch(
+            [vector], top_k=top_k, include_metadata=include_metadata, include_values=include_values, filter=filter
+        )[0]
+
+    def fetch(self, ids: Sequence[str]) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for vid in ids:
+                row = self._row_of.get(vid)
+                if row is not None:
+                    out[vid] = {"id": vid, "values": np.asarray(self._matrix[row]).tolist(), "metadata": dict(self._metadata[row])}
+            return {"vectors": out}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "dimension": self.dimension,
+                "metric": self.metric,
+                "total_vector_count": len(self._row_of),
+                "tombstones": self._rows - len(self._row_of),
+            }
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def compact(self) -> None:
+        """Rewrite storage without tombstoned rows."""
+        with self._lock:
+            keep = np.flatnonzero(self._valid[: self._rows])
+            ids = [self._ids[r] for r in keep]
+            metas = [self._metadata[r] for r in keep]
+            matrix = np.ascontiguousarray(np.asarray(self._matrix)[keep])
+
+            if self.path:
+                tmp_vectors = self._file("vectors.f32.tmp")
+                tmp_log = self._file("log.jsonl.tmp")
+                with open(tmp_vectors, "wb") as f:
+                    f.write(matrix.tobytes())
+                with open(tmp_log, "w", encoding="utf-8") as f:
+                    for row, (vid, meta) in enumerate(zip(ids, metas)):
+                        f.write(json.dumps({"op": "upsert", "id": vid, "row": row, "metadata": meta}) + "\n")
+                # drop the memmap before replacing the file underneath it
+                self._matrix = matrix
+                os.replace(tmp_vectors, self._file("vectors.f32"))
+                os.replace(tmp_log, self._file("log.jsonl"))
+
+            self._ids = list(ids)
+            self._metadata = list(metas)
+            self._row_of = {vid: i for i, vid in enumerate(ids)}
+            self._rows = len(ids)
+            self._valid = np.ones(self._rows, dtype=bool)
+            if self.path:
+                self._remap()
+            else:
+                self._matrix = matrix
+                self._buffer = None
+                if self.metric == "euclidean":
+                    self._sq_norms = self._row_norms(matrix)
+
+
+__all__ = ["LocalIndex", "METRICS", "normalize_metric", "matches_filter", "top_k_rows"]
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+
+def content_hash(text: str) -> str:
+    """Short stable digest of `text` (blake2b-64, hex)."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def chunk_ids(chunks: Sequence[Dict]) -> List[str]:
+    """Deterministic ids `<source_id>:<content hash>` (just the hash without a source).
+
+    Ids depend on the chunk text, not its position, so inserting a paragraph
+    only changes the ids of chunks that actually changed. Repeated identical
+    chunks of one source get a `~n` suffix.
+    """
+    seen: Dict[str, int] = {}
+    ids = []
+    for c in chunks:
+        digest = content_hash(c.get("text", ""))
+        base = f"{c['source_id']}:{digest}" if c.get("source_id") else digest
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        ids.append(base if n == 0 else f"{base}~{n}")
+    return ids
+
+
+class Manifest:
+    """Persisted record of what is indexed: source id -> content hash and chunk ids.
+
+    Stored as one JSON file, written atomically (temp file + rename), so a
+    crash leaves either the old or the new manifest.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sources: Dict[str, Dict] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._sources = json.load(f).get("sources", {})
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def __contains__(self, source_id: str) -> bool:
+        return source_id in self._sources
+
+    def sources(self) -> List[str]:
+        return list(self._sources)
+
+    def get(self, source_id: str) -> Optional[Dict]:
+        return self._sources.get(source_id)
+
+    def set(self, source_id: str, doc_hash: str, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._sources[source_id] = {"hash": doc_hash, "chunks": list(ids)}
+
+    def remove(self, source_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._sources.pop(source_id, None)
+
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if not path:
+            raise ValueError("Manifest has no path")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with self._lock:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "sources": self._sources}, f)
+        os.replace(tmp, path)
+
+
+__all__ = ["Manifest", "chunk_ids", "content_hash"]
@@ -0,0 +1,298 @@
+import os
+import json
+import shutil
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ONNX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rag", "onnx")
+EXPORT_INFO = "export.json"
+TOKENIZER_FILE = "tokenizer.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_int8.onnx"
+
+PARITY_TEXTS = (
+    "How do I replace the seal on the feed pump?",
+    "Quarterly revenue grew faster than operating costs.",
+    "The valve must be closed before the motor is serviced.",
+    "Employees accrue vacation days from their first month.",
+    "ok",
+    "Step 4: check the pressure gauge, then tighten the flange bolts to 40 Nm "
+    "in a star pattern and record the reading in the maintenance log.",
+)
+
+
+def _onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as exc:
+        raise ImportError("The ONNX embedding backend needs onnxruntime: pip install onnxruntime") from exc
+    return onnxruntime
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def onnx_model_dir(model_name: str, cache_dir: Optional[str] = None) -> str:
+    """Directory holding the export of `model_name` (under `ONNX_EMBEDDING_DIR`)."""
+    root = cache_dir or os.getenv("ONNX_EMBEDDING_DIR", DEFAULT_ONNX_DIR)
+    return os.path.join(root, model_name.replace("/", "--"))
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """Row-wise cosine similarity between two embedding matrices of the same texts."""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    cos = (reference * candidate).sum(axis=1) / np.maximum(norms, 1e-12)
+    return {"min_cosine": float(cos.min()), "mean_cosine": float(cos.mean())}
+
+
+class OnnxEmbeddingModel:
+    """CPU embedding model running an exported graph in an ONNX Runtime session.
+
+    It has the same `encode` interface as `SentenceTransformer`, so it can be
+    passed anywhere `embed_texts` takes a model; with `EMBEDDING_PRECISION=int8`
+    the shared registry loads it instead of PyTorch. Texts are tokenized once,
+    sorted by length and batched so each batch is only padded to its own
+    longest text; embeddings come back in input order. Use
+    `load_onnx_embedding_model` to build one from the configured model
+    (needs `onnxruntime` and `tokenizers`).
+
+    ONNX Runtime's thread pools do not survive `fork`: with a `session_factory`
+    a forked child opens its own session on first use.
+    """
+
+    def __init__(self, session: Any, tokenizer: Any, model_name: str, max_length: int = 256, model_bytes: int = 0,
+                 session_factory: Optional[Callable[[], Any]] = None):
+        self.session = session
+        self._session_factory = session_factory
+        self._pid = os.getpid()
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.model_bytes = model_bytes
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length)
+        self._inputs = {i.name for i in session.get_inputs()}
+        self._output = session.get_outputs()[0].name
+        self.model_name = model_name
+        # int8 vectors differ slightly from the PyTorch ones: keep them apart in the embedding cache
+        self.embedding_model_name = f"{model_name}@onnx-int8"
+
+    def get_sentence_embedding_dimension(self) -> Optional[int]:
+        dim = self.session.get_outputs()[0].shape[-1]
+        return dim if isinstance(dim, int) else None
+
+    def _run(self, encodings: Sequence[Any]) -> np.ndarray:
+        width = max(len(e.ids) for e in encodings)
+        input_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, e in enumerate(encodings):
+            input_ids[row, : len(e.ids)] = e.ids
+            attention_mask[row, : len(e.ids)] = 1
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._inputs:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        return self.session.run([self._output], feed)[0]
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        """Embed `texts` as a `(len(texts), dim)` float32 array (`SentenceTransformer.encode` compatible)."""
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size=batch_size)[0]
+        if not texts:
+            return np.empty((0, self.get_sentence_embedding_dimension() or 0), dtype=np.float32)
+        if self._session_factory is not None and self._pid != os.getpid():
+            self.session = self._session_factory()
+            self._pid = os.getpid()
+        encodings = self.tokenizer.encode_batch(list(texts))
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        out = None
+        for start in range(0, len(order), batch_size):
+            rows = order[start : start + batch_size]
+            vectors = self._run([encodings[i] for i in rows])
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[rows] = vectors
+        return out
+
+
+def _export_graph(st_model: Any, path: str, opset: int) -> None:
+    import torch
+
+    class SentenceEmbedding(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            features = {"input_ids": input_ids, "attention_mask": attention_mask}
+            return self.model(features)["sentence_embedding"]
+
+    # trace with padding present so the graph keeps the masked code paths
+    input_ids = torch.ones((2, 16), dtype=torch.long)
+    attention_mask = torch.ones((2, 16), dtype=torch.long)
+    attention_mask[1, 8:] = 0
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            SentenceEmbedding(st_model).eval(),
+            (input_ids, attention_mask),
+            path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["sentence_embedding"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "sentence_embedding": {0: "batch"}},
+            opset_version=opset,
+            dynamo=False,
+        )
+
+
+def export_onnx_model(
+    model_name: Optional[str] = None,
+    output_dir: Optional[str] = None,
+    quantize: bool = True,
+    min_cosine: float = 0.97,
+    opset: int = 17,
+    overwrite: bool = False,
+) -> str:
+    """Export `model_name` (default `HF_EMBEDDING_MODEL`) to ONNX and return the export directory.
+
+    - The graph takes `input_ids`/`attention_mask` and returns the pooled (and,
+      if the model does so, normalised) sentence embedding.
+    - With `quantize`, weights are quantized to int8 (`QuantType.QInt8`,
+      dynamic activation quantization) into `model_int8.onnx`.
+    - The exported model embeds `PARITY_TEXTS` and must reach `min_cosine` with
+      the PyTorch model on every text, otherwise a ValueError is raised and
+      nothing is written. The agreement is recorded in `export.json`.
+
+    An existing export is reused unless `overwrite` is set; concurrent exports
+    of the same model are safe (the first one to finish wins). Exporting needs
+    `torch`, `sentence-transformers` and `onnx` besides `onnxruntime`.
+    """
+    from app.embeddings import _resolve_model_name
+
+    model_name = _resolve_model_name(model_name)
+    output_dir = output_dir or onnx_model_dir(model_name)
+    if os.path.exists(os.path.join(output_dir, EXPORT_INFO)) and not overwrite:
+        return output_dir
+
+    ort = _onnxruntime()
+    from sentence_transformers import SentenceTransformer
+
+    logger.info("Exporting embedding model '%s' to ONNX in %s", model_name, output_dir)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    max_length = int(getattr(st_model, "max_seq_length", None) or 256)
+    staging = f"{output_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        _export_graph(st_model, os.path.join(staging, MODEL_FILE), opset)
+        model_file = MODEL_FILE
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(
+                os.path.join(staging, MODEL_FILE),
+                os.path.join(staging, QUANTIZED_MODEL_FILE),
+                weight_type=QuantType.QInt8,
+            )
+            model_file = QUANTIZED_MODEL_FILE
+        st_model.tokenizer.save_pretrained(staging)
+        if not os.path.exists(os.path.join(staging, TOKENIZER_FILE)):
+            raise ValueError(f"Embedding model '{model_name}' has no fast tokenizer ({TOKENIZER_FILE}) to export")
+
+        info = {"model_name": model_name, "model_file": model_file, "max_length": max_length, "opset": opset}
+        model = _load(staging, info, ort)
+        reference = st_model.encode(list(PARITY_TEXTS), convert_to_numpy=True, show_progress_bar=False)
+        info["parity"] = cosine_agreement(reference, model.encode(list(PARITY_TEXTS)))
+        if info["parity"]["min_cosine"] < min_cosine:
+            raise ValueError(
+                f"ONNX export of '{model_name}' disagrees with the PyTorch model: "
+                f"min cosine {info['parity']['min_cosine']:.4f} < {min_cosine}"
+            )
+        with open(os.path.join(staging, EXPORT_INFO), "w") as f:
+            json.dump(info, f, indent=2)
+
+        if overwrite:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(os.path.dirname(output_dir) or ".", exist_ok=True)
+        try:
+            os.rename(staging, output_dir)
+        except OSError:
+            if not os.path.exists(os.path.join(output_dir, EXPORT_INFO)):
+                raise
+            logger.info("ONNX export of '%s' already finished elsewhere", model_name)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info("ONNX export of '%s' ready (min cosine %.4f)", model_name, info["parity"]["min_cosine"])
+    return output_dir
+
+
+def _load(model_dir: str, info: Dict[str, Any], ort: Any,
+          intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None) -> OnnxEmbeddingModel:
+    from tokenizers import Tokenizer
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        options.inter_op_num_threads = inter_op_threads
+    path = os.path.join(model_dir, info["model_file"])
+
+    def new_session():
+        return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    return OnnxEmbeddingModel(
+        new_session(),
+        Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE)),
+        model_name=info["model_name"],
+        max_length=info["max_length"],
+        model_bytes=os.path.getsize(path),
+        session_factory=new_session,
+    )
+
+
+def load_onnx_embedding_model(
+    model_name: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: Optional[int] = None,
+) -> OnnxEmbeddingModel:
+    """Load the int8 ONNX export of `model_name`, exporting it on first use.
+
+    - `intra_op_threads` / `inter_op_threads` (or `ONNX_INTRA_OP_THREADS` /
+      `ONNX_INTER_OP_THREADS`) size the session's thread pools; ONNX Runtime
+      uses all cores by default, so set them when several workers share a host.
+    - Exports go to `ONNX_EMBEDDING_DIR` (default `~/.cache/rag/onnx`); ship
+      that directory to serving nodes to skip the export there.
+    """
+    from app.embeddings import _resolve_model_name
+
+    ort = _onnxruntime()
+    model_name = _resolve_model_name(model_name)
+    model_dir = export_onnx_model(model_name, output_dir=onnx_model_dir(model_name, cache_dir))
+    with open(os.path.join(model_dir, EXPORT_INFO)) as f:
+        info = json.load(f)
+    return _load(
+        model_dir,
+        info,
+        ort,
+        intra_op_threads=intra_op_threads or _env_int("ONNX_INTRA_OP_THREADS"),
+        inter_op_threads=inter_op_threads or _env_int("ONNX_INTER_OP_THREADS"),
+    )
+
+
+__all__ = [
+    "OnnxEmbeddingModel",
+    "cosine_agreement",
+    "export_onnx_model",
+    "load_onnx_embedding_model",
+    "onnx_model_dir",
+]
@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Reuse answers for paraphrased questions by comparing query embeddings.
+
+    - Recent query embeddings are kept (L2-normalised) in one NumPy matrix; a
+      lookup is a single matrix-vector product over the live rows.
+    - A hit needs cosine similarity >= `threshold`, the same `scope` (index and
+      generation settings) and the same corpus version the answer was built from.
+    - Entries expire after `ttl` seconds; entries from an older corpus version
+      are dropped the first time they are seen. When full, the oldest entry is
+      overwritten.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        ttl: Optional[float] = 3600.0,
+        max_entries: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be >= 1")
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * max_entries
+        self._live = np.zeros(max_entries, dtype=bool)
+        self._next = 0
+        self._lookups = 0
+        self._hits = 0
+        self._expired = 0
+        self._invalidated = 0
+        self._hit_age_total = 0.0
+        self._hit_age_max = 0.0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm > 0 else v
+
+    def _drop(self, row: int) -> None:
+        self._live[row] = False
+        self._entries[row] = None
+
+    def lookup(self, vector, corpus_version: int = 0, scope: str = "") -> Optional[Dict[str, Any]]:
+        """Return the cached entry closest to `vector`, or None.
+
+        The entry carries `answer`, `sources`, `retrieval` and `query`, plus the
+        `similarity` and `age_s` of this hit.
+        """
+        q = self._normalize(vector)
+        now = self._clock()
+        with self._lock:
+            self._lookups += 1
+            if self._vectors is None or self._vectors.shape[1] != q.size:
+                return None
+            rows = np.flatnonzero(self._live)
+            if rows.size:
+                sims = self._vectors[rows] @ q
+                for i in np.argsort(-sims):
+                    if sims[i] < self.threshold:
+                        break
+                    row = int(rows[i])
+                    entry = self._entries[row]
+                    if self.ttl is not None and now - entry["created"] > self.ttl:
+                        self._drop(row)
+                        self._expired += 1
+                        continue
+                    if entry["corpus_version"] != corpus_version:
+                        self._drop(row)
+                        self._invalidated += 1
+                        continue
+                    if entry["scope"] != scope:
+                        continue
+                    age = now - entry["created"]
+                    self._hits += 1
+                    self._hit_age_total += age
+                    self._hit_age_max = max(self._hit_age_max, age)
+                    return dict(entry, similarity=float(sims[i]), age_s=age)
+            return None
+
+    def store(
+        self,
+        vector,
+        answer: Any,
+        sources: List[Dict[str, Any]],
+        retrieval: Optional[Dict[str, Any]] = None,
+        corpus_version: int = 0,
+        scope: str = "",
+        query: str = "",
+    ) -> None:
+        v = self._normalize(vector)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != v.size:
+                self._vectors = np.zeros((self.max_entries, v.size), dtype=np.float32)
+                self._live[:] = False
+            row = self._next
+            self._next = (self._next + 1) % self.max_entries
+            self._vectors[row] = v
+            self._live[row] = True
+            self._entries[row] = {
+                "query": query,
+                "answer": answer,
+                "sources": sources,
+                "retrieval": retrieval,
+                "corpus_version": corpus_version,
+                "scope": scope,
+                "created": self._clock(),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._live[:] = False
+            self._entries = [None] * self.max_entries
+
+    def __len__(self) -> int:
+        return int(self._live.sum())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": int(self._live.sum()),
+                "lookups": self._lookups,
+                "hits": self._hits,
+                "hit_rate": self._hits / self._lookups if self._lookups else 0.0,
+                "saved_llm_calls": self._hits,
+                "expired": self._expired,
+                "invalidated": self._invalidated,
+                "mean_hit_age_s": self._hit_age_total / self._hits if self._hits else 0.0,
+                "max_hit_age_s": self._hit_age_max,
+            }
+
+
+_default_cache: Optional[SemanticAnswerCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Return the process-wide answer cache, or None when it is not configured.
+
+    - `ANSWER_CACHE_SIZE` enables the cache with that many entries.
+    - `ANSWER_CACHE_THRESHOLD` (defaults to `0.92`) and `ANSWER_CACHE_TTL` seconds (defaults to `3600`).
+    """
+    global _default_cache
+    size = os.getenv("ANSWER_CACHE_SIZE")
+    if not size:
+        return None
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = SemanticAnswerCache(
+                    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+                    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+                    max_entries=int(size),
+                )
+    return _default_cache
+
+
+__all__ = ["SemanticAnswerCache", "get_default_answer_cache"]
@@ -0,0 +1,258 @@
+import os
+import bisect
+import functools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from app.manifest import content_hash
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", ". ", "! ", "? ", " ")
+
+# Pages of a multi-page document are joined with a paragraph break, so a page
+# boundary is always a preferred split point.
+PAGE_SEPARATOR = "\n\n"
+
+LengthSpec = Union[str, Callable[[str], int]]
+
+Span = Tuple[int, int, int]  # (start, end, length)
+
+
+def approx_token_count(text: str) -> int:
+    """Same approximation as `build_prompt`: 1 token ~ 4 characters."""
+    return (len(text) + 3) // 4
+
+
+@functools.lru_cache(maxsize=4)
+def _hf_token_counter(name: str) -> Callable[[str], int]:
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(name)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def token_counter(tokenizer: Optional[LengthSpec] = None) -> Callable[[str], int]:
+    """`str -> int` token counter for `tokenizer`.
+
+    None or `"tokens"` gives `approx_token_count`; any other string is loaded
+    (once per process) as a Hugging Face tokenizer; callables are returned as-is.
+    """
+    if tokenizer is None or tokenizer == "tokens":
+        return approx_token_count
+    if callable(tokenizer):
+        return tokenizer
+    return _hf_token_counter(tokenizer)
+
+
+def _length_function(length: LengthSpec) -> Optional[Callable[[str], int]]:
+    """None means plain character counts, which are computed from offsets."""
+    return None if length == "chars" else token_counter(length)
+
+
+class Chunker:
+    """Recursive separator splitter that works on offsets instead of strings.
+
+    Produces the same chunks as LangChain's `RecursiveCharacterTextSplitter`
+    with the same separators (separators kept at the start of the following
+    piece, chunks stripped), but pieces are `(start, end)` spans into the
+    original text: merging and overlap only move integers, and each chunk is
+    sliced out once.
+
+    `length` picks the unit of `chunk_size` and `overlap`: `"chars"` (default),
+    `"tokens"` (the ~4 chars/token estimate `build_prompt` budgets with), the
+    name of a Hugging Face tokenizer, or any `str -> int` callable.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 500,
+        overlap: int = 50,
+        separators: Sequence[str] = DEFAULT_SEPARATORS,
+        length: LengthSpec = "chars",
+    ):
+        if overlap > chunk_size:
+            raise ValueError("overlap must not be larger than chunk_size")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.separators = tuple(separators)
+        self.length = length
+        self._count = _length_function(length)
+
+    # -- splitting ----------------------------------------------------------------
+
+    def _pieces(self, text: str, start: int, end: int, sep: str) -> List[Tuple[int, int]]:
+        if not sep:
+            return [(i, i + 1) for i in range(start, end)]
+        pieces = []
+        pos = start
+        idx = text.find(sep, start, end)
+        while idx != -1:
+            if idx > pos:
+                pieces.append((pos, idx))
+            pos = idx
+            idx = text.find(sep, idx + len(sep), end)
+        if end > pos:
+            pieces.append((pos, end))
+        return pieces
+
+    def _split(self, text: str, start: int, end: int, separators: Tuple[str, ...]) -> List[Span]:
+        sep, rest = separators[-1], ()
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                sep = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                sep, rest = candidate, separators[i + 1:]
+                break
+
+        out: List[Span] = []
+        good: List[Span] = []
+        count, size = self._count, self.chunk_size
+        for s, e in self._pieces(text, start, end, sep):
+            n = e - s if count is None else count(text[s:e])
+            if n < size:
+                good.append((s, e, n))
+                continue
+            if good:
+                out.extend(self._merge(text, good))
+                good = []
+            if rest:
+                out.extend(self._split(text, s, e, rest))
+            else:
+                out.append((s, e, n))
+        if good:
+            out.extend(self._merge(text, good))
+        return out
+
+    def _merge(self, text: str, pieces: List[Span]) -> List[Span]:
+        merged: List[Span] = []
+        window: deque = deque()
+        total = 0
+        for piece in pieces:
+            n = piece[2]
+            if window and total + n > self.chunk_size:
+                span = self._strip(text, window[0][0], window[-1][1])
+                if span is not None:
+                    merged.append(span)
+                while total > self.overlap or (total > 0 and total + n > self.chunk_size):
+                    total -= window.popleft()[2]
+            window.append(piece)
+            total += n
+        if window:
+            span = self._strip(text, window[0][0], window[-1][1])
+            if span is not None:
+                merged.append(span)
+        return merged
+
+    def _strip(self, text: str, start: int, end: int) -> Optional[Span]:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return (start, end, 0) if end > start else None
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        """`(start, end)` character offsets of the chunks of `text`."""
+        if not text:
+            return []
+        return [(s, e) for s, e, _ in self._split(text, 0, len(text), self.separators)]
+
+    # -- chunk dicts ----------------------------------------------------------------
+
+    def chunk(self, text: str, source_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Chunk dicts `{"source_id", "position", "text", "start", "end"}` for `text`."""
+        base_id = source_id or f"doc-{content_hash(text)}"
+        return [
+            {"source_id": base_id, "position": i, "text": text[s:e], "start": s, "end": e}
+            for i, (s, e) in enumerate(self.spans(text))
+        ]
+
+    def chunk_pages(self, pages: Sequence[str], source_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Chunk a multi-page document; each chunk also gets the 1-based `page` it starts on.
+
+        Offsets refer to the pages joined with `PAGE_SEPARATOR`.
+        """
+        starts = []
+        pos = 0
+        for page in pages:
+            starts.append(pos)
+            pos += len(page) + len(PAGE_SEPARATOR)
+        chunks = self.chunk(PAGE_SEPARATOR.join(pages), source_id=source_id)
+        for c in chunks:
+            c["page"] = bisect.bisect_right(starts, c["start"])
+        return chunks
+
+    def chunk_document(self, doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Chunk a `{"text" | "pages", "source_id"}` dict (the `load_documents` shape)."""
+        if doc.get("pages") is not None:
+            return self.chunk_pages(doc["pages"], source_id=doc.get("source_id"))
+        return self.chunk(doc.get("text") or "", source_id=doc.get("source_id"))
+
+
+@functools.lru_cache(maxsize=32)
+def get_chunker(
+    chunk_size: int = 500,
+    overlap: int = 50,
+    separators: Sequence[str] = DEFAULT_SEPARATORS,
+    length: LengthSpec = "chars",
+) -> Chunker:
+    """Shared `Chunker` per configuration, so callers don't rebuild one per document."""
+    return Chunker(chunk_size=chunk_size, overlap=overlap, separators=tuple(separators), length=length)
+
+
+def _chunk_batch(docs: List[Dict[str, Any]], config: Tuple) -> List[List[Dict[str, Any]]]:
+    chunker = get_chunker(*config)
+    return [chunker.chunk_document(doc) for doc in docs]
+
+
+def chunk_documents(
+    docs: Iterable[Dict[str, Any]],
+    chunk_size: int = 500,
+    overlap: int = 50,
+    separators: Sequence[str] = DEFAULT_SEPARATORS,
+    length: LengthSpec = "chars",
+    processes: Optional[int] = None,
+    batch_size: int = 32,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Yield the chunk list of each document in `docs`, in input order.
+
+    - `processes` > 1 chunks batches of `batch_size` documents in a process
+      pool (defaults to `CHUNK_PROCESSES`, else in-process). At most two
+      batches per process are in flight, so `docs` can be a lazy stream.
+    - With processes, `length` must be picklable: a string spec or a
+      module-level function.
+    """
+    if processes is None:
+        processes = int(os.getenv("CHUNK_PROCESSES", "1"))
+    config = (chunk_size, overlap, tuple(separators), length)
+    if processes <= 1:
+        chunker = get_chunker(*config)
+        for doc in docs:
+            yield chunker.chunk_document(doc)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        pending: deque = deque()
+        batch: List[Dict[str, Any]] = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                pending.append(pool.submit(_chunk_batch, batch, config))
+                batch = []
+                if len(pending) >= 2 * processes:
+                    yield from pending.popleft().result()
+        if batch:
+            pending.append(pool.submit(_chunk_batch, batch, config))
+        while pending:
+            yield from pending.popleft().result()
+
+
+__all__ = [
+    "Chunker",
+    "DEFAULT_SEPARATORS",
+    "PAGE_SEPARATOR",
+    "approx_token_count",
+    "chunk_documents",
+    "get_chunker",
+    "token_counter",
+]
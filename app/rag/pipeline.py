@@ -1,10 +1,23 @@
-from typing import Optional
+import time
+import asyncio
+import inspect
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, Optional
 
-from app.rag.retriever import retrieve_documents
+from app.async_utils import call_maybe_async, iterate_blocking, run_blocking
+from app.cache import identity_key
+from app.embeddings import embed_texts_array, get_embedding_model
+from app.embedding_batcher import get_default_batcher, microbatch_enabled
+from app.vectorstore import get_corpus_version
+from app.rag.answer_cache import SemanticAnswerCache, get_default_answer_cache
+from app.rag.retriever import retrieve_documents, retrieve_documents_async, retrieve_documents_batch
 from app.rag.prompt import build_prompt
-from app.llm import call_gemini
+from app.llm import call_gemini, call_gemini_async, stream_gemini_async
+from app.telemetry import current_span, traced
 
 
+@traced("generate_answer")
 def generate_answer(
     query: str,
     index,
@@ -12,31 +25,441 @@ def generate_answer(
     re_rank: bool = True,
     call_gemini_fn=None,
     system_prompt: Optional[str] = None,
+    embedding_model=None,
+    lexical_index=None,
+    token_features=None,
+    reranker=None,
+    stream: bool = False,
+    answer_cache: Optional[SemanticAnswerCache] = None,
+    chunk_store=None,
 ):
     """End-to-end RAG pipeline: retrieve -> prompt -> LLM -> post-process.
 
     - `index` is required (Pinecone Index or compatible mock).
     - `call_gemini_fn` can be provided to override the LLM call (useful in tests).
+    - `embedding_model` defaults to the process-wide shared embedding model.
+    - `lexical_index` (a `BM25Index`) enables hybrid dense + BM25 retrieval.
+    - `token_features` (a `TokenFeatureStore`) speeds up the lexical fallback reranker.
+    - `reranker` (e.g. a `CrossEncoderReranker`) replaces the Gemini/lexical reranker.
+    - `stream=True` returns an iterator of events instead: `{"type": "sources"}`
+      right after retrieval, one `{"type": "token", "text": ...}` per LLM chunk,
+      and `{"type": "done", "answer", "ttft_ms", "total_ms"}`. `call_gemini_fn`
+      may then return either a string or an iterator of chunks.
+    - `answer_cache` (or `get_default_answer_cache()`, see `ANSWER_CACHE_SIZE`)
+      returns a stored answer for a sufficiently similar earlier question and
+      skips retrieval and the LLM; the result then has a `cache` entry.
+    - `chunk_store` (a `ChunkStore`, default `CHUNK_STORE_PATH`) supplies chunk
+      text missing from the index metadata.
     Returns dict: {answer: str, sources: List[dict], retrieval: dict}
     """
+    start = time.perf_counter()
+    if answer_cache is None:
+        answer_cache = get_default_answer_cache()
+    query_vector = None
+    if answer_cache is not None:
+        query_vector = embed_texts_array([query], model=embedding_model or get_embedding_model())[0]
+        scope = _cache_scope(index, lexical_index, top_k, re_rank, system_prompt,
+                             embedding_model, call_gemini_fn, reranker, token_features)
+        version = get_corpus_version()
+        hit = answer_cache.lookup(query_vector, corpus_version=version, scope=scope)
+        current_span().set(answer_cache_hit=hit is not None)
+        if hit is not None:
+            if stream:
+                return _stream_events(start, hit["retrieval"], hit["sources"], [hit["answer"]])
+            return _cached_result(hit)
+
     # 1) Retrieve
-    retrieval = retrieve_documents(query, index=index, top_k=top_k, re_rank=re_rank, call_gemini=call_gemini_fn)
+    retrieval = retrieve_documents(
+        query,
+        index=index,
+        top_k=top_k,
+        re_rank=re_rank,
+        call_gemini=_joined_caller(call_gemini_fn) if stream else call_gemini_fn,
+        embedding_model=embedding_model,
+        lexical_index=lexical_index,
+        token_features=token_features,
+        reranker=reranker,
+        query_vector=query_vector,
+        chunk_store=chunk_store,
+    )
     contexts = retrieval.get("results", [])
 
     # 2) Build prompt
     prompt_bundle = build_prompt(query, contexts, system_prompt_template=system_prompt)
     prompt = prompt_bundle["prompt"]
+    current_span().set(
+        prompt_chars=len(prompt),
+        prompt_tokens=prompt_bundle["tokens_used"],
+        prompt_tokens_saved=prompt_bundle["tokens_saved"],
+        contexts=len(prompt_bundle["used_contexts"]),
+        stream=stream,
+    )
 
     # 3) Call LLM
+    sources = _sources(prompt_bundle)
+    remember = None
+    if answer_cache is not None:
+        remember = functools.partial(
+            answer_cache.store,
+            query_vector,
+            sources=sources,
+            retrieval=retrieval,
+            corpus_version=version,
+            scope=scope,
+            query=query,
+        )
+
+    if stream:
+        chunks = call_gemini_fn(prompt) if call_gemini_fn is not None else call_gemini(prompt, stream=True)
+        return _stream_events(start, retrieval, sources, [chunks] if isinstance(chunks, str) else chunks, remember)
     llm_caller = call_gemini_fn if call_gemini_fn is not None else call_gemini
     resp = llm_caller(prompt)
+    if remember is not None:
+        remember(resp)
 
     # 4) Post-process: try to extract cited sources from contexts
-    sources = []
-    for c in prompt_bundle.get("used_contexts", []):
-        sources.append({"id": c.get("id") or c.get("source_id"), "metadata": c.get("metadata", {})})
+    return {"answer": resp, "sources": sources, "retrieval": retrieval}
 
+
+@traced("generate_answer")
+async def generate_answer_async(
+    query: str,
+    index,
+    top_k: int = 5,
+    re_rank: bool = True,
+    call_gemini_fn=None,
+    system_prompt: Optional[str] = None,
+    embedding_model=None,
+    lexical_index=None,
+    token_features=None,
+    reranker=None,
+    retrieval_timeout: Optional[float] = None,
+    rerank_timeout: Optional[float] = None,
+    llm_timeout: Optional[float] = None,
+    answer_cache: Optional[SemanticAnswerCache] = None,
+    chunk_store=None,
+):
+    """asyncio-native `generate_answer`; same arguments and return value.
+
+    Each stage awaits instead of holding a thread: embedding goes through the
+    micro-batcher with `EMBEDDING_MICROBATCH=1` (otherwise the shared executor),
+    dense and lexical retrieval run together, and Gemini rerank shards run
+    concurrently. `call_gemini_fn` may be a coroutine function or a plain
+    callable. Stage timeouts are in seconds: a retrieval or LLM timeout raises
+    `asyncio.TimeoutError`, a rerank timeout falls back to lexical order.
+    """
+    if answer_cache is None:
+        answer_cache = get_default_answer_cache()
+    query_vector = None
+    if answer_cache is not None:
+        if embedding_model is None and microbatch_enabled():
+            query_vector = await get_default_batcher().embed_async(query)
+        else:
+            query_vector = (await run_blocking(embed_texts_array, [query], model=embedding_model))[0]
+        scope = _cache_scope(index, lexical_index, top_k, re_rank, system_prompt,
+                             embedding_model, call_gemini_fn, reranker, token_features)
+        version = get_corpus_version()
+        hit = answer_cache.lookup(query_vector, corpus_version=version, scope=scope)
+        current_span().set(answer_cache_hit=hit is not None)
+        if hit is not None:
+            return _cached_result(hit)
+
+    retrieval = await retrieve_documents_async(
+        query,
+        index=index,
+        top_k=top_k,
+        re_rank=re_rank,
+        call_gemini=call_gemini_fn,
+        embedding_model=embedding_model,
+        lexical_index=lexical_index,
+        token_features=token_features,
+        reranker=reranker,
+        query_vector=query_vector,
+        chunk_store=chunk_store,
+        retrieval_timeout=retrieval_timeout,
+        rerank_timeout=rerank_timeout,
+    )
+    prompt_bundle = build_prompt(query, retrieval.get("results", []), system_prompt_template=system_prompt)
+    current_span().set(
+        prompt_chars=len(prompt_bundle["prompt"]),
+        prompt_tokens=prompt_bundle["tokens_used"],
+        prompt_tokens_saved=prompt_bundle["tokens_saved"],
+        contexts=len(prompt_bundle["used_contexts"]),
+    )
+    llm_caller = call_gemini_fn if call_gemini_fn is not None else call_gemini_async
+    resp = await asyncio.wait_for(call_maybe_async(llm_caller, prompt_bundle["prompt"]), llm_timeout)
+    sources = _sources(prompt_bundle)
+    if answer_cache is not None:
+        answer_cache.store(query_vector, resp, sources, retrieval, corpus_version=version, scope=scope, query=query)
     return {"answer": resp, "sources": sources, "retrieval": retrieval}
 
 
-__all__ = ["generate_answer"]
+async def stream_answer_async(
+    query: str,
+    index,
+    top_k: int = 5,
+    re_rank: bool = True,
+    call_gemini_fn=None,
+    system_prompt: Optional[str] = None,
+    embedding_model=None,
+    lexical_index=None,
+    token_features=None,
+    reranker=None,
+    retrieval_timeout: Optional[float] = None,
+    rerank_timeout: Optional[float] = None,
+) -> AsyncIterator[Dict]:
+    """Async iterator of the `generate_answer(stream=True)` events.
+
+    `call_gemini_fn` may return a string, an iterator or an async iterator of
+    chunks, or be a coroutine function; by default `stream_gemini_async` is used.
+    """
+    start = time.perf_counter()
+    retrieval = await retrieve_documents_async(
+        query,
+        index=index,
+        top_k=top_k,
+        re_rank=re_rank,
+        call_gemini=_joined_caller_async(call_gemini_fn),
+        embedding_model=embedding_model,
+        lexical_index=lexical_index,
+        token_features=token_features,
+        reranker=reranker,
+        retrieval_timeout=retrieval_timeout,
+        rerank_timeout=rerank_timeout,
+    )
+    prompt_bundle = build_prompt(query, retrieval.get("results", []), system_prompt_template=system_prompt)
+    yield {"type": "sources", "sources": _sources(prompt_bundle), "retrieval": retrieval}
+
+    if call_gemini_fn is None:
+        chunks = stream_gemini_async(prompt_bundle["prompt"])
+    else:
+        chunks = call_gemini_fn(prompt_bundle["prompt"])
+        if inspect.isawaitable(chunks):
+            chunks = await chunks
+        if isinstance(chunks, str):
+            chunks = [chunks]
+        if not hasattr(chunks, "__aiter__"):
+            chunks = iterate_blocking(chunks)
+
+    parts = []
+    ttft_ms = None
+    try:
+        async for chunk in chunks:
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - start) * 1000.0
+            parts.append(chunk)
+            yield {"type": "token", "text": chunk}
+    finally:
+        # a disconnected client releases the LLM stream now, not at garbage collection
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+    yield _done_event(start, ttft_ms, parts)
+
+
+def generate_answers(
+    queries: Iterable[str],
+    index,
+    top_k: int = 5,
+    re_rank: bool = True,
+    call_gemini_fn=None,
+    system_prompt: Optional[str] = None,
+    embedding_model=None,
+    lexical_index=None,
+    token_features=None,
+    reranker=None,
+    max_concurrency: int = 8,
+    ordered: bool = True,
+    answer_cache: Optional[SemanticAnswerCache] = None,
+    chunk_store=None,
+) -> Iterator[Dict]:
+    """Answer many questions at once for offline jobs (evaluation sets, triage).
+
+    - All queries are embedded in one `encode` call.
+    - Queries answered by `answer_cache` (as in `generate_answer`) skip
+      retrieval and the LLM; `chunk_store` is passed on to retrieval.
+    - The rest go through `retrieve_documents_batch`: identical questions are
+      retrieved, reranked and answered once, and the chunk store is read once
+      for the whole batch.
+    - LLM calls run on a pool of `max_concurrency` threads, which bounds
+      concurrent LLM calls.
+    - Yields `generate_answer`-style dicts plus `query_index` and `query`, in
+      input order (`ordered=True`) or as each answer completes.
+    """
+    queries = list(queries)
+    if not queries:
+        return
+    vectors = embed_texts_array(queries, model=embedding_model or get_embedding_model())
+    llm_caller = call_gemini_fn if call_gemini_fn is not None else call_gemini
+    if answer_cache is None:
+        answer_cache = get_default_answer_cache()
+
+    done: Dict[int, Dict] = {}
+    if answer_cache is not None:
+        scope = _cache_scope(index, lexical_index, top_k, re_rank, system_prompt,
+                             embedding_model, call_gemini_fn, reranker, token_features)
+        version = get_corpus_version()
+        for i, vector in enumerate(vectors):
+            hit = answer_cache.lookup(vector, corpus_version=version, scope=scope)
+            if hit is not None:
+                done[i] = _cached_result(hit)
+    pending = [i for i in range(len(queries)) if i not in done]
+    first: Dict[str, int] = {}
+    for i in pending:
+        first.setdefault(queries[i], i)
+    current_span().set(queries=len(queries), answer_cache_hits=len(done))
+
+    retrievals = dict(
+        zip(
+            pending,
+            retrieve_documents_batch(
+                [queries[i] for i in pending],
+                index=index,
+                top_k=top_k,
+                re_rank=re_rank,
+                call_gemini=call_gemini_fn,
+                lexical_index=lexical_index,
+                token_features=token_features,
+                reranker=reranker,
+                query_vectors=vectors[pending],
+                chunk_store=chunk_store,
+                max_concurrency=max_concurrency,
+            ) if pending else [],
+        )
+    )
+
+    def answer(i: int) -> Dict:
+        retrieval = retrievals[i]
+        prompt_bundle = build_prompt(queries[i], retrieval["results"], system_prompt_template=system_prompt)
+        resp = llm_caller(prompt_bundle["prompt"])
+        sources = _sources(prompt_bundle)
+        if answer_cache is not None:
+            answer_cache.store(vectors[i], resp, sources, retrieval, corpus_version=version, scope=scope, query=queries[i])
+        return {"answer": resp, "sources": sources, "retrieval": retrieval}
+
+    def result(i: int, out: Dict) -> Dict:
+        return dict(out, query_index=i, query=queries[i])
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="batch-qa") as pool:
+        futures = {i: pool.submit(answer, i) for i in first.values()}
+        askers: Dict[int, list] = {}
+        for i in pending:
+            askers.setdefault(first[queries[i]], []).append(i)
+        try:
+            if ordered:
+                for i in range(len(queries)):
+                    yield result(i, done[i] if i in done else futures[first[queries[i]]].result())
+            else:
+                for i in done:
+                    yield result(i, done[i])
+                owner = {future: i for i, future in futures.items()}
+                for future in as_completed(futures.values()):
+                    for i in askers[owner[future]]:
+                        yield result(i, future.result())
+        finally:
+            # stop queued work if the caller abandons the iterator or a query fails
+            for future in futures.values():
+                future.cancel()
+
+
+def _joined_response(call_gemini_fn: Callable, prompt: str) -> str:
+    out = call_gemini_fn(prompt)
+    return out if isinstance(out, str) else "".join(out)
+
+
+async def _joined_response_async(call_gemini_fn: Callable, prompt: str) -> str:
+    out = call_gemini_fn(prompt)
+    if inspect.isawaitable(out):
+        out = await out
+    if isinstance(out, str):
+        return out
+    if hasattr(out, "__aiter__"):
+        return "".join([chunk async for chunk in out])
+    return await run_blocking("".join, out)
+
+
+def _joined_caller(call_gemini_fn):
+    # a streaming `call_gemini_fn` may return chunks; the reranker needs the whole JSON reply
+    return functools.partial(_joined_response, call_gemini_fn) if call_gemini_fn is not None else None
+
+
+def _joined_caller_async(call_gemini_fn):
+    return functools.partial(_joined_response_async, call_gemini_fn) if call_gemini_fn is not None else None
+
+
+def _stream_events(
+    start: float, retrieval: Dict, sources, chunks, on_done: Optional[Callable[[str], None]] = None
+) -> Iterator[Dict]:
+    yield {"type": "sources", "sources": sources, "retrieval": retrieval}
+    parts = []
+    ttft_ms = None
+    try:
+        for chunk in chunks:
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - start) * 1000.0
+            parts.append(chunk)
+            yield {"type": "token", "text": chunk}
+    finally:
+        # a consumer that stops early releases the LLM stream now, not at garbage collection
+        if hasattr(chunks, "close"):
+            chunks.close()
+    done = _done_event(start, ttft_ms, parts)
+    if on_done is not None:
+        on_done(done["answer"])
+    yield done
+
+
+def _done_event(start: float, ttft_ms: Optional[float], parts) -> Dict:
+    return {
+        "type": "done",
+        "answer": "".join(parts),
+        "ttft_ms": ttft_ms,
+        "total_ms": (time.perf_counter() - start) * 1000.0,
+    }
+
+
+def _index_identity(index) -> str:
+    # a Pinecone Index only knows its name through the client configuration
+    server_variables = getattr(getattr(index, "configuration", None), "server_variables", None)
+    if isinstance(server_variables, dict) and server_variables.get("index_name"):
+        return f"pinecone:{server_variables.get('environment')}/{server_variables['index_name']}"
+    return identity_key(index)
+
+
+def _cache_scope(
+    index,
+    lexical_index,
+    top_k: int,
+    re_rank: bool,
+    system_prompt: Optional[str],
+    embedding_model=None,
+    call_gemini_fn=None,
+    reranker=None,
+    token_features=None,
+) -> str:
+    # answers are only shared between calls that would have built the same prompt and sent it to the same model
+    parts = [_index_identity(index)] + [
+        identity_key(c) for c in (lexical_index, embedding_model, call_gemini_fn, reranker, token_features)
+    ]
+    return "|".join(parts + [str(top_k), str(int(re_rank)), system_prompt or ""])
+
+
+def _cached_result(hit: Dict) -> Dict:
+    return {
+        "answer": hit["answer"],
+        "sources": hit["sources"],
+        "retrieval": hit["retrieval"],
+        "cache": {"hit": True, "similarity": hit["similarity"], "age_s": hit["age_s"], "cached_query": hit["query"]},
+    }
+
+
+def _sources(prompt_bundle):
+    sources = []
+    for c in prompt_bundle.get("used_contexts", []):
+        source = {"id": c.get("id") or c.get("source_id"), "metadata": c.get("metadata", {})}
+        if c.get("merged_ids"):
+            source["merged_ids"] = c["merged_ids"]
+        sources.append(source)
+    return sources
+
+
+__all__ = ["generate_answer", "generate_answers", "generate_answer_async", "stream_answer_async"]
@@ -1,44 +1,258 @@
-from typing import List, Dict, Tuple, Optional
+import os
+import functools
+from typing import Callable, List, Dict, Tuple, Optional
+
+import numpy as np
+
+from app.lexical_index import tokenize
+from app.rag.chunker import LengthSpec, token_counter
+
+# MinHash: 64 multiply-shift hash functions ((a * x + b) mod 2**64) >> 32, a odd.
+_MINHASH_PERMUTATIONS = 64
+_rng = np.random.default_rng(20240601)
+_MINHASH_A = _rng.integers(0, 2**63, size=_MINHASH_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_MINHASH_B = _rng.integers(0, 2**63, size=_MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def get_prompt_token_counter(tokenizer: Optional[LengthSpec] = None) -> Callable[[str], int]:
+    """Token counter for prompt budgets: `tokenizer`, else `PROMPT_TOKENIZER`
+    (a Hugging Face tokenizer name), else the ~4 chars/token estimate."""
+    return token_counter(tokenizer if tokenizer is not None else os.getenv("PROMPT_TOKENIZER") or None)
+
+
+@functools.lru_cache(maxsize=16384)
+def _count(counter: Callable[[str], int], text: str) -> int:
+    # the same passages come back across queries; count each one once
+    return counter(text)
+
+
+@functools.lru_cache(maxsize=4096)
+def minhash_signature(text: str, shingle: int = 3) -> np.ndarray:
+    """64-value MinHash signature of the word `shingle`-grams of `text`.
+
+    Signatures are only comparable within one process (words are hashed with
+    Python's `hash`); they are cached per text, so treat them as read-only.
+    """
+    words = np.fromiter(map(hash, tokenize(text)), dtype=np.int64, count=-1).view(np.uint64)
+    if words.size >= shingle:
+        # polynomial combination of consecutive word hashes (wrapping uint64 arithmetic)
+        grams = np.zeros(words.size - shingle + 1, dtype=np.uint64)
+        for i in range(shingle):
+            grams = grams * np.uint64(1000003) + words[i : words.size - shingle + 1 + i]
+    else:
+        grams = np.array([words.sum(dtype=np.uint64)], dtype=np.uint64)
+    sig = ((_MINHASH_A[:, None] * grams[None, :] + _MINHASH_B[:, None]) >> np.uint64(32)).min(axis=1)
+    sig.flags.writeable = False
+    return sig
+
+
+def _span(c: Dict) -> Tuple[Optional[str], Optional[int], Optional[int], Optional[int]]:
+    meta = c.get("metadata") or {}
+    get = lambda key: c.get(key, meta.get(key))
+    return get("source_id"), get("position"), get("start"), get("end")
+
+
+def _suffix_prefix_overlap(a: str, b: str, limit: int = 2000) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (up to `limit`)."""
+    for k in range(min(len(a), len(b), limit), 0, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+
+def _join(prev: Dict, nxt: Dict) -> Optional[Tuple[int, str]]:
+    """`(overlap, joiner)` to append `nxt` to `prev`: the characters of `nxt`
+    already at the end of `prev` and what goes between; None if `nxt` doesn't follow `prev`."""
+    _, prev_pos, _, prev_end = _span(prev)
+    _, pos, start, _ = _span(nxt)
+    a, b = prev.get("text", ""), nxt.get("text", "")
+    if start is not None and prev_end is not None:
+        # chunks are stripped, so a separator's whitespace may sit between them
+        if start > prev_end + 2:
+            return None
+        if start >= prev_end:
+            return 0, " " if start > prev_end else ""
+        overlap = prev_end - start
+        if a.endswith(b[:overlap]):
+            return overlap, ""
+        overlap = _suffix_prefix_overlap(a, b)
+        return overlap, "" if overlap else " "
+    if pos is not None and prev_pos is not None and pos == prev_pos + 1:
+        overlap = _suffix_prefix_overlap(a, b)
+        return overlap, "" if overlap else " "
+    return None
+
+
+def merge_adjacent(contexts: List[Dict]) -> Tuple[List[Dict], int]:
+    """Merge chunks of the same source that follow each other, dropping the repeated overlap.
+
+    Chunks are adjacent when their `start`/`end` offsets touch or overlap, or
+    (without offsets) when their `position`s are consecutive. A merged context
+    sits where its best-ranked chunk was, keeps that chunk's id and score and
+    lists all `merged_ids`. Returns the contexts and the number of characters
+    of overlap removed.
+    """
+    by_source: Dict[str, List[int]] = {}
+    for i, c in enumerate(contexts):
+        source_id, position, start, _ = _span(c)
+        if source_id is not None and (start is not None or position is not None):
+            by_source.setdefault(source_id, []).append(i)
+
+    replaced: Dict[int, Dict] = {}
+    absorbed = set()
+    saved = 0
+    for members in by_source.values():
+        if len(members) < 2:
+            continue
+        members.sort(key=lambda i: (_span(contexts[i])[2] or 0, _span(contexts[i])[1] or 0))
+        run = [members[0]]
+        current = contexts[members[0]]
+        for i in members[1:] + [None]:
+            join = _join(current, contexts[i]) if i is not None else None
+            if join is not None:
+                nxt = contexts[i]
+                overlap, joiner = join
+                current = dict(current, text=current["text"] + joiner + nxt["text"][overlap:])
+                for key in ("position", "end"):
+                    if key in nxt:
+                        current[key] = nxt[key]
+                run.append(i)
+                saved += overlap
+                continue
+            if len(run) > 1:
+                best = min(run)
+                merged = dict(contexts[best], text=current["text"], merged_ids=[contexts[j].get("id") for j in run])
+                for key in ("start", "end"):
+                    if key in contexts[run[0]] or key in contexts[run[-1]]:
+                        merged[key] = contexts[run[0] if key == "start" else run[-1]].get(key)
+                replaced[best] = merged
+                absorbed.update(j for j in run if j != best)
+            if i is not None:
+                run = [i]
+                current = contexts[i]
+    out = [replaced.get(i, c) for i, c in enumerate(contexts) if i not in absorbed]
+    return out, saved
+
+
+def drop_near_duplicates(contexts: List[Dict], threshold: float = 0.8) -> Tuple[List[Dict], List[Dict]]:
+    """Keep the best-ranked of every group of passages whose estimated Jaccard
+    similarity (MinHash over word 3-grams) is at least `threshold`; passages
+    contained verbatim in a better-ranked one are dropped too.
+    Returns `(kept, dropped)`."""
+    if len(contexts) < 2:
+        return list(contexts), []
+    sigs = np.stack([minhash_signature(c.get("text", "")) for c in contexts])
+    similarity = (sigs[:, None, :] == sigs[None, :, :]).mean(axis=2)
+    kept, dropped, kept_rows = [], [], []
+    for i, c in enumerate(contexts):
+        text = c.get("text", "")
+        if kept_rows and (
+            similarity[i, kept_rows].max() >= threshold or any(text in contexts[j].get("text", "") for j in kept_rows)
+        ):
+            dropped.append(c)
+        else:
+            kept.append(c)
+            kept_rows.append(i)
+    return kept, dropped
+
+
+def _values(contexts: List[Dict]) -> List[float]:
+    scores = [c.get("rerank_score", c.get("score")) for c in contexts]
+    if all(isinstance(s, (int, float)) and s > 0 for s in scores):
+        return [float(s) for s in scores]
+    # missing or non-positive scores (e.g. cross-encoder logits): rank decides
+    return [1.0 / (rank + 1) for rank in range(len(contexts))]
+
+
+def _passage(c: Dict) -> str:
+    cid = c.get("id") or c.get("source_id") or ""
+    return f"[Source: {cid}]\n" + c["text"] + "\n\n"
 
 
 def build_prompt(query: str,
                  contexts: List[Dict],
                  system_prompt_template: Optional[str] = None,
-                 token_budget: int = 2048) -> Dict:
+                 token_budget: int = 2048,
+                 tokenizer: Optional[LengthSpec] = None,
+                 dedup_threshold: Optional[float] = 0.8,
+                 merge: bool = True) -> Dict:
     """Assemble a prompt for the LLM using `system_prompt_template` and `contexts`.
 
-    - `contexts` is a list of dicts with at least `text` and `source_id`/`id`.
+    - `contexts` is a list of dicts with at least `text` and `source_id`/`id`, best first.
     - `system_prompt_template` is optional system instruction text.
-    - `token_budget` is an approximate token budget (we use characters as a rough proxy).
+    - `token_budget` is counted with `tokenizer` (see `get_prompt_token_counter`;
+      the ~4 chars/token estimate unless a tokenizer is configured).
+    - With `merge`, adjacent chunks of one source become one context without
+      their repeated overlap; with `dedup_threshold`, near-duplicate passages
+      (MinHash Jaccard estimate) are dropped in favour of the better-ranked one.
+    - Contexts are packed by score per token: passages that don't fit are
+      skipped (not the end of packing), and the chosen ones keep rank order.
+      A merged passage that doesn't fit is replaced by its best-ranked chunk
+      alone (counted in `packing["split"]`) before it is given up on.
 
-    Returns a dict: {"prompt": str, "used_contexts": List[Dict]}.
+    Returns a dict: {"prompt": str, "used_contexts": List[Dict], "tokens_used": int,
+    "tokens_saved": int, "packing": Dict} where `tokens_saved` is what merging and
+    de-duplication removed and `packing` has the details.
     """
-    # Very simple token approximation: 1 token ≈ 4 characters
-    char_budget = token_budget * 4
-
+    counter = get_prompt_token_counter(tokenizer)
     system_part = system_prompt_template.strip() + "\n\n" if system_prompt_template else ""
+    frame = f"{system_part}CONTEXT:\nUSER QUERY:\n{query}\n"
+    frame_tokens = _count(counter, frame)
 
-    used_contexts: List[Dict] = []
-    context_parts: List[str] = []
-    used_chars = len(system_part) + len(query)
+    candidates = [c for c in contexts if c.get("text")]
+    before = sum(_count(counter, c["text"]) for c in candidates)
+    with_text = len(candidates)
+    # a merged context keeps its best-ranked chunk's id: that chunk alone is the fallback when the merge does not fit
+    unmerged = {c["id"]: c for c in candidates if c.get("id")}
+    merged_chars = 0
+    if merge:
+        candidates, merged_chars = merge_adjacent(candidates)
+    merged = with_text - len(candidates)
+    duplicates: List[Dict] = []
+    if dedup_threshold is not None:
+        candidates, duplicates = drop_near_duplicates(candidates, dedup_threshold)
+    tokens_saved = max(before - sum(_count(counter, c["text"]) for c in candidates), 0)
 
-    for c in contexts:
-        text = c.get("text", "")
-        cid = c.get("id") or c.get("source_id") or ""
-        citation = f"[Source: {cid}]\n"
-        part = citation + text + "\n\n"
-        if used_chars + len(part) > char_budget:
-            # stop adding contexts once budget exceeded
-            break
-        context_parts.append(part)
-        used_contexts.append(c)
-        used_chars += len(part)
-
-    # Build final prompt
-    context_section = "".join(context_parts)
+    parts = [_passage(c) for c in candidates]
+    costs = [_count(counter, p) for p in parts]
+    values = _values(candidates)
+
+    remaining = token_budget - frame_tokens
+    chosen = set()
+    skipped = 0
+    split = 0
+    for i in sorted(range(len(parts)), key=lambda i: values[i] / max(costs[i], 1), reverse=True):
+        best = unmerged.get(candidates[i].get("id")) if candidates[i].get("merged_ids") else None
+        if costs[i] > remaining and best is not None:
+            candidates[i], parts[i] = best, _passage(best)
+            costs[i] = _count(counter, parts[i])
+            split += 1
+        if costs[i] <= remaining:
+            chosen.add(i)
+            remaining -= costs[i]
+        else:
+            skipped += 1
+
+    order = sorted(chosen)
+    used_contexts = [candidates[i] for i in order]
+    context_section = "".join(parts[i] for i in order)
     prompt = f"{system_part}CONTEXT:\n{context_section}USER QUERY:\n{query}\n"
 
-    return {"prompt": prompt, "used_contexts": used_contexts}
+    return {
+        "prompt": prompt,
+        "used_contexts": used_contexts,
+        "tokens_used": frame_tokens + sum(costs[i] for i in order),
+        "tokens_saved": tokens_saved,
+        "packing": {
+            "token_budget": token_budget,
+            "candidates": len(contexts),
+            "merged": merged,
+            "merged_overlap_chars": merged_chars,
+            "duplicates": len(duplicates),
+            "split": split,
+            "skipped": skipped,
+        },
+    }
 
 
-__all__ = ["build_prompt"]
+__all__ = ["build_prompt", "drop_near_duplicates", "get_prompt_token_counter", "merge_adjacent", "minhash_signature"]
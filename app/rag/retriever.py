@@ -1,21 +1,130 @@
-from typing import List, Dict, Optional
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Sequence
 
-from app.vectorstore import query_pinecone
-from app.reranker import rerank_documents_with_gemini
+from app.async_utils import ProcessSingleton, run_blocking
+from app.chunk_store import get_default_chunk_store, hydrate
+from app.telemetry import current_span, traced
+from app.vectorstore import query_pinecone, query_pinecone_async
+from app.reranker import (
+    get_default_reranker,
+    rerank_documents_with_gemini,
+    rerank_documents_with_gemini_async,
+    rerank_lexical,
+)
 
+logger = logging.getLogger(__name__)
 
+_executor = ProcessSingleton(lambda: ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval"))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    return _executor.get()
+
+
+def docs_from_response(resp: Dict) -> List[Dict]:
+    """Turn a Pinecone-style response into result dicts with `id`, `text`, `score`, `metadata`."""
+    matches = resp.get("matches") or resp.get("results") or []
+
+    docs: List[Dict] = []
+    for m in matches:
+        mid = m.get("id") or m.get("metadata", {}).get("id")
+        score = m.get("score") or m.get("score", 0.0)
+        metadata = m.get("metadata", {})
+        # prefer textual fields in metadata
+        text = metadata.get("text") or metadata.get("content") or metadata.get("page_content") or ""
+        docs.append({"id": mid, "text": text, "score": score, "metadata": metadata})
+    return docs
+
+
+def fuse_results(
+    ranked_lists: Sequence[List[Dict]],
+    method: str = "rrf",
+    weights: Optional[Sequence[float]] = None,
+    rrf_k: int = 60,
+    top_k: Optional[int] = None,
+) -> List[Dict]:
+    """Merge several ranked result lists into one, keyed by document `id`.
+
+    - `method="rrf"`: reciprocal-rank fusion, `sum(w / (rrf_k + rank))`.
+    - `method="weighted"`: min-max normalise each list's scores, then `sum(w * score)`.
+
+    The first list a document appears in supplies its dict; the fused value is
+    stored in `score` and each input's own score in `fused_scores`.
+    """
+    if method not in ("rrf", "weighted"):
+        raise ValueError(f"Unknown fusion method '{method}'")
+    weights = list(weights) if weights is not None else [1.0] * len(ranked_lists)
+
+    fused: Dict[str, Dict] = {}
+    totals: Dict[str, float] = {}
+    for li, (docs, w) in enumerate(zip(ranked_lists, weights)):
+        if method == "weighted" and docs:
+            raw = [float(d.get("score") or 0.0) for d in docs]
+            lo, hi = min(raw), max(raw)
+            contrib = [w * ((s - lo) / (hi - lo) if hi > lo else 1.0) for s in raw]
+        else:
+            contrib = [w / (rrf_k + rank) for rank in range(1, len(docs) + 1)]
+        for d, c in zip(docs, contrib):
+            did = d.get("id")
+            if did not in fused:
+                fused[did] = dict(d, fused_scores=[None] * len(ranked_lists))
+                totals[did] = 0.0
+            elif not fused[did].get("text") and d.get("text"):
+                fused[did]["text"] = d["text"]
+            fused[did]["fused_scores"][li] = d.get("score")
+            totals[did] += c
+
+    out = sorted(fused.values(), key=lambda d: totals[d["id"]], reverse=True)
+    for d in out:
+        d["score"] = totals[d["id"]]
+    return out[:top_k] if top_k else out
+
+
+@traced("retrieve_documents")
 def retrieve_documents(
     query: str,
     index,
     top_k: int = 5,
     re_rank: bool = True,
     call_gemini: Optional[callable] = None,
+    embedding_model=None,
+    lexical_index=None,
+    fusion: str = "rrf",
+    fusion_alpha: float = 0.5,
+    dense_top_k: Optional[int] = None,
+    lexical_top_k: Optional[int] = None,
+    token_features=None,
+    reranker=None,
+    query_vector=None,
+    chunk_store=None,
 ) -> Dict:
     """Retrieve documents for `query` from Pinecone index and optionally rerank.
 
     - `index` is a Pinecone Index instance (returned by `init_pinecone`).
     - If `re_rank` is True, documents will be passed to `rerank_documents_with_gemini`.
     - `call_gemini` is an optional callable(prompt) -> str used by reranker.
+    - `embedding_model` defaults to the shared model from `app.embeddings.get_embedding_model`.
+    - `lexical_index` (a `BM25Index`) enables hybrid retrieval: the BM25 search
+      runs concurrently with the dense query and the two rankings are merged with
+      `fuse_results` (`fusion="rrf"` or `"weighted"`). `fusion_alpha` is the
+      dense weight for `"weighted"` only; `"rrf"` weighs both sides equally.
+      `dense_top_k`/`lexical_top_k` set how many candidates each side returns.
+      BM25 hits carry no text, so lexical-only matches get theirs from `chunk_store`.
+    - `token_features` (a `TokenFeatureStore` filled at ingest) lets the lexical
+      fallback reranker skip re-tokenizing candidate texts.
+    - `reranker` is any object with `rerank(query, docs, top_k)` (e.g. a
+      `CrossEncoderReranker`) used instead of the Gemini/lexical reranker. When
+      neither it nor `call_gemini` is given it defaults to
+      `get_default_reranker()` (`RERANKER_BACKEND=cross_encoder`).
+      Rerank latency is reported under `rerank` in the output.
+    - `query_vector` is a precomputed query embedding (skips embedding the query).
+    - `chunk_store` (a `ChunkStore`, default `CHUNK_STORE_PATH`) supplies the
+      text of matches whose metadata has none, in one bulk read: for all
+      candidates when the reranker needs text, otherwise only for the `top_k`
+      that are returned.
 
     Returns a dict with keys: `query`, `results` (list of docs), `raw_response`.
     Each result contains: `id`, `text`, `score`, `metadata`, and optional `rerank_score`.
@@ -23,24 +132,265 @@ def retrieve_documents(
     if index is None:
         raise ValueError("`index` (Pinecone Index) is required")
 
-    resp = query_pinecone(query, index=index, top_k=top_k)
+    docs, resp, lexical_resp = _retrieve_candidates(
+        query, index, top_k, embedding_model, lexical_index, fusion, fusion_alpha,
+        dense_top_k, lexical_top_k, query_vector,
+    )
+    if chunk_store is None:
+        chunk_store = get_default_chunk_store()
 
-    matches = resp.get("matches") or resp.get("results") or []
+    if re_rank:
+        if reranker is None and not call_gemini:
+            # an explicit `call_gemini` asks for Gemini reranking, whatever RERANKER_BACKEND says
+            reranker = get_default_reranker()
+        if _rerank_needs_text(docs, reranker, call_gemini, token_features):
+            hydrate(docs, chunk_store)
+    docs, rerank_info = _rerank_candidates(query, docs, top_k, re_rank, call_gemini, reranker, token_features)
+    hydrate(docs, chunk_store)
 
-    docs: List[Dict] = []
-    for m in matches:
-        mid = m.get("id") or m.get("metadata", {}).get("id")
-        score = m.get("score") or m.get("score", 0.0)
-        metadata = m.get("metadata", {})
-        # prefer textual fields in metadata
-        text = metadata.get("text") or metadata.get("content") or metadata.get("page_content") or ""
-        docs.append({"id": mid, "text": text, "score": score, "metadata": metadata})
+    return _retrieval_output(query, docs, resp, lexical_resp, rerank_info)
+
+
+@traced("retrieve_documents")
+async def retrieve_documents_async(
+    query: str,
+    index,
+    top_k: int = 5,
+    re_rank: bool = True,
+    call_gemini: Optional[callable] = None,
+    embedding_model=None,
+    lexical_index=None,
+    fusion: str = "rrf",
+    fusion_alpha: float = 0.5,
+    dense_top_k: Optional[int] = None,
+    lexical_top_k: Optional[int] = None,
+    token_features=None,
+    reranker=None,
+    query_vector=None,
+    chunk_store=None,
+    retrieval_timeout: Optional[float] = None,
+    rerank_timeout: Optional[float] = None,
+) -> Dict:
+    """Async `retrieve_documents` with the same arguments and output.
+
+    - The dense query (`query_pinecone_async`) and the BM25 search are awaited
+      together; if they exceed `retrieval_timeout` seconds both are cancelled
+      and `asyncio.TimeoutError` is raised.
+    - Gemini reranking goes through `rerank_documents_with_gemini_async`, so its
+      shards run concurrently; `call_gemini` may be sync or a coroutine function.
+      A `reranker` with `rerank_async` is awaited directly.
+    - If reranking exceeds `rerank_timeout` it is cancelled and the candidates
+      are ranked lexically instead (`rerank["timed_out"]` is set).
+    """
+    if index is None:
+        raise ValueError("`index` (Pinecone Index) is required")
+
+    dense = query_pinecone_async(
+        query, index=index, top_k=dense_top_k or top_k, model=embedding_model, query_vector=query_vector
+    )
+    if lexical_index is None:
+        resp, lexical_resp = await asyncio.wait_for(dense, retrieval_timeout), None
+    else:
+        lexical = run_blocking(lexical_index.search, query, lexical_top_k or top_k)
+        resp, lexical_resp = await asyncio.wait_for(asyncio.gather(dense, lexical), retrieval_timeout)
+    docs = _candidates(resp, lexical_resp, fusion, fusion_alpha)
+    if chunk_store is None:
+        chunk_store = get_default_chunk_store()
 
+    rerank_info = None
     if re_rank:
+        if reranker is None and not call_gemini:
+            reranker = get_default_reranker()
+        if _rerank_needs_text(docs, reranker, call_gemini, token_features):
+            await run_blocking(hydrate, docs, chunk_store)
+        candidates = docs
+        start = time.perf_counter()
+        if reranker is None:
+            backend = "gemini" if call_gemini else "lexical"
+            pending = rerank_documents_with_gemini_async(
+                query, docs, call_gemini=call_gemini, top_k=top_k, features=token_features
+            )
+        else:
+            backend = type(reranker).__name__
+            if hasattr(reranker, "rerank_async"):
+                pending = reranker.rerank_async(query, docs, top_k=top_k)
+            else:
+                pending = run_blocking(reranker.rerank, query, docs, top_k=top_k)
+        timed_out = False
+        try:
+            docs = await asyncio.wait_for(pending, rerank_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Rerank (%s) timed out after %.3fs, using lexical order", backend, rerank_timeout)
+            docs = [r.to_dict() for r in rerank_lexical(query, candidates, top_k=top_k, features=token_features)]
+            timed_out = True
+        rerank_info = {
+            "backend": backend,
+            "candidates": len(candidates),
+            "latency_ms": (time.perf_counter() - start) * 1000.0,
+        }
+        if timed_out:
+            rerank_info["timed_out"] = True
+    else:
+        docs = docs[:top_k]
+    await run_blocking(hydrate, docs, chunk_store)
+
+    return _retrieval_output(query, docs, resp, lexical_resp, rerank_info)
+
+
+@traced("retrieve_documents_batch")
+def retrieve_documents_batch(
+    queries: Sequence[str],
+    index,
+    top_k: int = 5,
+    re_rank: bool = True,
+    call_gemini: Optional[callable] = None,
+    embedding_model=None,
+    lexical_index=None,
+    fusion: str = "rrf",
+    fusion_alpha: float = 0.5,
+    dense_top_k: Optional[int] = None,
+    lexical_top_k: Optional[int] = None,
+    token_features=None,
+    reranker=None,
+    query_vectors=None,
+    chunk_store=None,
+    max_concurrency: int = 8,
+) -> List[Dict]:
+    """`retrieve_documents` for many queries, sharing the work they have in common.
+
+    - Identical queries are retrieved and reranked once and share one output.
+    - Candidate retrieval and reranking run on `max_concurrency` threads.
+    - The chunk store is read once, with one `get_many` over the union of
+      candidate ids (or of returned ids when the reranker needs no text).
+    - Chunks retrieved by several queries share one `text`/`metadata` object.
+    - `query_vectors` are precomputed embeddings in the order of `queries`.
+
+    Returns one `retrieve_documents`-style dict per query, in input order.
+    """
+    if index is None:
+        raise ValueError("`index` (Pinecone Index) is required")
+    queries = list(queries)
+    first: Dict[str, int] = {}
+    for i, q in enumerate(queries):
+        first.setdefault(q, i)
+    distinct = list(first.values())
+    if chunk_store is None:
+        chunk_store = get_default_chunk_store()
+    if re_rank and reranker is None and not call_gemini:
+        reranker = get_default_reranker()
+
+    def candidates(i: int):
+        return _retrieve_candidates(
+            queries[i], index, top_k, embedding_model, lexical_index, fusion, fusion_alpha,
+            dense_top_k, lexical_top_k, None if query_vectors is None else query_vectors[i],
+        )
+
+    def rerank(i: int):
+        return _rerank_candidates(queries[i], retrieved[i][0], top_k, re_rank, call_gemini, reranker, token_features)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="batch-retrieval") as pool:
+        retrieved = dict(zip(distinct, pool.map(candidates, distinct)))
+        needs_text = re_rank and any(
+            _rerank_needs_text(retrieved[i][0], reranker, call_gemini, token_features) for i in distinct
+        )
+        if needs_text:
+            hydrate([d for i in distinct for d in retrieved[i][0]], chunk_store)
+        reranked = dict(zip(distinct, pool.map(rerank, distinct)))
+    if not needs_text:
+        hydrate([d for i in distinct for d in reranked[i][0]], chunk_store)
+
+    chunk_pool: Dict[tuple, tuple] = {}
+    outputs = {}
+    for i in distinct:
+        docs = [_shared_chunk(chunk_pool, d) for d in reranked[i][0]]
+        outputs[i] = _retrieval_output(queries[i], docs, retrieved[i][1], retrieved[i][2], reranked[i][1])
+    current_span().set(queries=len(queries), distinct_queries=len(distinct))
+    return [outputs[first[q]] for q in queries]
+
+
+def _rerank_needs_text(docs: List[Dict], reranker, call_gemini, token_features) -> bool:
+    # only the lexical reranker with precomputed token features can rank without text
+    if reranker is not None or call_gemini is not None or token_features is None:
+        return True
+    return any(token_features.get(d.get("id")) is None for d in docs)
+
+
+def _retrieve_candidates(
+    query: str,
+    index,
+    top_k: int,
+    embedding_model,
+    lexical_index,
+    fusion: str,
+    fusion_alpha: float,
+    dense_top_k: Optional[int],
+    lexical_top_k: Optional[int],
+    query_vector,
+):
+    dense_k = dense_top_k or top_k
+    if lexical_index is None:
+        resp = query_pinecone(query, index=index, top_k=dense_k, model=embedding_model, query_vector=query_vector)
+        lexical_resp = None
+    else:
+        lexical_future = _get_executor().submit(lexical_index.search, query, lexical_top_k or top_k)
+        resp = query_pinecone(query, index=index, top_k=dense_k, model=embedding_model, query_vector=query_vector)
+        lexical_resp = lexical_future.result()
+    return _candidates(resp, lexical_resp, fusion, fusion_alpha), resp, lexical_resp
+
+
+def _rerank_candidates(
+    query: str, docs: List[Dict], top_k: int, re_rank: bool, call_gemini, reranker, token_features
+):
+    if not re_rank:
+        return docs[:top_k], None
+    candidates = len(docs)
+    start = time.perf_counter()
+    if reranker is not None:
+        docs = reranker.rerank(query, docs, top_k=top_k)
+        backend = type(reranker).__name__
+    else:
         # reranker will fallback to lexical scoring if call_gemini is None
-        docs = rerank_documents_with_gemini(query, docs, call_gemini=call_gemini, top_k=top_k)
+        docs = rerank_documents_with_gemini(query, docs, call_gemini=call_gemini, top_k=top_k, features=token_features)
+        backend = "gemini" if call_gemini else "lexical"
+    return docs, {"backend": backend, "candidates": candidates, "latency_ms": (time.perf_counter() - start) * 1000.0}
+
+
+def _shared_chunk(chunk_pool: Dict[tuple, tuple], doc: Dict) -> Dict:
+    text = doc.get("text", "")
+    shared_text, shared_metadata = chunk_pool.setdefault((doc.get("id"), text), (text, doc.get("metadata", {})))
+    return dict(doc, text=shared_text, metadata=shared_metadata)
 
-    return {"query": query, "results": docs, "raw_response": resp}
+
+def _candidates(resp: Dict, lexical_resp: Optional[Dict], fusion: str, fusion_alpha: float) -> List[Dict]:
+    if lexical_resp is None:
+        return docs_from_response(resp)
+    return fuse_results(
+        [docs_from_response(resp), docs_from_response(lexical_resp)],
+        method=fusion,
+        weights=[fusion_alpha, 1.0 - fusion_alpha] if fusion == "weighted" else None,
+    )
+
+
+def _retrieval_output(
+    query: str, docs: List[Dict], resp: Dict, lexical_resp: Optional[Dict], rerank_info: Optional[Dict]
+) -> Dict:
+    current_span().set(
+        results=len(docs),
+        hybrid=lexical_resp is not None,
+        candidates=rerank_info["candidates"] if rerank_info else len(docs),
+    )
+    out = {"query": query, "results": docs, "raw_response": resp}
+    if rerank_info is not None:
+        out["rerank"] = rerank_info
+    if lexical_resp is not None:
+        out["lexical_response"] = lexical_resp
+    return out
 
 
-__all__ = ["retrieve_documents"]
+__all__ = [
+    "retrieve_documents",
+    "retrieve_documents_async",
+    "retrieve_documents_batch",
+    "docs_from_response",
+    "fuse_results",
+]
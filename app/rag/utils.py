@@ -1,25 +1,26 @@
-import uuid
 from typing import List, Dict, Optional
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from app.rag.chunker import LengthSpec, get_chunker
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50, source_id: Optional[str] = None) -> List[Dict]:
-    """Use LangChain's RecursiveCharacterTextSplitter to create chunks.
 
-    Returns list of dicts: {"source_id", "position", "text"}.
+def chunk_text(
+    text: str,
+    chunk_size: int = 500,
+    overlap: int = 50,
+    source_id: Optional[str] = None,
+    length: LengthSpec = "chars",
+) -> List[Dict]:
+    """Split `text` with the shared offset-based `Chunker` (LangChain-compatible splits).
+
+    Returns list of dicts: {"source_id", "position", "text", "start", "end"},
+    where `start`/`end` are character offsets into `text`. `chunk_size` and
+    `overlap` are in characters, or in tokens with `length="tokens"` (or a
+    tokenizer name). Without a `source_id` one is derived from the text, so
+    re-chunking is deterministic.
     """
     if not text:
         return []
-
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=overlap,
-        separators=["\n\n", "\n", ". ", "! ", "? ", " "]
-    )
-
-    texts = splitter.split_text(text)
-    base_id = source_id or str(uuid.uuid4())
-    return [{"source_id": base_id, "position": i, "text": t} for i, t in enumerate(texts)]
+    return get_chunker(chunk_size, overlap, length=length).chunk(text, source_id=source_id)
 
 
 if __name__ == "__main__":
@@ -1,86 +1,525 @@
+import os
 import json
+import asyncio
+import time
+import zlib
+import hashlib
 import logging
-import re
-from typing import List, Dict, Callable, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Dict, Callable, Iterable, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from app.async_utils import ProcessSingleton, call_maybe_async, run_blocking
+from app.cache import LRUCache, identity_key
+from app.gemini_client import DEFAULT_GEMINI_MODEL
+from app.lexical_index import tokenize
+from app.telemetry import current_span, traced
 
 logger = logging.getLogger(__name__)
 
 
-def _simple_lexical_score(query: str, text: str) -> int:
-    q_tokens = set(re.findall(r"\w+", query.lower()))
-    t_tokens = set(re.findall(r"\w+", text.lower()))
-    return len(q_tokens & t_tokens)
+def token_hashes(text: str) -> np.ndarray:
+    """Sorted unique CRC32 hashes of the tokens of `text` (stable across processes)."""
+    return np.unique(np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokenize(text)), dtype=np.uint32))
+
+
+class TokenFeatureStore:
+    """Side store of per-document token hashes computed once at ingest.
+
+    Lets the lexical reranker score documents without re-tokenizing their text
+    on every query. Filled by `upsert_documents(token_features=...)`.
+    """
+
+    def __init__(self):
+        self._features: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def add(self, doc_id: str, text: str) -> None:
+        features = token_hashes(text)
+        with self._lock:
+            self._features[doc_id] = features
+
+    def add_documents(self, docs: Iterable[Dict], ids: Sequence[str]) -> None:
+        for doc_id, d in zip(ids, docs):
+            self.add(doc_id, d.get("text", ""))
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                self._features.pop(doc_id, None)
+
+    def get(self, doc_id: Any) -> Optional[np.ndarray]:
+        return self._features.get(doc_id)
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def save(self, path: str) -> None:
+        """Write all features to one `.npz` file (flat hashes + offsets + ids)."""
+        with self._lock:
+            ids = list(self._features)
+            arrays = [self._features[i] for i in ids]
+        lengths = np.array([a.size for a in arrays], dtype=np.int64)
+        flat = np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.uint32)
+        # a fixed-width string array, so loading never needs pickle
+        np.savez(path, hashes=flat, lengths=lengths, ids=np.asarray(ids, dtype=str))
 
+    @classmethod
+    def load(cls, path: str) -> "TokenFeatureStore":
+        store = cls()
+        with np.load(path, allow_pickle=False) as data:
+            offsets = np.concatenate([[0], np.cumsum(data["lengths"])])
+            flat = data["hashes"]
+            for i, doc_id in enumerate(data["ids"]):
+                store._features[str(doc_id)] = flat[offsets[i] : offsets[i + 1]]
+        return store
 
+
+class RerankResult(NamedTuple):
+    """A reranked document by reference, without copying its dict."""
+
+    doc: Dict
+    score: float
+    rationale: str
+
+    def to_dict(self) -> Dict:
+        return dict(self.doc, rerank_score=self.score, rerank_rationale=self.rationale)
+
+
+def lexical_scores(query: str, docs: Sequence[Dict], features: Optional[TokenFeatureStore] = None) -> np.ndarray:
+    """Unique-token overlap between `query` and each doc, computed in one batch.
+
+    Token hashes come from `features` (by doc id), then `metadata["token_hashes"]`,
+    and only as a last resort from tokenizing the doc text.
+    """
+    q = token_hashes(query)
+    if not docs or not q.size:
+        return np.zeros(len(docs), dtype=np.float32)
+    per_doc = []
+    for d in docs:
+        h = features.get(d.get("id")) if features is not None else None
+        if h is None:
+            meta_hashes = (d.get("metadata") or {}).get("token_hashes")
+            h = np.asarray(meta_hashes, dtype=np.uint32) if meta_hashes is not None else token_hashes(d.get("text", ""))
+        per_doc.append(h)
+    lengths = np.fromiter((h.size for h in per_doc), dtype=np.int64, count=len(per_doc))
+    flat = np.concatenate(per_doc)
+    owner = np.repeat(np.arange(len(per_doc)), lengths)
+    hits = np.isin(flat, q, assume_unique=False)
+    return np.bincount(owner[hits], minlength=len(per_doc)).astype(np.float32)
+
+
+def rerank_lexical(
+    query: str,
+    docs: Sequence[Dict],
+    top_k: Optional[int] = None,
+    features: Optional[TokenFeatureStore] = None,
+) -> List[RerankResult]:
+    """Rank `docs` by lexical overlap; returns lightweight `RerankResult` records."""
+    scores = lexical_scores(query, docs, features=features)
+    order = np.argsort(-scores, kind="stable")
+    if top_k:
+        order = order[:top_k]
+    return [RerankResult(docs[i], float(scores[i]), f"lexical_overlap={int(scores[i])}") for i in order]
+
+
+_executor = ProcessSingleton(lambda: ThreadPoolExecutor(max_workers=8, thread_name_prefix="rerank"))
+
+# (scorer, query hash, doc id, text hash) -> (score, rationale) from successful Gemini shards
+_gemini_score_cache = LRUCache(int(os.getenv("RERANK_CACHE_SIZE", "10000")))
+_gemini_score_cache_version: Optional[int] = None
+_gemini_score_cache_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    return _executor.get()
+
+
+def _doc_id(doc: Dict) -> str:
+    return doc.get("id") or doc.get("source_id") or ""
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _scorer_identity(call_gemini: Callable) -> tuple:
+    # the module-level call_gemini uses the default client, whose model comes from the environment
+    return (identity_key(call_gemini), os.getenv("GEMINI_MODEL", DEFAULT_GEMINI_MODEL))
+
+
+def _default_score_cache() -> LRUCache:
+    """The process-wide score cache, emptied whenever the corpus version changes."""
+    global _gemini_score_cache_version
+    # imported here: app.vectorstore imports this module
+    from app.vectorstore import get_corpus_version
+
+    version = get_corpus_version()
+    with _gemini_score_cache_lock:
+        if version != _gemini_score_cache_version:
+            _gemini_score_cache.clear()
+            _gemini_score_cache_version = version
+    return _gemini_score_cache
+
+
+def _gemini_rerank_prompt(query: str, docs: Sequence[Dict], max_passage_chars: Optional[int]) -> str:
+    prompt_lines = [
+        "You are a relevance scorer. Given a user query, score each document between 0 and 1 and include a brief rationale.",
+        "Return a JSON array of objects with fields: id, score (0-1), rationale. Respond with JSON only.",
+    ]
+    prompt_lines.append(f"Query: {query}")
+    prompt_lines.append("Documents:")
+    for d in docs:
+        text = d.get("text", "")
+        if max_passage_chars and len(text) > max_passage_chars:
+            text = text[:max_passage_chars]
+        prompt_lines.append(f"ID: {_doc_id(d)}\nText: {text}\n---")
+    return "\n".join(prompt_lines)
+
+
+def _parse_shard_scores(resp: str) -> Dict[str, tuple]:
+    parsed = json.loads(resp)
+    return {
+        item.get("id"): (float(item.get("score", 0.0)), item.get("rationale", ""))
+        for item in parsed
+        if item.get("id") is not None
+    }
+
+
+def _score_shard(
+    query: str, shard: Sequence[Dict], call_gemini: Callable[[str], str], max_passage_chars: Optional[int]
+) -> Optional[Dict[str, tuple]]:
+    """Score one shard with Gemini; returns `{doc id: (score, rationale)}` or None on failure."""
+    try:
+        return _parse_shard_scores(call_gemini(_gemini_rerank_prompt(query, shard, max_passage_chars)))
+    except Exception:
+        logger.exception("Gemini rerank failed for a shard of %d documents", len(shard))
+        return None
+
+
+async def _score_shard_async(
+    query: str,
+    shard: Sequence[Dict],
+    call_gemini: Callable,
+    max_passage_chars: Optional[int],
+    timeout: Optional[float],
+) -> Optional[Dict[str, tuple]]:
+    try:
+        prompt = _gemini_rerank_prompt(query, shard, max_passage_chars)
+        resp = await asyncio.wait_for(call_maybe_async(call_gemini, prompt), timeout)
+        return _parse_shard_scores(resp)
+    except asyncio.TimeoutError:
+        logger.warning("Gemini rerank timed out for a shard of %d documents", len(shard))
+        return None
+    except Exception:
+        logger.exception("Gemini rerank failed for a shard of %d documents", len(shard))
+        return None
+
+
+def _plan_shards(
+    query: str, docs: Sequence[Dict], shard_size: Optional[int], cache: LRUCache, call_gemini: Callable
+):
+    """Split `docs` into cached scores and shards of documents still to score."""
+    shard_size = shard_size or int(os.getenv("RERANK_SHARD_SIZE", "8"))
+    query_key = (_scorer_identity(call_gemini), _text_hash(query))
+    scored: Dict[str, tuple] = {}
+    pending = []
+    for d in docs:
+        hit = cache.get(query_key + (_doc_id(d), _text_hash(d.get("text", ""))))
+        if hit is None:
+            pending.append(d)
+        else:
+            scored[_doc_id(d)] = hit
+    shards = [pending[i : i + shard_size] for i in range(0, len(pending), shard_size)]
+    return query_key, scored, shards
+
+
+def _merge_shards(
+    query: str,
+    docs: Sequence[Dict],
+    query_key: tuple,
+    scored: Dict[str, tuple],
+    shards: List[List[Dict]],
+    results: List[Optional[Dict[str, tuple]]],
+    cache: LRUCache,
+    top_k: Optional[int],
+    features: Optional[TokenFeatureStore],
+) -> Optional[List[Dict]]:
+    """Combine shard results; None means every shard failed and nothing was cached."""
+    failed: List[Dict] = []
+    for shard, result in zip(shards, results):
+        if result is None:
+            failed.extend(shard)
+            continue
+        for d in shard:
+            did = _doc_id(d)
+            if did in result:
+                scored[did] = result[did]
+                cache.put(query_key + (did, _text_hash(d.get("text", ""))), result[did])
+
+    if not scored and failed:
+        return None
+    if failed:
+        n_terms = max(token_hashes(query).size, 1)
+        for d, overlap in zip(failed, lexical_scores(query, failed, features=features)):
+            scored[_doc_id(d)] = (float(overlap) / n_terms, f"lexical_overlap={int(overlap)}")
+    ranked = [RerankResult(d, *scored.get(_doc_id(d), (0.0, ""))) for d in docs]
+    ranked.sort(key=lambda r: r.score, reverse=True)
+    if top_k:
+        ranked = ranked[:top_k]
+    return [r.to_dict() for r in ranked]
+
+
+@traced("rerank")
 def rerank_documents_with_gemini(
     query: str,
     docs: List[Dict],
     call_gemini: Optional[Callable[[str], str]] = None,
     top_k: Optional[int] = None,
+    features: Optional[TokenFeatureStore] = None,
+    shard_size: Optional[int] = None,
+    max_passage_chars: Optional[int] = None,
+    score_cache: Optional[LRUCache] = None,
 ) -> List[Dict]:
     """Rerank `docs` for `query` using Gemini if provided, otherwise fallback.
 
     - `docs` should be a list of dicts containing at least `text` and an `id` or `source_id`.
-    - If `call_gemini` is provided, it will be invoked with a prompt asking for a
-      JSON array of `{id, score, rationale}`. The function will parse and apply
-      those scores to the documents.
+    - If `call_gemini` is provided, documents are split into shards of
+      `shard_size` (or `RERANK_SHARD_SIZE`, default 8) and each shard is scored
+      concurrently with a prompt asking for a JSON array of `{id, score, rationale}`.
+      Passages are cut to `max_passage_chars` (or `RERANK_MAX_PASSAGE_CHARS`, default 1500).
+    - Scores are cached per (scorer, query, doc id, doc text) in `score_cache`
+      (a process-wide `LRUCache` by default, emptied when the corpus version
+      changes), so repeated queries only send unscored documents.
+    - If a shard fails, only its documents fall back to lexical overlap (scaled
+      to 0-1); if every shard fails the whole list is scored lexically.
+    - The fallback lexical scorer uses precomputed token hashes from `features`
+      when available and only copies the `top_k` documents it returns.
     - Returns the documents annotated with `rerank_score` and `rerank_rationale`, sorted descending.
     """
     if not docs:
         return []
 
     if call_gemini:
-        prompt_lines = [
-            "You are a relevance scorer. Given a user query, score each document between 0 and 1 and include a brief rationale.",
-            "Return a JSON array of objects with fields: id, score (0-1), rationale. Respond with JSON only.",
-        ]
-        prompt_lines.append(f"Query: {query}")
-        prompt_lines.append("Documents:")
-        for d in docs:
-            did = d.get("id") or d.get("source_id") or ""
-            text = d.get("text", "")
-            prompt_lines.append(f"ID: {did}\nText: {text}\n---")
-
-        prompt = "\n".join(prompt_lines)
-        try:
-            resp = call_gemini(prompt)
-            parsed = json.loads(resp)
-            id_map = {item.get("id"): item for item in parsed if item.get("id") is not None}
-            out = []
-            for d in docs:
-                did = d.get("id") or d.get("source_id") or ""
-                item = id_map.get(did)
-                if item:
-                    score = float(item.get("score", 0.0))
-                    rationale = item.get("rationale", "")
-                else:
-                    score = 0.0
-                    rationale = ""
-                new = dict(d)
-                new["rerank_score"] = score
-                new["rerank_rationale"] = rationale
-                out.append(new)
-            out.sort(key=lambda x: x["rerank_score"], reverse=True)
-            if top_k:
-                out = out[:top_k]
+        if max_passage_chars is None:
+            max_passage_chars = int(os.getenv("RERANK_MAX_PASSAGE_CHARS", "1500"))
+        cache = score_cache if score_cache is not None else _default_score_cache()
+        query_key, scored, shards = _plan_shards(query, docs, shard_size, cache, call_gemini)
+        current_span().set(backend="gemini", candidates=len(docs), cache_hits=len(scored), shards=len(shards))
+        if len(shards) == 1:
+            results = [_score_shard(query, shards[0], call_gemini, max_passage_chars)]
+        else:
+            futures = [
+                _get_executor().submit(_score_shard, query, shard, call_gemini, max_passage_chars) for shard in shards
+            ]
+            results = [f.result() for f in futures]
+
+        out = _merge_shards(query, docs, query_key, scored, shards, results, cache, top_k, features)
+        if out is not None:
             return out
-        except Exception:
-            logger.exception("Gemini rerank failed, falling back to lexical scorer")
+        logger.warning("Gemini rerank failed for every shard, falling back to lexical scorer")
 
     # Fallback lexical scorer
-    scored = []
-    for d in docs:
-        text = d.get("text", "")
-        score = _simple_lexical_score(query, text)
-        new = dict(d)
-        new["rerank_score"] = float(score)
-        new["rerank_rationale"] = f"lexical_overlap={score}"
-        scored.append(new)
+    current_span().set(backend="lexical", candidates=len(docs))
+    return [r.to_dict() for r in rerank_lexical(query, docs, top_k=top_k, features=features)]
 
-    scored.sort(key=lambda x: x["rerank_score"], reverse=True)
-    if top_k:
-        scored = scored[:top_k]
-    return scored
+
+@traced("rerank")
+async def rerank_documents_with_gemini_async(
+    query: str,
+    docs: List[Dict],
+    call_gemini: Optional[Callable] = None,
+    top_k: Optional[int] = None,
+    features: Optional[TokenFeatureStore] = None,
+    shard_size: Optional[int] = None,
+    max_passage_chars: Optional[int] = None,
+    score_cache: Optional[LRUCache] = None,
+    shard_timeout: Optional[float] = None,
+) -> List[Dict]:
+    """Async `rerank_documents_with_gemini`: shards are awaited concurrently.
+
+    `call_gemini` may be a coroutine function (e.g. `call_gemini_async`) or a
+    plain callable, which runs on the shared blocking executor. A shard that
+    exceeds `shard_timeout` seconds is cancelled and scored lexically.
+    """
+    if not docs:
+        return []
+
+    if call_gemini:
+        if max_passage_chars is None:
+            max_passage_chars = int(os.getenv("RERANK_MAX_PASSAGE_CHARS", "1500"))
+        cache = score_cache if score_cache is not None else _default_score_cache()
+        query_key, scored, shards = _plan_shards(query, docs, shard_size, cache, call_gemini)
+        current_span().set(backend="gemini", candidates=len(docs), cache_hits=len(scored), shards=len(shards))
+        results = await asyncio.gather(
+            *(_score_shard_async(query, shard, call_gemini, max_passage_chars, shard_timeout) for shard in shards)
+        )
+        out = _merge_shards(query, docs, query_key, scored, shards, list(results), cache, top_k, features)
+        if out is not None:
+            return out
+        logger.warning("Gemini rerank failed for every shard, falling back to lexical scorer")
+
+    return [r.to_dict() for r in rerank_lexical(query, docs, top_k=top_k, features=features)]
+
+
+DEFAULT_CROSS_ENCODER = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class CrossEncoderReranker:
+    """Rerank with a local sentence-transformers cross-encoder on CPU.
+
+    - (query, passage) pairs are scored in batches of `batch_size`; pairs are
+      sorted by length first so each batch pads to similar lengths.
+    - Passages are cut to roughly `max_length` tokens minus the query before
+      tokenization, so long chunks don't pay for text the model would drop.
+    - Scores are cached in an LRU keyed by (model, query hash, doc id, text
+      hash), so repeated queries only score new or edited candidates; the
+      cache is emptied whenever the corpus version changes.
+    - `model` may be any object with `predict(pairs, batch_size=...)`; by default
+      `model_name` (or `RERANKER_MODEL`) is loaded lazily on first use.
+    """
+
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        model: Optional[Any] = None,
+        batch_size: int = 32,
+        max_length: int = 256,
+        cache_size: int = 10000,
+        device: Optional[str] = None,
+    ):
+        self.model_name = model_name or os.getenv("RERANKER_MODEL", DEFAULT_CROSS_ENCODER)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.device = device or os.getenv("RERANKER_DEVICE", "cpu")
+        self._model = model
+        self._model_lock = threading.Lock()
+        self._cache = LRUCache(cache_size)
+        self._cache_version: Optional[int] = None
+        self._stats_lock = threading.Lock()
+        self._calls = 0
+        self._pairs_scored = 0
+        self._total_ms = 0.0
+
+    @property
+    def model(self) -> Any:
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    logger.info("Loading cross-encoder '%s' on %s", self.model_name, self.device)
+                    self._model = CrossEncoder(self.model_name, device=self.device, max_length=self.max_length)
+        return self._model
+
+    def _truncate(self, query_tokens: int, text: str) -> str:
+        budget = max(self.max_length - query_tokens, 16)
+        words = text.split()
+        return text if len(words) <= budget else " ".join(words[:budget])
+
+    def _cache_key(self, query_hash: str, doc: Dict) -> tuple:
+        text_hash = _text_hash(doc.get("text", ""))
+        did = doc.get("id") or doc.get("source_id") or text_hash
+        return (self.model_name, query_hash, did, text_hash)
+
+    def _check_corpus_version(self) -> None:
+        # imported here: app.vectorstore imports this module
+        from app.vectorstore import get_corpus_version
+
+        version = get_corpus_version()
+        with self._stats_lock:
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+
+    def score(self, query: str, docs: Sequence[Dict]) -> np.ndarray:
+        """Cross-encoder scores for `docs`, reusing cached (query, doc) scores."""
+        start = time.perf_counter()
+        self._check_corpus_version()
+        query_hash = _text_hash(query)
+        keys = [self._cache_key(query_hash, d) for d in docs]
+        scores = np.zeros(len(docs), dtype=np.float32)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self._cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                scores[i] = cached
+
+        if missing:
+            query_tokens = len(query.split())
+            passages = {i: self._truncate(query_tokens, docs[i].get("text", "")) for i in missing}
+            missing.sort(key=lambda i: len(passages[i]))
+            pairs = [(query, passages[i]) for i in missing]
+            predicted = np.asarray(self.model.predict(pairs, batch_size=self.batch_size), dtype=np.float32)
+            for i, value in zip(missing, predicted.reshape(len(missing), -1)[:, 0]):
+                scores[i] = value
+                self._cache.put(keys[i], float(value))
+        current_span().set(cache_hits=len(docs) - len(missing), pairs_scored=len(missing))
+
+        with self._stats_lock:
+            self._calls += 1
+            self._pairs_scored += len(missing)
+            self._total_ms += (time.perf_counter() - start) * 1000.0
+        return scores
+
+    @traced("rerank")
+    def rerank(self, query: str, docs: Sequence[Dict], top_k: Optional[int] = None) -> List[Dict]:
+        """Return `docs` sorted by cross-encoder score with `rerank_score`/`rerank_rationale`."""
+        if not docs:
+            return []
+        current_span().set(backend="cross_encoder", candidates=len(docs))
+        scores = self.score(query, docs)
+        order = np.argsort(-scores, kind="stable")
+        if top_k:
+            order = order[:top_k]
+        return [RerankResult(docs[i], float(scores[i]), "cross_encoder").to_dict() for i in order]
+
+    async def rerank_async(self, query: str, docs: Sequence[Dict], top_k: Optional[int] = None) -> List[Dict]:
+        """`rerank` on the shared blocking executor, leaving the event loop free."""
+        return await run_blocking(self.rerank, query, docs, top_k)
+
+    def stats(self) -> Dict[str, Any]:
+        cache = self._cache.stats()
+        with self._stats_lock:
+            return {
+                "model": self.model_name,
+                "calls": self._calls,
+                "pairs_scored": self._pairs_scored,
+                "cache_hits": cache["hits"],
+                "cache_hit_rate": cache["hit_rate"],
+                "total_ms": self._total_ms,
+                "mean_ms": self._total_ms / self._calls if self._calls else 0.0,
+            }
+
+
+_default_reranker: Optional[CrossEncoderReranker] = None
+_default_lock = threading.Lock()
+
+
+def get_default_reranker() -> Optional[CrossEncoderReranker]:
+    """Return the process-wide cross-encoder when `RERANKER_BACKEND=cross_encoder`, else None."""
+    global _default_reranker
+    if os.getenv("RERANKER_BACKEND", "").lower().replace("-", "_") != "cross_encoder":
+        return None
+    if _default_reranker is None:
+        with _default_lock:
+            if _default_reranker is None:
+                _default_reranker = CrossEncoderReranker()
+    return _default_reranker
 
 
-__all__ = ["rerank_documents_with_gemini"]
+__all__ = [
+    "rerank_documents_with_gemini",
+    "rerank_documents_with_gemini_async",
+    "CrossEncoderReranker",
+    "get_default_reranker",
+    "rerank_lexical",
+    "lexical_scores",
+    "token_hashes",
+    "TokenFeatureStore",
+    "RerankResult",
+]
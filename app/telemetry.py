@@ -1,29 +1,485 @@
+import os
 import json
 import time
-from typing import Dict, Any
+import atexit
+import inspect
+import logging
+import functools
+import itertools
+import threading
+import contextvars
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# -- buffered sink ---------------------------------------------------------------
+
+
+class BufferedSink:
+    """Background JSON-lines writer: `write` never touches the disk.
+
+    - Records are buffered in memory (at most `max_buffer`; when full, new
+      records are dropped and counted) and written by one daemon thread in
+      batches of up to `batch_size`, at least every `flush_interval` seconds.
+    - When the file reaches `max_bytes` it is rotated to `<path>.1` ...
+      `<path>.<backups>`, dropping the oldest.
+    - In a forked child the sink starts over with its own writer thread and
+      file, `<path>.<pid>`; records still queued in the parent stay there.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 10 * 2**20,
+        backups: int = 3,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: deque = deque()
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._closed = False
+        self._written = 0
+        self._dropped = 0
+        self._rotations = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="telemetry-sink", daemon=True)
+        self._thread.start()
+        _live_sinks.add(self)
+
+    def _after_fork(self) -> None:
+        # the writer thread did not survive the fork and the parent still owns the file
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._inflight = 0
+        if self._closed:
+            return
+        self.path = f"{self.path}.{os.getpid()}"
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="telemetry-sink", daemon=True)
+        self._thread.start()
+
+    def write(self, record: Dict[str, Any]) -> bool:
+        """Queue `record`; returns False if it was dropped (buffer full or sink closed)."""
+        with self._cond:
+            if self._closed or len(self._buffer) >= self.max_buffer:
+                self._dropped += 1
+                return False
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is on disk; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._buffer or self._inflight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.1)
+        return True
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "buffered": len(self._buffer),
+                "written": self._written,
+                "dropped": self._dropped,
+                "rotations": self._rotations,
+            }
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._buffer and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                if not self._buffer:
+                    if self._closed:
+                        return
+                    continue
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                self._inflight = len(batch)
+            try:
+                self._file.write("".join(json.dumps(r, default=str) + "\n" for r in batch))
+                self._file.flush()
+                if self._file.tell() >= self.max_bytes:
+                    self._rotate()
+            except Exception:
+                logger.exception("Telemetry sink failed to write %d records to %s", len(batch), self.path)
+            with self._cond:
+                self._written += len(batch)
+                self._inflight = 0
+                self._cond.notify_all()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._rotations += 1
+
+
+_live_sinks: "weakref.WeakSet[BufferedSink]" = weakref.WeakSet()
+_sinks: Dict[str, BufferedSink] = {}
+_sinks_lock = threading.Lock()
+
+
+def get_sink(path: str) -> BufferedSink:
+    """Shared `BufferedSink` per file path (closed at interpreter exit)."""
+    path = os.path.abspath(path)
+    sink = _sinks.get(path)
+    if sink is None:
+        with _sinks_lock:
+            sink = _sinks.get(path)
+            if sink is None:
+                sink = _sinks[path] = BufferedSink(
+                    path, max_bytes=int(os.getenv("TELEMETRY_MAX_BYTES", str(10 * 2**20)))
+                )
+    return sink
+
+
+def flush_telemetry(timeout: Optional[float] = None) -> None:
+    """Wait until every sink has written what was queued so far."""
+    for sink in list(_sinks.values()):
+        sink.flush(timeout)
+
+
+@atexit.register
+def _close_sinks() -> None:
+    for sink in list(_sinks.values()):
+        sink.close()
 
 
 def log_interaction(logfile: str, interaction: Dict[str, Any]) -> None:
-    """Append an interaction JSON object to `logfile` with a timestamp."""
+    """Append an interaction JSON object to `logfile` with a timestamp.
+
+    The write is buffered and done by a background thread (see `BufferedSink`);
+    call `flush_telemetry()` to wait for it.
+    """
     entry = {"ts": time.time(), "interaction": interaction}
-    with open(logfile, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry) + "\n")
+    get_sink(logfile).write(entry)
+
+
+# -- rolling histograms ----------------------------------------------------------
+
+
+class RollingHistogram:
+    """Quantiles over the last `window` observations, plus lifetime count and sum."""
+
+    def __init__(self, window: int = 2048):
+        self._values = np.zeros(window, dtype=np.float64)
+        self._next = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self._values.size
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self, qs: Sequence[float] = QUANTILES) -> List[float]:
+        filled = self._values[: min(self.count, self._values.size)]
+        if not filled.size:
+            return [0.0] * len(qs)
+        return [float(v) for v in np.quantile(filled, qs)]
+
+
+class MetricsRegistry:
+    """Per-span latency histograms, error counts and sums of numeric span attributes."""
+
+    def __init__(self, window: int = 2048):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latency: Dict[str, RollingHistogram] = {}
+        self._errors: Dict[str, int] = {}
+        self._attributes: Dict[tuple, float] = {}
+
+    def record(self, name: str, seconds: float, attrs: Dict[str, Any], error: bool = False) -> None:
+        with self._lock:
+            hist = self._latency.get(name)
+            if hist is None:
+                hist = self._latency[name] = RollingHistogram(self.window)
+            hist.observe(seconds)
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+            for key, value in attrs.items():
+                # bools count occurrences (e.g. cache_hit), numbers are summed (e.g. batch sizes)
+                if isinstance(value, (bool, int, float)):
+                    self._attributes[(name, key)] = self._attributes.get((name, key), 0.0) + float(value)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """`{span: {"count", "sum_s", "p50_ms", "p95_ms", "p99_ms", "errors"}}`."""
+        with self._lock:
+            out = {}
+            for name, hist in self._latency.items():
+                p50, p95, p99 = hist.quantiles()
+                out[name] = {
+                    "count": hist.count,
+                    "sum_s": hist.sum,
+                    "p50_ms": p50 * 1000.0,
+                    "p95_ms": p95 * 1000.0,
+                    "p99_ms": p99 * 1000.0,
+                    "errors": self._errors.get(name, 0),
+                }
+            return out
+
+    def prometheus_text(self, prefix: str = "rag") -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            lines = [
+                f"# HELP {prefix}_span_seconds Latency of instrumented stages (quantiles over a rolling window).",
+                f"# TYPE {prefix}_span_seconds summary",
+            ]
+            for name in sorted(self._latency):
+                hist = self._latency[name]
+                for q, v in zip(QUANTILES, hist.quantiles()):
+                    lines.append(f'{prefix}_span_seconds{{span="{name}",quantile="{q}"}} {v!r}')
+                lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {hist.sum!r}')
+                lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {hist.count}')
+            lines += [
+                f"# HELP {prefix}_span_errors_total Spans that ended with an exception.",
+                f"# TYPE {prefix}_span_errors_total counter",
+            ]
+            for name in sorted(self._errors):
+                lines.append(f'{prefix}_span_errors_total{{span="{name}"}} {self._errors[name]}')
+            lines += [
+                f"# HELP {prefix}_span_attribute_total Sum of numeric span attributes (batch sizes, cache hits, prompt sizes).",
+                f"# TYPE {prefix}_span_attribute_total counter",
+            ]
+            for (name, key) in sorted(self._attributes):
+                lines.append(
+                    f'{prefix}_span_attribute_total{{span="{name}",attribute="{key}"}} {self._attributes[(name, key)]!r}'
+                )
+        dropped = sum(s.stats()["dropped"] for s in list(_sinks.values()))
+        lines += [
+            f"# HELP {prefix}_telemetry_dropped_total Telemetry records dropped because a sink buffer was full.",
+            f"# TYPE {prefix}_telemetry_dropped_total counter",
+            f"{prefix}_telemetry_dropped_total {dropped}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._latency.clear()
+            self._errors.clear()
+            self._attributes.clear()
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+def prometheus_metrics() -> str:
+    """The process-wide metrics in Prometheus text format (serve it on `/metrics`)."""
+    return _registry.prometheus_text()
+
+
+# -- spans -----------------------------------------------------------------------
+
+
+class Span:
+    """One timed stage. Attributes set with `set` go to the sink record and metrics."""
+
+    __slots__ = ("name", "attrs", "span_id", "trace_id", "parent_id", "start", "duration")
+
+    def __init__(self, name: str, attrs: Dict[str, Any], parent: Optional["Span"]):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(_span_ids)
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = 0.0
+        self.duration = 0.0
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+_span_ids = itertools.count(1)
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("telemetry_span", default=None)
+_enabled = os.getenv("TELEMETRY_ENABLED", "1").lower() not in ("0", "false", "no")
+_span_sink: Optional[BufferedSink] = get_sink(os.environ["TELEMETRY_LOG_PATH"]) if os.getenv("TELEMETRY_LOG_PATH") else None
+
+
+def _after_fork_in_child() -> None:
+    global _sinks_lock
+    _sinks_lock = threading.Lock()
+    # each worker reports its own spans, not the parent's preload
+    _registry._lock = threading.Lock()
+    _registry.clear()
+    for sink in list(_live_sinks):
+        sink._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def configure_telemetry(enabled: Optional[bool] = None, sink: Any = False) -> None:
+    """Switch span recording on/off and set where span records go.
+
+    `sink` is a `BufferedSink`, a file path, or None to stop writing records;
+    by default spans only feed the in-memory metrics (`TELEMETRY_LOG_PATH` sets
+    a file sink at import, `TELEMETRY_ENABLED=0` turns spans off).
+    """
+    global _enabled, _span_sink
+    if enabled is not None:
+        _enabled = enabled
+    if sink is not False:
+        _span_sink = get_sink(sink) if isinstance(sink, str) else sink
+
+
+def current_span():
+    """The innermost active span, or a no-op stand-in, so `current_span().set(...)` is always safe."""
+    return _current.get() or _NOOP
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Any]:
+    """Time the enclosed block as span `name`; nested spans share a trace id."""
+    if not _enabled:
+        yield _NOOP
+        return
+    s = Span(name, attrs, _current.get())
+    token = _current.set(s)
+    error = None
+    s.start = time.perf_counter()
+    try:
+        yield s
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        s.duration = time.perf_counter() - s.start
+        _current.reset(token)
+        if error is not None:
+            s.attrs["error"] = type(error).__name__
+        _finish(s, error is not None)
+
+
+def _finish(s: Span, error: bool) -> None:
+    _registry.record(s.name, s.duration, s.attrs, error=error)
+    sink = _span_sink
+    if sink is not None:
+        sink.write(
+            {
+                "ts": time.time(),
+                "trace": s.trace_id,
+                "span": s.span_id,
+                "parent": s.parent_id,
+                "name": s.name,
+                "duration_ms": s.duration * 1000.0,
+                "attrs": s.attrs,
+            }
+        )
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """Decorator form of `span` for plain and `async def` functions.
+
+    A function that returns an iterator is only timed until it returns it.
+    """
+
+    def decorate(fn: Callable) -> Callable:
+        label = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(label):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
 
 
 def collect_metrics(interaction: Dict[str, Any]) -> Dict[str, Any]:
     """Collect simple metrics from an interaction dict.
 
-    Example metrics: answer length, number of sources, retrieval time (if provided).
+    Example metrics: answer length, number of sources, retrieval time (if provided),
+    rerank backend and latency, and time-to-first-token for streamed answers.
     """
     metrics = {}
     ans = interaction.get("answer") or ""
     metrics["answer_chars"] = len(ans)
     metrics["num_sources"] = len(interaction.get("sources", []))
+    if interaction.get("ttft_ms") is not None:
+        metrics["ttft_ms"] = interaction["ttft_ms"]
     if "retrieval" in interaction and isinstance(interaction["retrieval"], dict):
         # try to extract number of retrieved items
         results = interaction["retrieval"].get("results") or []
         metrics["retrieved_items"] = len(results)
+        rerank = interaction["retrieval"].get("rerank")
+        if isinstance(rerank, dict):
+            metrics["rerank_backend"] = rerank.get("backend")
+            metrics["rerank_ms"] = rerank.get("latency_ms")
     return metrics
 
 
-__all__ = ["log_interaction", "collect_metrics"]
+__all__ = [
+    "BufferedSink",
+    "MetricsRegistry",
+    "RollingHistogram",
+    "Span",
+    "collect_metrics",
+    "configure_telemetry",
+    "current_span",
+    "flush_telemetry",
+    "get_metrics_registry",
+    "get_sink",
+    "log_interaction",
+    "prometheus_metrics",
+    "span",
+    "traced",
+]
@@ -1,16 +1,46 @@
 import os
-import uuid
 import logging
-from typing import List, Dict, Optional
+import threading
+from typing import TYPE_CHECKING, List, Dict, Optional
 
-import pinecone
+import numpy as np
 
-from app.embeddings import embed_texts, load_embedding_model
+from app.async_utils import run_blocking
+from app.chunk_store import ChunkStore, get_default_chunk_store, without_text
+from app.embeddings import embed_texts_array, get_embedding_model
+from app.embedding_cache import EmbeddingCache
+from app.embedding_batcher import EmbeddingBatcher, get_default_batcher, microbatch_enabled
+from app.local_index import LocalIndex
+from app.ann_index import IVFPQIndex
+from app.lexical_index import BM25Index
+from app.manifest import chunk_ids
+from app.reranker import TokenFeatureStore
+from app.telemetry import current_span, traced
+
+if TYPE_CHECKING:
+    import pinecone
 
 logger = logging.getLogger(__name__)
 
+# bumped on every write so caches derived from the corpus can tell they are stale
+_corpus_version = 0
+_corpus_lock = threading.Lock()
+
+
+def get_corpus_version() -> int:
+    """Monotonic counter of corpus writes made through this module in this process."""
+    return _corpus_version
+
+
+def bump_corpus_version() -> int:
+    """Mark the corpus as changed (called by `upsert_documents`); returns the new version."""
+    global _corpus_version
+    with _corpus_lock:
+        _corpus_version += 1
+        return _corpus_version
+
 
-def init_pinecone(index_name: str, dimension: int, metric: str = "cosine") -> pinecone.Index:
+def init_pinecone(index_name: str, dimension: int, metric: str = "cosine") -> "pinecone.Index":
     """Initialize Pinecone client and ensure index exists. Returns Index instance.
 
     Requires `PINECONE_API_KEY` and optionally `PINECONE_ENVIRONMENT` env vars.
@@ -21,6 +51,8 @@ def init_pinecone(index_name: str, dimension: int, metric: str = "cosine") -> pi
     if not api_key:
         raise EnvironmentError("PINECONE_API_KEY is not set")
 
+    import pinecone
+
     pinecone.init(api_key=api_key, environment=environment)
 
     existing = pinecone.list_indexes()
@@ -33,43 +65,192 @@ def init_pinecone(index_name: str, dimension: int, metric: str = "cosine") -> pi
     return pinecone.Index(index_name)
 
 
-def upsert_documents(docs: List[Dict], index: pinecone.Index, model: Optional[object] = None, batch_size: int = 100) -> List[str]:
+def init_index(
+    index_name: str,
+    dimension: int,
+    metric: str = "cosine",
+    backend: Optional[str] = None,
+    path: Optional[str] = None,
+):
+    """Return an index for `index_name` from the configured backend.
+
+    - `backend` (or `VECTOR_BACKEND`) is `pinecone` (default), `local` (exact
+      search) or `ivfpq` (approximate search, see `app.ann_index`).
+    - The local backends store their files under `path` (or `LOCAL_INDEX_PATH`)
+      joined with `index_name`; without either they are purely in-memory.
+    - `ivfpq` reads `ANN_NLIST`, `ANN_NPROBE` and `ANN_M`; call `index.save()`
+      after ingesting to persist it.
+    """
+    backend = (backend or os.getenv("VECTOR_BACKEND", "pinecone")).lower()
+    if backend == "pinecone":
+        return init_pinecone(index_name, dimension, metric=metric)
+    if backend == "local":
+        root = path or os.getenv("LOCAL_INDEX_PATH")
+        index_path = os.path.join(root, index_name) if root else None
+        logger.info("Opening local index '%s' at %s (dim=%s, metric=%s)", index_name, index_path or "<memory>", dimension, metric)
+        return LocalIndex(path=index_path, dimension=dimension, metric=metric)
+    if backend == "ivfpq":
+        root = path or os.getenv("LOCAL_INDEX_PATH")
+        index_path = os.path.join(root, index_name) if root else None
+        knobs = {}
+        if os.getenv("ANN_NPROBE"):
+            knobs["nprobe"] = int(os.getenv("ANN_NPROBE"))
+        if index_path and os.path.exists(os.path.join(index_path, "ids.json")):
+            logger.info("Opening IVF-PQ index '%s' at %s", index_name, index_path)
+            return IVFPQIndex.open(index_path, **knobs)
+        if os.getenv("ANN_NLIST"):
+            knobs["nlist"] = int(os.getenv("ANN_NLIST"))
+        if os.getenv("ANN_M"):
+            knobs["m"] = int(os.getenv("ANN_M"))
+        logger.info("Creating IVF-PQ index '%s' (dim=%s, metric=%s)", index_name, dimension, metric)
+        return IVFPQIndex(dimension, metric=metric, path=index_path, **knobs)
+    raise ValueError(f"Unknown vector backend '{backend}'")
+
+
+def _client_vectors(index, vectors: np.ndarray):
+    """Convert embeddings for `index`: lists for the Pinecone client, arrays as-is
+    for indexes that declare `accepts_numpy = True`."""
+    if getattr(index, "accepts_numpy", False):
+        return vectors
+    return vectors.tolist()
+
+
+def upsert_embeddings(
+    index: "pinecone.Index",
+    ids: List[str],
+    embeddings: np.ndarray,
+    metadatas: List[Dict],
+    batch_size: int = 100,
+) -> None:
+    """Upsert already-computed `embeddings` in batches of `batch_size`."""
+    for i in range(0, len(ids), batch_size):
+        # only this batch is converted to Python floats for the client
+        rows = _client_vectors(index, embeddings[i : i + batch_size])
+        index.upsert(vectors=list(zip(ids[i : i + batch_size], rows, metadatas[i : i + batch_size])))
+
+
+def upsert_documents(
+    docs: List[Dict],
+    index: "pinecone.Index",
+    model: Optional[object] = None,
+    batch_size: int = 100,
+    cache: Optional[EmbeddingCache] = None,
+    lexical_index: Optional[BM25Index] = None,
+    token_features: Optional[TokenFeatureStore] = None,
+    chunk_store: Optional[ChunkStore] = None,
+) -> List[str]:
     """Embed and upsert documents into Pinecone.
 
     `docs` is a list of dicts with keys: `id` (optional), `text`, `metadata` (optional).
+    Docs without an `id` get a deterministic one from `chunk_ids` (source id
+    and content hash), so re-upserting the same chunk overwrites it.
+    With an embedding `cache` (or a configured default cache) unchanged chunks
+    are not re-embedded on re-ingest. If `lexical_index` is given the same
+    documents are added to it under the same ids for hybrid retrieval, and
+    `token_features` gets their token hashes for the lexical reranker.
+    With a `chunk_store` (or `CHUNK_STORE_PATH`) the text goes to the store and
+    the index metadata keeps only the other fields.
     Returns list of upserted ids.
     """
     if not docs:
         return []
 
     texts = [d["text"] for d in docs]
-    model = model or load_embedding_model()
-    embeddings = embed_texts(texts, model=model)
+    model = model or get_embedding_model()
+    embeddings = embed_texts_array(texts, model=model, cache=cache)
+
+    generated = iter(chunk_ids([d for d in docs if not d.get("id")]))
+    upsert_ids = [d.get("id") or next(generated) for d in docs]
+    metadatas = [d.get("metadata", {}) for d in docs]
+    if chunk_store is None:
+        chunk_store = get_default_chunk_store()
+    if chunk_store is not None:
+        # text first, so a vector is never visible without its text
+        chunk_store.add_documents(docs, ids=upsert_ids)
+        metadatas = [without_text(m) for m in metadatas]
+    upsert_embeddings(index, upsert_ids, embeddings, metadatas, batch_size=batch_size)
 
-    upsert_ids = []
-    vectors = []
-    for d, emb in zip(docs, embeddings):
-        vid = d.get("id") or str(uuid.uuid4())
-        meta = d.get("metadata", {})
-        vectors.append((vid, emb, meta))
-        upsert_ids.append(vid)
+    if lexical_index is not None:
+        lexical_index.add_documents(docs, ids=upsert_ids)
+    if token_features is not None:
+        token_features.add_documents(docs, ids=upsert_ids)
 
-    for i in range(0, len(vectors), batch_size):
-        batch = vectors[i : i + batch_size]
-        index.upsert(vectors=batch)
+    bump_corpus_version()
 
     return upsert_ids
 
 
-def query_pinecone(query: str, index: pinecone.Index, top_k: int = 5, model: Optional[object] = None) -> Dict:
+@traced("query_pinecone")
+def query_pinecone(
+    query: str,
+    index: "pinecone.Index",
+    top_k: int = 5,
+    model: Optional[object] = None,
+    batcher: Optional[EmbeddingBatcher] = None,
+    query_vector: Optional[np.ndarray] = None,
+) -> Dict:
     """Query Pinecone with an embedded query. Returns raw Pinecone response.
 
     Caller can post-process to extract documents, scores and metadata.
+    Uses the process-wide shared embedding model unless `model` is given.
+    If `batcher` is given (or `EMBEDDING_MICROBATCH=1` and no `model` is passed),
+    the query is embedded together with concurrent queries by the batcher.
+    A precomputed `query_vector` skips embedding altogether.
     """
-    model = model or load_embedding_model()
-    q_emb = embed_texts([query], model=model)[0]
-    resp = index.query(vector=q_emb, top_k=top_k, include_metadata=True)
+    current_span().set(top_k=top_k)
+    if query_vector is not None:
+        return index.query(vector=_client_vectors(index, np.asarray(query_vector)), top_k=top_k, include_metadata=True)
+    if batcher is None and model is None and microbatch_enabled():
+        batcher = get_default_batcher()
+    if batcher is not None:
+        q_emb = batcher.embed(query)
+    else:
+        model = model or get_embedding_model()
+        q_emb = embed_texts_array([query], model=model)[0]
+    resp = index.query(vector=_client_vectors(index, q_emb), top_k=top_k, include_metadata=True)
     return resp
 
 
-__all__ = ["init_pinecone", "upsert_documents", "query_pinecone"]
+@traced("query_pinecone")
+async def query_pinecone_async(
+    query: str,
+    index: "pinecone.Index",
+    top_k: int = 5,
+    model: Optional[object] = None,
+    batcher: Optional[EmbeddingBatcher] = None,
+    query_vector: Optional[np.ndarray] = None,
+) -> Dict:
+    """Async `query_pinecone` that never blocks the event loop.
+
+    The query is embedded by `batcher` if given, or by the default
+    micro-batcher under the same `EMBEDDING_MICROBATCH=1` rule as
+    `query_pinecone`, so concurrent questions share forward passes; otherwise
+    encoding runs on the shared blocking executor.
+    The index call uses `index.query_async` when the backend has one and the
+    executor otherwise.
+    """
+    if batcher is None and model is None and microbatch_enabled():
+        batcher = get_default_batcher()
+    if query_vector is not None:
+        q_emb = np.asarray(query_vector)
+    elif batcher is not None:
+        q_emb = await batcher.embed_async(query)
+    else:
+        q_emb = (await run_blocking(embed_texts_array, [query], model=model))[0]
+    kwargs = {"vector": _client_vectors(index, q_emb), "top_k": top_k, "include_metadata": True}
+    query_async = getattr(index, "query_async", None)
+    if query_async is not None:
+        return await query_async(**kwargs)
+    return await run_blocking(index.query, **kwargs)
+
+
+__all__ = [
+    "init_pinecone",
+    "init_index",
+    "upsert_documents",
+    "upsert_embeddings",
+    "query_pinecone",
+    "query_pinecone_async",
+    "get_corpus_version",
+    "bump_corpus_version",
+]
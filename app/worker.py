@@ -0,0 +1,189 @@
+import os
+import gc
+import sys
+import time
+import signal
+import logging
+import argparse
+import importlib
+import multiprocessing
+from multiprocessing.connection import wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import Config, load_config
+from app.embeddings import get_embedding_model, get_embedding_registry
+from app.telemetry import flush_telemetry
+from app.vectorstore import init_index
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Preloaded:
+    """What the parent loaded for its workers."""
+
+    config: Config
+    model: Any
+    index: Any
+    index_args: Dict[str, Any] = field(default_factory=dict)
+    load_seconds: float = 0.0
+
+
+def preload(
+    config: Optional[Config] = None,
+    index_name: Optional[str] = None,
+    dimension: Optional[int] = None,
+    warm: bool = True,
+) -> Preloaded:
+    """Load config, the shared embedding model and the index in this process.
+
+    Forked workers (`serve`) then share the loaded weights and index arrays
+    copy-on-write, so starting one costs a fork rather than a model load.
+
+    - `config` defaults to `load_config()`; the model, device, precision and
+      vector backend come from it.
+    - With `warm`, a dummy text is embedded so lazy initialisation happens
+      here, once, instead of in every worker.
+    - The hot request modules are imported as well, so workers start with
+      them in memory.
+    """
+    start = time.perf_counter()
+    config = config or load_config()
+    registry = get_embedding_registry()
+    name, device, precision = registry.key(config.hf_embedding_model, config.embedding_device, config.embedding_precision)
+    if device.startswith("cuda"):
+        raise ValueError("Preloaded workers need the embedding model on the CPU; CUDA cannot be shared across fork")
+    if warm:
+        registry.warmup([name], device=device, precision=precision)
+    model = get_embedding_model(name, device=device, precision=precision)
+    if dimension is None:
+        dimension = model.get_sentence_embedding_dimension()
+
+    index_args = {
+        "index_name": index_name or config.pinecone_index,
+        "dimension": dimension,
+        "metric": config.pinecone_metric,
+        "backend": config.vector_backend,
+        "path": config.local_index_path,
+    }
+    index = init_index(**index_args)
+    importlib.import_module("app.rag.pipeline")
+    importlib.import_module("app.ingestion")
+
+    preloaded = Preloaded(config=config, model=model, index=index, index_args=index_args,
+                          load_seconds=time.perf_counter() - start)
+    logger.info("Preloaded '%s' (%s, %s) and index '%s' in %.2fs",
+                name, device, precision, index_args["index_name"], preloaded.load_seconds)
+    return preloaded
+
+
+def _child(target: Callable[[Preloaded, int], Any], preloaded: Preloaded, worker_id: int) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if preloaded.index_args.get("backend") == "pinecone":
+        # a network client must not share the parent's sockets
+        preloaded.index = init_index(**preloaded.index_args)
+    try:
+        target(preloaded, worker_id)
+    finally:
+        # multiprocessing children skip atexit handlers
+        flush_telemetry(timeout=5)
+
+
+def serve(
+    target: Callable[[Preloaded, int], Any],
+    preloaded: Preloaded,
+    workers: Optional[int] = None,
+    respawn: bool = True,
+    min_uptime: float = 1.0,
+) -> int:
+    """Fork `workers` children (default `WORKERS` or the CPU count) running `target`.
+
+    `target(preloaded, worker_id)` is called in every child, e.g. from the
+    command line: `python -m app.worker --workers 4 myservice.main:run`.
+    Process-wide thread pools, HTTP sessions, SQLite connections and the disk
+    embedding cache are `ProcessSingleton`s (`app.async_utils`), recreated in
+    each child on first use; telemetry sinks reopen per-pid files. Models must
+    be on the CPU: CUDA cannot be used across fork.
+
+    - A child that exits with an error is replaced when `respawn` is set,
+      unless it failed within `min_uptime` seconds of starting (a crash loop);
+      otherwise the parent waits for all children.
+    - SIGTERM / SIGINT stop the children. Returns 0 if every child exited
+      cleanly, else the first non-zero exit code.
+    """
+    workers = workers or int(os.getenv("WORKERS", "0")) or os.cpu_count() or 1
+    ctx = multiprocessing.get_context("fork")
+    # keep the collector from touching (and so copying) the shared objects' pages
+    gc.collect()
+    gc.freeze()
+
+    started: Dict[int, float] = {}
+
+    def start(worker_id: int):
+        proc = ctx.Process(target=_child, args=(target, preloaded, worker_id), name=f"worker-{worker_id}")
+        proc.start()
+        started[worker_id] = time.monotonic()
+        return proc
+
+    procs = {worker_id: start(worker_id) for worker_id in range(workers)}
+    logger.info("Started %d workers: %s", workers, [p.pid for p in procs.values()])
+    stopping = False
+    exit_code = 0
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for proc in procs.values():
+            if proc.is_alive():
+                proc.terminate()
+
+    previous = {sig: signal.signal(sig, stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        while procs:
+            wait([p.sentinel for p in procs.values()])
+            for worker_id, proc in list(procs.items()):
+                if proc.is_alive():
+                    continue
+                proc.join()
+                del procs[worker_id]
+                if proc.exitcode:
+                    logger.warning("Worker %d (pid %d) exited with %s", worker_id, proc.pid, proc.exitcode)
+                    if not stopping and respawn and time.monotonic() - started[worker_id] >= min_uptime:
+                        procs[worker_id] = start(worker_id)
+                        continue
+                    exit_code = exit_code or proc.exitcode
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+        gc.unfreeze()
+    return 0 if stopping else exit_code
+
+
+def _load_target(spec: str) -> Callable[[Preloaded, int], Any]:
+    module, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(f"Worker target '{spec}' must look like 'module:function'")
+    return getattr(importlib.import_module(module), attr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Preload the model and index once, then fork workers.")
+    parser.add_argument("target", help="module:function called as function(preloaded, worker_id) in each worker")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--index", default=None, help="index name (defaults to PINECONE_INDEX)")
+    parser.add_argument("--no-respawn", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(name)s: %(message)s")
+
+    target = _load_target(args.target)
+    preloaded = preload(index_name=args.index)
+    return serve(target, preloaded, workers=args.workers, respawn=not args.no_respawn)
+
+
+__all__ = ["Preloaded", "preload", "serve"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
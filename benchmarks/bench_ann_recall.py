@@ -0,0 +1,71 @@
+"""Recall@k and latency of the IVF-PQ index against exact search.
+
+Runs offline on synthetic clustered vectors:
+
+    python -m benchmarks.bench_ann_recall --vectors 200000 --dim 384 --nlist 1024
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.ann_index import IVFPQIndex
+from app.local_index import LocalIndex
+
+
+def synthetic(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    out = np.empty((n, dim), dtype=np.float32)
+    for i in range(0, n, 65536):
+        size = min(65536, n - i)
+        out[i : i + size] = centers[rng.integers(0, clusters, size)] + 0.5 * rng.standard_normal((size, dim), dtype=np.float32)
+    return out
+
+
+def timed_queries(index, queries, top_k, **kwargs):
+    start = time.perf_counter()
+    results = [index.query_batch(q[None, :], top_k=top_k, **kwargs)[0] for q in queries]
+    return results, 1000.0 * (time.perf_counter() - start) / len(queries)
+
+
+def recall(approx, exact):
+    hits = sum(len({m["id"] for m in a["matches"]} & {m["id"] for m in e["matches"]}) for a, e in zip(approx, exact))
+    return hits / sum(len(e["matches"]) for e in exact)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=512)
+    parser.add_argument("--m", type=int, default=None)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--metric", default="cosine")
+    args = parser.parse_args()
+
+    x = synthetic(args.vectors, args.dim, clusters=max(args.nlist // 2, 1))
+    ids = [f"v{i}" for i in range(args.vectors)]
+    rng = np.random.default_rng(1)
+    queries = x[rng.choice(args.vectors, args.queries, replace=False)] + 0.05 * rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+    exact = LocalIndex(metric=args.metric)
+    ann = IVFPQIndex(args.dim, metric=args.metric, nlist=args.nlist, m=args.m, train_threshold=args.vectors)
+    for i in range(0, args.vectors, 50000):
+        batch = list(zip(ids[i : i + 50000], x[i : i + 50000], [{}] * len(x[i : i + 50000])))
+        exact.upsert(vectors=batch)
+        start = time.perf_counter()
+        ann.upsert(vectors=batch)
+    print(f"{args.vectors} vectors x {args.dim} dims, nlist={args.nlist}, m={ann.m}, last batch + train {time.perf_counter() - start:.1f}s")
+
+    truth, exact_ms = timed_queries(exact, queries, args.top_k)
+    print(f"{'exact':<22} recall@{args.top_k}=1.000  {exact_ms:7.2f} ms/query")
+    for nprobe in (1, 4, 16, 64):
+        for refine in (0, 8):
+            got, ms = timed_queries(ann, queries, args.top_k, nprobe=nprobe, refine_factor=refine)
+            print(f"nprobe={nprobe:<3} refine={refine:<3}     recall@{args.top_k}={recall(got, truth):.3f}  {ms:7.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
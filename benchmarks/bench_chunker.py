@@ -0,0 +1,84 @@
+"""Compare the LangChain splitter with the offset-based chunker.
+
+Runs fully offline on a synthetic corpus of paragraph/sentence text. The
+baseline is the previous `chunk_text`: a new `RecursiveCharacterTextSplitter`
+per document.
+
+    python -m benchmarks.bench_chunker --docs 2000 --chars 20000 --processes 4
+"""
+import argparse
+import os
+import random
+import time
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.rag.chunker import DEFAULT_SEPARATORS, chunk_documents
+
+WORDS = (
+    "the quarterly report lists revenue growth across regions while support costs fell "
+    "after the migration policy updates require approval from finance and legal teams"
+).split()
+
+
+def make_corpus(docs: int, chars: int, seed: int = 0):
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(docs):
+        parts, size = [], 0
+        while size < chars:
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20))).capitalize()
+            sentence += rng.choice((". ", ". ", "? ", "! ")) + ("\n\n" if rng.random() < 0.15 else "")
+            parts.append(sentence)
+            size += len(sentence)
+        corpus.append({"source_id": f"doc{i}", "text": "".join(parts)})
+    return corpus
+
+
+def langchain_chunks(corpus, chunk_size, overlap):
+    total = 0
+    for doc in corpus:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=overlap, separators=list(DEFAULT_SEPARATORS)
+        )
+        total += len(splitter.split_text(doc["text"]))
+    return total
+
+
+def measure(label, fn, chars):
+    start = time.perf_counter()
+    chunks = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<30} {elapsed * 1000:>9.1f} ms   {chars / elapsed / 2**20:>7.1f} MiB/s   {chunks} chunks")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--chars", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.docs, args.chars)
+    chars = sum(len(d["text"]) for d in corpus)
+    print(f"{args.docs} docs, {chars / 2**20:.1f} MiB, chunk_size={args.chunk_size} overlap={args.overlap}")
+
+    def ours(processes, length="chars"):
+        return lambda: sum(
+            len(c)
+            for c in chunk_documents(
+                corpus, chunk_size=args.chunk_size, overlap=args.overlap, length=length, processes=processes
+            )
+        )
+
+    measure("langchain (splitter per doc)", lambda: langchain_chunks(corpus, args.chunk_size, args.overlap), chars)
+    measure("chunker", ours(1), chars)
+    measure("chunker (approx tokens)", ours(1, "tokens"), chars)
+    if args.processes > 1:
+        measure(f"chunker x{args.processes} processes", ours(args.processes), chars)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare the list-of-lists and NumPy embedding paths.
+
+Runs fully offline: a fake encoder returns random float32 matrices shaped like
+`all-MiniLM-L6-v2` output, so only the cost of moving embeddings around is
+measured (not the model itself).
+
+    python -m benchmarks.bench_embedding_arrays --chunks 50000 --dim 384
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.embeddings import embed_texts, embed_texts_array, quantize_int8
+from app.vectorstore import upsert_documents
+
+
+class RandomEncoder:
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.rng = np.random.default_rng(0)
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        return self.rng.standard_normal((len(texts), self.dim), dtype=np.float32)
+
+
+class NullIndex:
+    def __init__(self, accepts_numpy: bool):
+        self.accepts_numpy = accepts_numpy
+
+    def upsert(self, vectors):
+        pass
+
+
+def measure(label, fn):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    print(f"{label:<34} {elapsed * 1000:>9.1f} ms   peak {peak / 2**20:>9.1f} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    model = RandomEncoder(args.dim)
+    texts = [f"chunk {i}" for i in range(args.chunks)]
+    docs = [{"id": f"c{i}", "text": t} for i, t in enumerate(texts)]
+    print(f"{args.chunks} chunks x {args.dim} dims")
+
+    measure("embed_texts (lists)", lambda: embed_texts(texts, model=model))
+    for dtype in ("float32", "float16"):
+        measure(f"embed_texts_array ({dtype})", lambda: embed_texts_array(texts, model=model, dtype=dtype))
+    measure("embed_texts_array + quantize_int8", lambda: quantize_int8(embed_texts_array(texts, model=model)))
+    measure("upsert_documents -> list client", lambda: upsert_documents(docs, NullIndex(False), model=model))
+    measure("upsert_documents -> numpy index", lambda: upsert_documents(docs, NullIndex(True), model=model))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compare PyTorch and int8 ONNX Runtime embedding throughput on CPU.
+
+Embeds chunks of the synthetic `bench_rag` corpus in batches (ingestion) and
+queries one at a time (serving) with the float32 `SentenceTransformer` and the
+quantized ONNX export, and reports how closely the two agree. Needs the
+embedding model (downloaded on first use) and `onnxruntime`/`onnx`; the export
+is cached under `ONNX_EMBEDDING_DIR`.
+
+    python -m benchmarks.bench_onnx_embeddings --chunks 2000 --intra-op-threads 4
+"""
+import argparse
+import os
+
+import numpy as np
+
+from app.embeddings import _resolve_model_name, load_embedding_model
+from app.onnx_embeddings import cosine_agreement, load_onnx_embedding_model
+from app.rag.utils import chunk_text
+from benchmarks.bench_rag import _batches, make_corpus, make_queries, measure
+
+
+def run(model, passages, queries, batch_size):
+    embedded = []
+
+    def encode(batch):
+        embedded.append(np.asarray(model.encode(batch, batch_size=batch_size, show_progress_bar=False)))
+        return len(batch)
+
+    ingest = measure(_batches(passages, batch_size), encode)
+    vectors = np.concatenate(embedded)
+    serve = measure(queries, lambda q: len(model.encode([q], show_progress_bar=False)))
+    return ingest, serve, vectors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=None, help="defaults to HF_EMBEDDING_MODEL")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument("--inter-op-threads", type=int, default=None)
+    args = parser.parse_args()
+
+    model_name = _resolve_model_name(args.model)
+    passages = [c["text"] for d in make_corpus(args.chunks) for c in chunk_text(d["text"], source_id=d["source_id"])]
+    queries = make_queries(args.queries)
+    if args.intra_op_threads:
+        import torch
+
+        # same thread budget for both backends
+        torch.set_num_threads(args.intra_op_threads)
+    models = {
+        "torch float32": load_embedding_model(model_name, device="cpu", precision="float32"),
+        "onnx int8": load_onnx_embedding_model(
+            model_name, intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads
+        ),
+    }
+    print(f"{model_name}: {len(passages)} passages, {len(queries)} queries, {os.cpu_count()} cpus")
+    print(f"{'backend':<16} {'passages/s':>11} {'query p50':>10} {'query p99':>10} {'queries/s':>10}")
+    vectors = {}
+    for label, model in models.items():
+        ingest, serve, vectors[label] = run(model, passages, queries, args.batch_size)
+        print(
+            f"{label:<16} {ingest['throughput']:>11.1f} {serve['p50_ms']:>8.2f}ms "
+            f"{serve['p99_ms']:>8.2f}ms {serve['throughput']:>10.1f}"
+        )
+    parity = cosine_agreement(vectors["torch float32"], vectors["onnx int8"])
+    print(f"cosine agreement: min {parity['min_cosine']:.4f}  mean {parity['mean_cosine']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""End-to-end offline benchmark of the RAG path with a regression gate.
+
+Everything runs on CPU without network or model downloads:
+
+- a synthetic corpus of topic-clustered documents (sizes given in chunks,
+  e.g. `1k` ... `1m`),
+- `HashingEncoder`, a deterministic bag-of-words embedding model,
+- `LatencyIndex`, a `LocalIndex` with optional simulated round-trip latency,
+- `FakeLLM`, which answers after a configurable delay.
+
+Stages: chunk_text, embed_texts, upsert_documents, retrieve_documents,
+rerank (sharded Gemini rerank against `FakeLLM`), build_prompt and
+generate_answer. Each reports throughput, p50/p99 latency per operation and
+peak RSS; with `--repeat` every figure is the median over the runs.
+
+Each run also times a fixed reference workload (`reference_ms`). The gate
+scales the baseline by how much slower that workload ran than when the
+baseline was recorded, so a slower or busier machine is not reported as a
+regression of the code.
+
+    python -m benchmarks.bench_rag --chunks 10k --output results.json
+    python -m benchmarks.bench_rag --baseline benchmarks/baseline.json   # exit 1 on regression
+    python -m benchmarks.bench_rag --update-baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import platform
+import random
+import re
+import resource
+import sys
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.cache import LRUCache
+from app.lexical_index import tokenize
+from app.local_index import LocalIndex
+from app.rag.pipeline import generate_answer
+from app.rag.prompt import build_prompt
+from app.rag.retriever import retrieve_documents
+from app.rag.utils import chunk_text
+from app.embeddings import embed_texts_array
+from app.reranker import TokenFeatureStore, rerank_documents_with_gemini
+from app.vectorstore import upsert_documents
+
+TOPICS = {
+    "billing": "invoice refund payment card charge subscription plan renewal receipt tax",
+    "security": "password login token access role audit breach encryption key rotation",
+    "hardware": "pump valve motor sensor pressure seal bearing maintenance torque gasket",
+    "travel": "flight hotel expense booking approval per diem mileage visa itinerary",
+    "hiring": "candidate interview offer onboarding referral contract probation salary",
+    "network": "router firewall vpn latency packet dns subnet bandwidth switch gateway",
+}
+FILLER = "the a of to and for with on is are was be this that it as from by at policy team process".split()
+
+
+class HashingEncoder:
+    """Deterministic stand-in for a sentence embedding model: hashed bag of words, L2-normalised."""
+
+    embedding_model_name = "bench-hashing-encoder"
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokenize(text)), dtype=np.uint32)
+            if hashes.size:
+                out[i] = np.bincount(hashes % self.dim, minlength=self.dim)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+
+class LatencyIndex(LocalIndex):
+    """`LocalIndex` that sleeps `latency_ms` per query, like a remote vector database."""
+
+    def __init__(self, dimension: int, latency_ms: float = 0.0):
+        super().__init__(dimension=dimension)
+        self.latency_ms = latency_ms
+
+    def query(self, *args, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return super().query(*args, **kwargs)
+
+
+class FakeLLM:
+    """Answers every prompt after `latency_ms`.
+
+    Rerank prompts get a JSON score per document (by word overlap with the
+    query); answer prompts cite the first source in the prompt.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+
+    def __call__(self, prompt: str) -> str:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if prompt.startswith("You are a relevance scorer"):
+            query = set(tokenize(re.search(r"^Query: (.*)$", prompt, re.M).group(1)))
+            scores = [
+                {"id": doc_id, "score": len(query.intersection(tokenize(text))) / max(len(query), 1), "rationale": ""}
+                for doc_id, text in re.findall(r"^ID: (.*)\nText: (.*)$", prompt, re.M)
+            ]
+            return json.dumps(scores)
+        start = prompt.find("[Source: ")
+        cited = prompt[start : prompt.find("]", start) + 1] if start >= 0 else ""
+        return f"Synthetic answer ({len(prompt)} prompt chars). {cited}"
+
+
+def parse_size(value: str) -> int:
+    """`"10k"` -> 10000, `"1m"` -> 1000000."""
+    value = value.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+
+def make_corpus(chunks: int, chunk_size: int = 500, chunks_per_doc: int = 10, seed: int = 0) -> List[Dict[str, str]]:
+    """Documents that `chunk_text(chunk_size)` splits into about `chunks` chunks in total."""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    docs = []
+    for d in range(max(1, chunks // chunks_per_doc)):
+        topic = topics[d % len(topics)]
+        words = TOPICS[topic].split()
+        paragraphs = []
+        for _ in range(chunks_per_doc):
+            sentences, size = [], 0
+            while size < chunk_size * 0.8:
+                n = rng.randint(8, 18)
+                sentence = " ".join(rng.choice(words) if rng.random() < 0.4 else rng.choice(FILLER) for _ in range(n))
+                sentences.append(sentence.capitalize() + ".")
+                size += len(sentence) + 2
+            paragraphs.append(" ".join(sentences))
+        docs.append({"source_id": f"{topic}-{d}", "text": "\n\n".join(paragraphs)})
+    return docs
+
+
+def make_queries(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    return [
+        "How do I handle " + " ".join(rng.sample(TOPICS[topics[i % len(topics)]].split(), 3)) + "?"
+        for i in range(n)
+    ]
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _batches(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def measure(ops: Iterable[Any], fn: Callable[[Any], int]) -> Dict[str, float]:
+    """Run `fn` on every op; `fn` returns how many items the op processed."""
+    latencies = []
+    items = 0
+    start = time.perf_counter()
+    for op in ops:
+        t0 = time.perf_counter()
+        items += fn(op)
+        latencies.append(time.perf_counter() - t0)
+    seconds = time.perf_counter() - start
+    lat = np.asarray(latencies) * 1000.0 if latencies else np.zeros(1)
+    return {
+        "ops": len(latencies),
+        "items": items,
+        "seconds": seconds,
+        "throughput": items / seconds if seconds > 0 else 0.0,
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p99_ms": float(np.percentile(lat, 99)),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def reference_ms(repeats: int = 7) -> float:
+    """Median of `repeats` timings of a fixed CPU workload (tokenising and a matrix product).
+
+    The median rather than the fastest timing, so that a busy machine shows up in it.
+    """
+    matrix = np.random.default_rng(0).standard_normal((512, 384)).astype(np.float32)
+    text = " ".join(TOPICS.values()) * 20
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for _ in range(10):
+            tokenize(text)
+            matrix @ matrix.T
+        timings.append(time.perf_counter() - t0)
+    return float(np.median(timings)) * 1000.0
+
+
+def median_results(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine several `run_benchmark` results: every stage figure and `reference_ms` is the median."""
+    merged = dict(runs[0], runs=len(runs), reference_ms=float(np.median([r["reference_ms"] for r in runs])))
+    merged["stages"] = {
+        stage: {key: type(value)(np.median([r["stages"][stage][key] for r in runs])) for key, value in stats.items()}
+        for stage, stats in runs[0]["stages"].items()
+    }
+    return merged
+
+
+def run_benchmark(
+    chunks: int = 10000,
+    queries: int = 200,
+    dim: int = 384,
+    chunk_size: int = 500,
+    top_k: int = 5,
+    candidates: int = 50,
+    llm_latency_ms: float = 5.0,
+    index_latency_ms: float = 0.0,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    config = {
+        "chunks": chunks,
+        "queries": queries,
+        "dim": dim,
+        "chunk_size": chunk_size,
+        "top_k": top_k,
+        "candidates": candidates,
+        "llm_latency_ms": llm_latency_ms,
+        "index_latency_ms": index_latency_ms,
+        "seed": seed,
+    }
+    model = HashingEncoder(dim)
+    index = LatencyIndex(dim, latency_ms=index_latency_ms)
+    features = TokenFeatureStore()
+    llm = FakeLLM(llm_latency_ms)
+    docs = make_corpus(chunks, chunk_size=chunk_size, seed=seed)
+    questions = make_queries(queries, seed=seed + 1)
+    stages: Dict[str, Dict[str, float]] = {}
+
+    corpus: List[Dict[str, Any]] = []
+
+    def chunk(doc):
+        out = chunk_text(doc["text"], chunk_size=chunk_size, overlap=chunk_size // 10, source_id=doc["source_id"])
+        for c in out:
+            corpus.append({"text": c["text"], "source_id": c["source_id"], "metadata": {"text": c["text"]}})
+        return len(out)
+
+    stages["chunk_text"] = measure(docs, chunk)
+    stages["embed_texts"] = measure(
+        _batches([c["text"] for c in corpus], 256), lambda b: len(embed_texts_array(b, model=model, cache=None))
+    )
+    stages["upsert_documents"] = measure(
+        _batches(corpus, 1000),
+        lambda b: len(upsert_documents(b, index, model=model, cache=None, token_features=features)),
+    )
+
+    retrieved: List[List[Dict]] = []
+
+    def retrieve(q):
+        out = retrieve_documents(q, index, top_k=candidates, re_rank=False, embedding_model=model)["results"]
+        retrieved.append(out)
+        return 1
+
+    stages["retrieve_documents"] = measure(questions, retrieve)
+    pairs = list(zip(questions, retrieved))
+    scores = LRUCache(queries * candidates)
+
+    def rerank(pair):
+        query, docs = pair
+        return len(rerank_documents_with_gemini(query, docs, call_gemini=llm, top_k=top_k, features=features,
+                                                score_cache=scores)) and 1
+
+    stages["rerank"] = measure(pairs, rerank)
+    stages["build_prompt"] = measure(pairs, lambda p: len(build_prompt(p[0], p[1][:top_k])["prompt"]) and 1)
+    stages["generate_answer"] = measure(
+        questions,
+        lambda q: bool(
+            generate_answer(
+                q, index, top_k=top_k, embedding_model=model, token_features=features, call_gemini_fn=llm,
+                answer_cache=None,
+            )["answer"]
+        ),
+    )
+    return {
+        "config": config,
+        "reference_ms": reference_ms(),
+        "indexed_chunks": len(index),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "stages": stages,
+    }
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.5, min_delta_ms: float = 1.0
+) -> List[str]:
+    """Regressions of `results` against `baseline`: throughput below `1 - tolerance` of
+    the baseline, or p99 latency above `1 + tolerance` of it.
+
+    When both carry `reference_ms`, baseline timings are first scaled by how
+    much slower the reference workload ran now (never tightened when it ran
+    faster: the simulated LLM and index latencies do not speed up with the
+    CPU). Differences smaller than `min_delta_ms` (stage wall time for
+    throughput, per-op for p99) are timer noise and never count.
+    """
+    if results["config"] != baseline["config"]:
+        return [f"config differs from baseline: {results['config']} != {baseline['config']}"]
+    scale = 1.0
+    if results.get("reference_ms") and baseline.get("reference_ms"):
+        scale = max(1.0, results["reference_ms"] / baseline["reference_ms"])
+    problems = []
+    for stage, base in baseline["stages"].items():
+        current = results["stages"].get(stage)
+        if current is None:
+            problems.append(f"{stage}: missing from results")
+            continue
+        base_throughput, base_p99 = base["throughput"] / scale, base["p99_ms"] * scale
+        slower = (current["seconds"] - base["seconds"] * scale) * 1000.0 > min_delta_ms
+        if slower and current["throughput"] < base_throughput * (1.0 - tolerance):
+            problems.append(f"{stage}: throughput {current['throughput']:.1f}/s < baseline {base_throughput:.1f}/s")
+        worse = current["p99_ms"] - base_p99 > min_delta_ms
+        if worse and current["p99_ms"] > base_p99 * (1.0 + tolerance):
+            problems.append(f"{stage}: p99 {current['p99_ms']:.2f} ms > baseline {base_p99:.2f} ms")
+    return problems
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    cfg = results["config"]
+    print(f"{results['indexed_chunks']} chunks indexed, {cfg['queries']} queries, dim {cfg['dim']}"
+          f", median of {results.get('runs', 1)} run(s), reference {results['reference_ms']:.2f} ms")
+    print(f"{'stage':<20} {'items':>9} {'items/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS':>11}")
+    for name, s in results["stages"].items():
+        print(
+            f"{name:<20} {s['items']:>9} {s['throughput']:>12.1f} {s['p50_ms']:>9.3f} {s['p99_ms']:>9.3f}"
+            f" {s['peak_rss_mb']:>7.1f} MiB"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=parse_size, default=parse_size("10k"), help="corpus size, e.g. 1k, 100k, 1m")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=5.0)
+    parser.add_argument("--index-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs to take the median of (default 3)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="fail (exit 1) when a stage regresses past this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown (default 0.5)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore smaller absolute slowdowns")
+    parser.add_argument("--update-baseline", metavar="PATH", help="write these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    runs = [
+        run_benchmark(
+            chunks=args.chunks,
+            queries=args.queries,
+            dim=args.dim,
+            chunk_size=args.chunk_size,
+            top_k=args.top_k,
+            candidates=args.candidates,
+            llm_latency_ms=args.llm_latency_ms,
+            index_latency_ms=args.index_latency_ms,
+            seed=args.seed,
+        )
+        for _ in range(max(1, args.repeat))
+    ]
+    results = median_results(runs)
+    print_report(results)
+    for path in (args.output, args.update_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+                f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(results, json.load(f), tolerance=args.tolerance, min_delta_ms=args.min_delta_ms)
+        if problems:
+            print("\nREGRESSIONS:")
+            for p in problems:
+                print(f"  {p}")
+            return 1
+        print(f"\nno regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from app.ann_index import IVFPQIndex
+from app.local_index import LocalIndex
+
+
+def clustered(n, d, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((20, d)).astype(np.float32)
+    return (centers[rng.integers(0, 20, n)] + 0.2 * rng.standard_normal((n, d))).astype(np.float32)
+
+
+def recall(approx, exact):
+    hits = [len({m["id"] for m in a["matches"]} & {m["id"] for m in e["matches"]}) for a, e in zip(approx, exact)]
+    return sum(hits) / sum(len(e["matches"]) for e in exact)
+
+
+class TestIVFPQIndex(unittest.TestCase):
+    def setUp(self):
+        self.x = clustered(3000, 16)
+        self.vectors = [(f"v{i}", row, {"i": i}) for i, row in enumerate(self.x)]
+        self.queries = self.x[:20] + 0.01
+
+    def test_recall_against_exact_search(self):
+        for metric in ("cosine", "euclidean"):
+            ann = IVFPQIndex(16, metric=metric, nlist=16, m=8, nprobe=4, train_threshold=2000)
+            exact = LocalIndex(metric=metric)
+            ann.upsert(vectors=self.vectors[:2500])
+            self.assertTrue(ann.trained)
+            ann.upsert(vectors=self.vectors[2500:])
+            exact.upsert(vectors=self.vectors)
+            self.assertGreaterEqual(recall(ann.query_batch(self.queries, top_k=5), exact.query_batch(self.queries, top_k=5)), 0.9)
+
+    def test_untrained_index_is_exact(self):
+        ann = IVFPQIndex(16, nlist=16)
+        ann.upsert(vectors=self.vectors[:100])
+        self.assertFalse(ann.trained)
+        self.assertEqual(ann.query(vector=self.x[42], top_k=1)["matches"][0]["id"], "v42")
+
+    def test_repeated_id_in_one_batch_keeps_the_last_vector(self):
+        for threshold in (None, 50):
+            ann = IVFPQIndex(16, nlist=4, m=8, nprobe=4, train_threshold=threshold)
+            ann.upsert(vectors=self.vectors[:100])
+            result = ann.upsert(vectors=[("dup", self.x[3], {"v": 1}), ("dup", self.x[4], {"v": 2})])
+            self.assertEqual(result["upserted_count"], 1)
+            self.assertEqual(len(ann), 101)
+            matches = ann.query(vector=self.x[4], top_k=3, include_metadata=True)["matches"]
+            self.assertEqual([m["id"] for m in matches].count("dup"), 1)
+            self.assertEqual(next(m for m in matches if m["id"] == "dup")["metadata"], {"v": 2})
+
+    def test_tombstones_compaction_and_mmap_reload(self):
+        ann = IVFPQIndex(16, nlist=16, m=8, nprobe=16, train_threshold=1000, compact_ratio=0.5)
+        ann.upsert(vectors=self.vectors)
+        ann.delete(ids=["v1", "v2"])
+        self.assertEqual(ann.describe_index_stats()["tombstones"], 2)
+        self.assertNotIn("v1", [m["id"] for m in ann.query(vector=self.x[1], top_k=3)["matches"]])
+        ann.compact()
+        self.assertEqual(ann.describe_index_stats()["tombstones"], 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ann.save(tmp)
+            reopened = IVFPQIndex.open(tmp)
+            self.assertEqual(len(reopened), 2998)
+            self.assertEqual(reopened.query(vector=self.x[7], top_k=1, include_metadata=True)["matches"][0]["metadata"], {"i": 7})
+            reopened.upsert(vectors=[("new", self.x[9] + 5.0, {})])
+            self.assertEqual(reopened.query(vector=self.x[9] + 5.0, top_k=1)["matches"][0]["id"], "new")
+
+
+if __name__ == "__main__":
+    unittest.main()
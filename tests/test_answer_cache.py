@@ -0,0 +1,104 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from app.cache import identity_key
+from app.local_index import LocalIndex
+from app.rag.answer_cache import SemanticAnswerCache
+from app.rag.pipeline import generate_answer
+from app.vectorstore import bump_corpus_version, get_corpus_version
+
+
+class TestSemanticAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.now = [0.0]
+        self.cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_entries=2, clock=lambda: self.now[0])
+
+    def test_similar_queries_hit_and_dissimilar_miss(self):
+        self.cache.store([1.0, 0.0], "yes", [{"id": "d1"}], query="is it on?")
+        hit = self.cache.lookup([0.99, 0.05])
+        self.assertEqual(hit["answer"], "yes")
+        self.assertGreater(hit["similarity"], 0.9)
+        self.assertIsNone(self.cache.lookup([0.0, 1.0]))
+        self.assertIsNone(self.cache.lookup([1.0, 0.0], scope="other settings"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["lookups"], stats["saved_llm_calls"]), (1, 3, 1))
+
+    def test_ttl_version_and_capacity(self):
+        self.cache.store([1.0, 0.0], "old", [], corpus_version=1)
+        self.now[0] = 30
+        self.assertEqual(self.cache.lookup([1.0, 0.0], corpus_version=1)["age_s"], 30)
+        self.assertIsNone(self.cache.lookup([1.0, 0.0], corpus_version=2))
+        self.assertEqual(len(self.cache), 0)
+
+        self.cache.store([1.0, 0.0], "a", [])
+        self.now[0] = 100
+        self.assertIsNone(self.cache.lookup([1.0, 0.0]))
+        self.assertEqual(self.cache.stats()["expired"], 1)
+
+        for i, v in enumerate(([1.0, 0.0], [0.0, 1.0], [0.7, 0.7])):
+            self.cache.store(v, str(i), [])
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.lookup([1.0, 0.0]))
+
+
+class TestPipelineAnswerCache(unittest.TestCase):
+    class TopicModel:
+        def encode(self, texts, **kwargs):
+            return [[1.0, 0.0] if "refund" in t.lower() else [0.0, 1.0] for t in texts]
+
+    class FakeIndex:
+        def query(self, *args, **kwargs):
+            return {"matches": [{"id": "policy", "score": 0.9, "metadata": {"text": "Refunds take 5 days."}}]}
+
+    def test_paraphrase_skips_llm_until_corpus_changes(self):
+        calls = []
+
+        def llm(prompt):
+            calls.append(prompt)
+            return "Five days."
+
+        cache = SemanticAnswerCache()
+        kwargs = dict(
+            index=self.FakeIndex(), top_k=1, re_rank=False, call_gemini_fn=llm,
+            embedding_model=self.TopicModel(), answer_cache=cache,
+        )
+        first = generate_answer("How long do refunds take?", **kwargs)
+        second = generate_answer("refund timing", **kwargs)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second["answer"], first["answer"])
+        self.assertTrue(second["cache"]["hit"])
+        self.assertEqual(second["sources"], first["sources"])
+
+        version = get_corpus_version()
+        bump_corpus_version()
+        self.assertGreater(get_corpus_version(), version)
+        generate_answer("refund timing", **kwargs)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cache.stats()["invalidated"], 1)
+
+    def test_answers_are_not_shared_across_llms_or_indexes(self):
+        cache = SemanticAnswerCache()
+        kwargs = dict(top_k=1, re_rank=False, embedding_model=self.TopicModel(), answer_cache=cache)
+        index = self.FakeIndex()
+        answers = [
+            generate_answer("refund timing", index=index, call_gemini_fn=lambda p: "from a", **kwargs)["answer"],
+            # same index, another LLM
+            generate_answer("refund timing", index=index, call_gemini_fn=lambda p: "from b", **kwargs)["answer"],
+        ]
+        with tempfile.TemporaryDirectory() as tmp, patch.object(LocalIndex, "query", self.FakeIndex.query):
+            other = LocalIndex(path=tmp, dimension=2)
+            answers.append(generate_answer("refund timing", index=other, call_gemini_fn=lambda p: "from b", **kwargs)["answer"])
+        self.assertEqual(answers, ["from a", "from b", "from b"])
+        self.assertEqual(cache.stats()["hits"], 0)
+
+    def test_identity_keys_outlive_objects(self):
+        first = identity_key(self.FakeIndex())
+        # the first index is already collected, so its id() may be handed out again
+        self.assertNotEqual(identity_key(self.FakeIndex()), first)
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(identity_key(LocalIndex(path=tmp)), identity_key(LocalIndex(path=tmp)))
+
+
+if __name__ == "__main__":
+    unittest.main()
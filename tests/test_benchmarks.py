@@ -0,0 +1,67 @@
+import copy
+import unittest
+
+from benchmarks.bench_rag import FakeLLM, compare, make_corpus, median_results, parse_size, run_benchmark
+
+STAGES = {
+    "chunk_text",
+    "embed_texts",
+    "upsert_documents",
+    "retrieve_documents",
+    "rerank",
+    "build_prompt",
+    "generate_answer",
+}
+
+
+class TestBenchRag(unittest.TestCase):
+    def test_small_run_reports_every_stage(self):
+        results = run_benchmark(chunks=300, queries=10, dim=32, llm_latency_ms=0.0)
+        self.assertEqual(set(results["stages"]), STAGES)
+        self.assertEqual(results["indexed_chunks"], results["stages"]["chunk_text"]["items"])
+        self.assertGreater(results["indexed_chunks"], 250)
+        for stats in results["stages"].values():
+            self.assertGreater(stats["throughput"], 0)
+            self.assertLessEqual(stats["p50_ms"], stats["p99_ms"])
+            self.assertGreater(stats["peak_rss_mb"], 0)
+
+        self.assertEqual(compare(results, results), [])
+        slower = copy.deepcopy(results)
+        slower["stages"]["generate_answer"]["p99_ms"] += 50.0
+        slower["stages"]["rerank"]["throughput"] /= 10
+        slower["stages"]["rerank"]["seconds"] += 1.0
+        problems = compare(slower, results)
+        self.assertEqual(len(problems), 2)
+        self.assertTrue(problems[0].startswith("rerank: throughput"))
+        other = dict(results, config=dict(results["config"], chunks=1))
+        self.assertIn("config differs", compare(other, results)[0])
+
+    def test_gate_uses_medians_and_the_reference_workload(self):
+        results = run_benchmark(chunks=100, queries=5, dim=16, llm_latency_ms=0.0)
+        noisy = copy.deepcopy(results)
+        noisy["stages"]["rerank"]["p99_ms"] += 50.0
+        merged = median_results([results, noisy, copy.deepcopy(results)])
+        self.assertEqual(merged["runs"], 3)
+        self.assertEqual(merged["stages"]["rerank"]["p99_ms"], results["stages"]["rerank"]["p99_ms"])
+
+        # every stage three times slower, and so is the reference workload: a slower machine, not a regression
+        slower = copy.deepcopy(results)
+        slower["reference_ms"] *= 3
+        for stats in slower["stages"].values():
+            stats["seconds"] *= 3
+            stats["throughput"] /= 3
+            stats["p99_ms"] *= 3
+        self.assertEqual(compare(slower, results, min_delta_ms=0.0), [])
+        slower["reference_ms"] = results["reference_ms"]
+        self.assertEqual(len(compare(slower, results, min_delta_ms=0.0)), 2 * len(STAGES))
+
+    def test_corpus_and_fakes_are_deterministic(self):
+        self.assertEqual(make_corpus(50), make_corpus(50))
+        self.assertEqual(parse_size("10k"), 10000)
+        self.assertEqual(parse_size("1m"), 1000000)
+        prompt = "You are a relevance scorer.\nQuery: pump valve\nDocuments:\nID: a\nText: pump seal\n---"
+        self.assertIn('"id": "a"', FakeLLM()(prompt))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+
+from app.chunk_store import ChunkStore
+from app.lexical_index import BM25Index
+from app.local_index import LocalIndex
+from app.rag.retriever import retrieve_documents
+from app.reranker import TokenFeatureStore
+from app.vectorstore import upsert_documents
+
+
+class FakeModel:
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        return [[1.0, float(len(t) % 7)] for t in texts]
+
+
+class CountingStore(ChunkStore):
+    def __init__(self, path=None):
+        super().__init__(path)
+        self.fetched = []
+
+    def get_many(self, ids):
+        self.fetched.append(list(ids))
+        return super().get_many(ids)
+
+
+class TestChunkStore(unittest.TestCase):
+    def test_persists_and_reads_in_bulk(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "chunks.db")
+            store = ChunkStore(path)
+            docs = [{"source_id": "s", "text": f"chunk {i}"} for i in range(2000)]
+            store.add_documents(docs, ids=[f"c{i}" for i in range(2000)])
+            store.delete(["c1"])
+            store.close()
+
+            reopened = ChunkStore(path)
+            self.assertEqual(len(reopened), 1999)
+            texts = reopened.get_many([f"c{i}" for i in range(2000)] + ["missing"])
+            self.assertEqual(len(texts), 1999)
+            self.assertEqual(texts["c1999"], "chunk 1999")
+            self.assertNotIn("c1", reopened)
+            self.assertEqual(len(reopened.ids_for_source("s")), 1999)
+            reopened.close()
+
+    def test_index_carries_no_text_and_retrieval_hydrates_survivors(self):
+        store = CountingStore()
+        index = LocalIndex(dimension=2)
+        features = TokenFeatureStore()
+        docs = [
+            {"id": f"d{i}", "text": f"document {i} about {'pumps' if i % 2 else 'valves'}", "metadata": {"team": "ops", "text": "copy"}}
+            for i in range(10)
+        ]
+        upsert_documents(docs, index, model=FakeModel(), chunk_store=store, token_features=features)
+        stored = index.query([1.0, 0.0], top_k=10, include_metadata=True)["matches"]
+        self.assertTrue(all(m["metadata"] == {"team": "ops"} for m in stored))
+
+        out = retrieve_documents(
+            "pumps", index, top_k=2, embedding_model=FakeModel(), dense_top_k=10, token_features=features, chunk_store=store
+        )
+        self.assertEqual(len(out["results"]), 2)
+        self.assertTrue(all("pumps" in r["text"] for r in out["results"]))
+        # lexical rerank ran on token features; only the 2 survivors were fetched
+        self.assertEqual([len(ids) for ids in store.fetched], [2])
+
+        store.fetched.clear()
+        retrieve_documents("pumps", index, top_k=2, embedding_model=FakeModel(), dense_top_k=10, chunk_store=store)
+        self.assertEqual([len(ids) for ids in store.fetched], [10])
+
+    def test_lexical_hits_are_hydrated_from_the_store(self):
+        store = CountingStore()
+        index = LocalIndex(dimension=2)
+        lexical = BM25Index()
+        docs = [{"id": "code", "text": "E1234 means overheating", "metadata": {"team": "ops"}}]
+        upsert_documents(docs, index, model=FakeModel(), chunk_store=store, lexical_index=lexical)
+        self.assertEqual(lexical.search("E1234")["matches"][0]["metadata"], {"team": "ops"})
+
+        out = retrieve_documents(
+            "E1234", index, top_k=1, re_rank=False, embedding_model=FakeModel(), lexical_index=lexical, chunk_store=store
+        )
+        self.assertEqual(out["results"][0]["text"], "E1234 means overheating")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import random
+import unittest
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.rag.chunker import Chunker, approx_token_count, chunk_documents, get_chunker
+from app.rag.utils import chunk_text
+
+
+def _corpus(n, seed=0):
+    rng = random.Random(seed)
+    words = "alpha beta gamma delta. epsilon! zeta? eta\ntheta\n\niota kappa".split(" ")
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(1, 300))) for _ in range(n)]
+
+
+class TestChunker(unittest.TestCase):
+    def test_matches_langchain_splitter(self):
+        for text in _corpus(50):
+            for size, overlap in ((60, 20), (100, 0), (500, 50)):
+                expected = RecursiveCharacterTextSplitter(
+                    chunk_size=size, chunk_overlap=overlap, separators=["\n\n", "\n", ". ", "! ", "? ", " "]
+                ).split_text(text)
+                self.assertEqual([c["text"] for c in chunk_text(text, size, overlap)], expected)
+
+    def test_offsets_point_into_the_text(self):
+        text = _corpus(1, seed=3)[0]
+        chunks = chunk_text(text, chunk_size=80, overlap=20, source_id="doc")
+        self.assertGreater(len(chunks), 1)
+        for c in chunks:
+            self.assertEqual(text[c["start"]:c["end"]], c["text"])
+        self.assertTrue(all(a["start"] < b["start"] for a, b in zip(chunks, chunks[1:])))
+
+    def test_pages_and_token_sizing(self):
+        pages = ["First page. " * 10, "Second page. " * 10, "Third page."]
+        chunks = Chunker(chunk_size=50, overlap=0).chunk_pages(pages, source_id="report.pdf")
+        self.assertEqual(chunks[0]["page"], 1)
+        self.assertEqual(chunks[-1]["page"], 3)
+        self.assertEqual(sorted({c["page"] for c in chunks}), [1, 2, 3])
+
+        text = "word " * 400
+        by_tokens = chunk_text(text, chunk_size=25, overlap=0, length="tokens")
+        self.assertTrue(all(approx_token_count(c["text"]) <= 25 for c in by_tokens))
+        self.assertEqual(by_tokens, chunk_text(text, chunk_size=25, overlap=0, length=approx_token_count))
+
+    def test_process_pool_preserves_order(self):
+        docs = [{"source_id": f"d{i}", "text": t} for i, t in enumerate(_corpus(40, seed=7))]
+        serial = list(chunk_documents(docs, chunk_size=80, overlap=10, processes=1))
+        parallel = list(chunk_documents(iter(docs), chunk_size=80, overlap=10, processes=2, batch_size=3))
+        self.assertEqual(parallel, serial)
+        self.assertIs(get_chunker(80, 10), get_chunker(80, 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
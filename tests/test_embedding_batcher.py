@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import unittest
+
+from app.embedding_batcher import EmbeddingBatcher
+
+
+class RecordingModel:
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        with self.lock:
+            self.batches.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+class TestEmbeddingBatcher(unittest.TestCase):
+    def test_concurrent_requests_share_batches(self):
+        model = RecordingModel()
+        batcher = EmbeddingBatcher(model=model, max_batch_size=8, max_wait_ms=50)
+        texts = ["q" * (i + 1) for i in range(16)]
+        futures = [batcher.submit(t) for t in texts]
+        results = [f.result(timeout=5) for f in futures]
+        batcher.close()
+
+        self.assertEqual([r[0] for r in results], [float(len(t)) for t in texts])
+        self.assertEqual(sum(len(b) for b in model.batches), 16)
+        self.assertLess(len(model.batches), 16)
+        stats = batcher.stats()
+        self.assertEqual(stats["requests"], 16)
+        self.assertEqual(sum(size * n for size, n in stats["batch_size_histogram"].items()), 16)
+        self.assertGreater(stats["mean_batch_size"], 1.0)
+
+    def test_embed_async(self):
+        model = RecordingModel()
+        batcher = EmbeddingBatcher(model=model, max_batch_size=4, max_wait_ms=20)
+
+        async def run():
+            return await asyncio.gather(*(batcher.embed_async(t) for t in ["a", "bb", "ccc"]))
+
+        results = asyncio.run(run())
+        batcher.close()
+        self.assertEqual([r[0] for r in results], [1.0, 2.0, 3.0])
+
+    def test_errors_propagate_to_every_caller(self):
+        class BrokenModel:
+            def encode(self, *args, **kwargs):
+                raise RuntimeError("boom")
+
+        batcher = EmbeddingBatcher(model=BrokenModel(), max_batch_size=4, max_wait_ms=20)
+        futures = [batcher.submit("x"), batcher.submit("y")]
+        for f in futures:
+            with self.assertRaises(RuntimeError):
+                f.result(timeout=5)
+        batcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import multiprocessing
+import tempfile
+import unittest
+
+import numpy as np
+
+from app.embedding_cache import EmbeddingCache
+from app.embeddings import embed_texts
+
+
+class CountingModel:
+    embedding_model_name = "fake-model"
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        self.encoded.extend(texts)
+        return np.array([[float(len(t)), 0.5, -1.0] for t in texts], dtype=np.float32)
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_embed_texts_only_encodes_misses(self):
+        cache = EmbeddingCache(memory_items=100)
+        model = CountingModel()
+        first = embed_texts(["alpha", "beta"], model=model, cache=cache)
+        second = embed_texts(["alpha ", "gamma", "gamma"], model=model, cache=cache)
+
+        self.assertEqual(model.encoded, ["alpha", "beta", "gamma"])
+        self.assertEqual(second[0], first[0])
+        self.assertEqual(second[1], second[2])
+        stats = cache.stats()
+        self.assertEqual(stats["hits_memory"], 1)
+        self.assertGreater(stats["bytes_saved"], 0)
+
+    def test_models_without_a_name_are_not_cached(self):
+        class Unnamed:
+            def __init__(self, value, dim):
+                self.value, self.dim = value, dim
+
+            def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+                return np.full((len(texts), self.dim), self.value, dtype=np.float32)
+
+        cache = EmbeddingCache(memory_items=100)
+        self.assertEqual(embed_texts(["x"], model=Unnamed(1.0, 4), cache=cache), [[1.0] * 4])
+        self.assertEqual(embed_texts(["x"], model=Unnamed(2.0, 4), cache=cache), [[2.0] * 4])
+        self.assertEqual(embed_texts(["x"], model=Unnamed(3.0, 2), cache=cache), [[3.0] * 2])
+        self.assertEqual((cache.stats()["misses"], cache.stats()["memory_items"]), (0, 0))
+
+    def test_disk_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = EmbeddingCache(path=tmp, memory_items=10, dtype="float16")
+            cache.put_many("m", ["one", "two"], [[1.0, 2.0], [3.0, 4.0]])
+
+            reopened = EmbeddingCache(path=tmp, memory_items=10, dtype="float16")
+            got = reopened.get_many("m", ["two", "three", "one"])
+            np.testing.assert_allclose(got[0], [3.0, 4.0])
+            self.assertIsNone(got[1])
+            np.testing.assert_allclose(got[2], [1.0, 2.0])
+            self.assertIsNone(reopened.get_many("other-model", ["one"])[0])
+            self.assertEqual(reopened.stats()["hits_disk"], 2)
+
+    def test_processes_sharing_a_disk_tier_keep_their_rows_apart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            EmbeddingCache(path=tmp).put_many("m", ["seed"], np.zeros((1, 4), dtype=np.float32))
+            # two handles opened before either writes, like forked workers
+            first, second = EmbeddingCache(path=tmp), EmbeddingCache(path=tmp)
+            first.put_many("m", ["a"], np.full((1, 4), 1.0, dtype=np.float32))
+            second.put_many("m", ["b"], np.full((1, 4), 2.0, dtype=np.float32))
+
+            def writer(worker):
+                cache = EmbeddingCache(path=tmp)
+                for i in range(20):
+                    cache.put_many("m", [f"w{worker}-{i}"], np.full((1, 4), worker * 100 + i, dtype=np.float32))
+
+            procs = [multiprocessing.get_context("fork").Process(target=writer, args=(w,)) for w in (1, 2)]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+            self.assertEqual([p.exitcode for p in procs], [0, 0])
+
+            reopened = EmbeddingCache(path=tmp)
+            texts = ["seed", "a", "b"] + [f"w{w}-{i}" for w in (1, 2) for i in range(20)]
+            got = reopened.get_many("m", texts)
+            expected = [0.0, 1.0, 2.0] + [w * 100 + i for w in (1, 2) for i in range(20)]
+            self.assertEqual([v[0] for v in got], expected)
+            self.assertEqual(reopened.stats()["disk_items"], len(texts))
+            # a stale handle sees the other writers' rows after its next write
+            first.put_many("m", ["c"], np.full((1, 4), 3.0, dtype=np.float32))
+            self.assertEqual(first.get_many("m", ["b"])[0][0], 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,21 +1,106 @@
+import threading
 import unittest
 from unittest.mock import patch
 
-from app.embeddings import embed_texts
+import numpy as np
+
+from app.embeddings import (
+    EmbeddingModelRegistry,
+    embed_texts,
+    embed_texts_array,
+    get_embedding_registry,
+    load_embedding_model,
+    quantize_int8,
+)
+
+
+class FakeModel:
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        return [[0.1, 0.2, 0.3] for _ in texts]
 
 
 class TestEmbeddings(unittest.TestCase):
+    def tearDown(self):
+        get_embedding_registry().clear()
+
     @patch("app.embeddings.load_embedding_model")
     def test_embed_texts_returns_vectors(self, mock_load):
-        class FakeModel:
-            def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
-                return [[0.1, 0.2, 0.3] for _ in texts]
-
         mock_load.return_value = FakeModel()
         vecs = embed_texts(["hello", "world"], batch_size=2)
         self.assertEqual(len(vecs), 2)
         self.assertEqual(len(vecs[0]), 3)
 
+    @patch("app.embeddings.load_embedding_model")
+    def test_embed_texts_reuses_shared_model(self, mock_load):
+        mock_load.return_value = FakeModel()
+        embed_texts(["hello"])
+        embed_texts(["world"])
+        self.assertEqual(mock_load.call_count, 1)
+
+    def test_cache_name_includes_reduced_precision(self):
+        class FakeSentenceTransformer(FakeModel):
+            def __init__(self, name, device=None):
+                pass
+
+            def to(self, dtype):
+                return self
+
+        with patch("sentence_transformers.SentenceTransformer", FakeSentenceTransformer):
+            names = [load_embedding_model("m", device="cpu", precision=p).embedding_model_name
+                     for p in ("float32", "float16", "bfloat16")]
+        # float32 keeps the bare name, so vectors cached before precision existed stay valid
+        self.assertEqual(names, ["m", "m@float16", "m@bfloat16"])
+
+
+class TestEmbedTextsArray(unittest.TestCase):
+    def test_returns_contiguous_arrays_in_requested_dtype(self):
+        model = FakeModel()
+        arr = embed_texts_array(["a", "b"], model=model)
+        self.assertEqual(arr.shape, (2, 3))
+        self.assertEqual(arr.dtype, np.float32)
+        self.assertTrue(arr.flags["C_CONTIGUOUS"])
+        self.assertEqual(embed_texts_array(["a"], model=model, dtype="float16").dtype, np.float16)
+        for dtype in ("float64", "int8"):
+            with self.assertRaises(ValueError):
+                embed_texts_array(["a"], model=model, dtype=dtype)
+
+    def test_quantize_int8_round_trips(self):
+        emb = np.array([[0.5, -0.25, 0.0], [0.0, 0.0, 0.0]], dtype=np.float32)
+        codes, scales = quantize_int8(emb)
+        self.assertEqual(codes[0].tolist(), [127, -64, 0])
+        np.testing.assert_allclose(codes * scales[:, None], emb, atol=0.005)
+
+
+class TestEmbeddingModelRegistry(unittest.TestCase):
+    def test_concurrent_get_loads_once(self):
+        calls = []
+
+        def loader(name, device, precision):
+            calls.append((name, device, precision))
+            return FakeModel()
+
+        registry = EmbeddingModelRegistry(loader=loader)
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(registry.get("m", device="cpu"))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(calls, [("m", "cpu", "float32")])
+        self.assertTrue(all(m is models[0] for m in models))
+        self.assertIsNot(registry.get("m", device="cpu", precision="float16"), models[0])
+
+    def test_warmup_reports_stats_and_evicts_idle(self):
+        registry = EmbeddingModelRegistry(loader=lambda *key: FakeModel())
+        stats = registry.warmup(["a", "b"], device="cpu")
+        self.assertEqual([s["model_name"] for s in stats], ["a", "b"])
+        self.assertGreaterEqual(stats[0]["load_seconds"], 0.0)
+
+        evicted = registry.evict_idle(max_idle_seconds=-1)
+        self.assertEqual(len(evicted), 2)
+        self.assertEqual(registry.stats(), [])
+
 
 if __name__ == "__main__":
     unittest.main()
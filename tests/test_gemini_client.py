@@ -0,0 +1,170 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import traceback
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.async_utils import iterate_blocking
+from app.gemini_client import GeminiClient, GeminiError, HTTPTransport, RetryableGeminiError, TokenBucket
+
+
+class FakeTransport:
+    def __init__(self, failures=0, gate=None):
+        self.failures = failures
+        self.gate = gate
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate(self, model, prompt, temperature):
+        with self.lock:
+            self.calls += 1
+            fail = self.calls <= self.failures
+        if fail:
+            raise RetryableGeminiError("HTTP 429", status=429, retry_after=0.25)
+        if self.gate is not None:
+            self.gate.wait(5)
+        return f"answer to {prompt}"
+
+    def stream(self, model, prompt, temperature):
+        yield from self.generate(model, prompt, temperature).split(" ")
+
+
+class TestGeminiClient(unittest.TestCase):
+    def test_retries_with_backoff_respecting_retry_after(self):
+        sleeps = []
+        client = GeminiClient(transport=FakeTransport(failures=2), sleep=sleeps.append, backoff_base=0.01)
+        self.assertEqual(client.generate("q"), "answer to q")
+        self.assertEqual(len(sleeps), 2)
+        self.assertTrue(all(s >= 0.25 for s in sleeps))
+        self.assertEqual(client.stats()["retries"], 2)
+
+        exhausted = GeminiClient(transport=FakeTransport(failures=10), max_retries=1, sleep=lambda s: None)
+        with self.assertRaises(RetryableGeminiError):
+            exhausted.generate("q")
+
+    def test_concurrent_identical_prompts_are_coalesced(self):
+        gate = threading.Event()
+        transport = FakeTransport(gate=gate)
+        client = GeminiClient(transport=transport)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.generate("popular"))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        while client.stats()["coalesced"] < 7:
+            time.sleep(0.001)
+        gate.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ["answer to popular"] * 8)
+        self.assertEqual(transport.calls, 1)
+
+    def test_stream_retries_before_first_chunk(self):
+        client = GeminiClient(transport=FakeTransport(failures=1), sleep=lambda s: None)
+        self.assertEqual(list(client.stream("a b")), ["answer", "to", "a", "b"])
+
+    def test_closed_or_expired_streams_release_their_slot(self):
+        client = GeminiClient(transport=FakeTransport(), max_concurrency=1, stream_timeout=0.05)
+        stream = client.stream("a b")
+        self.assertEqual(next(stream), "answer")
+        stream.close()
+        self.assertEqual(client.generate("q"), "answer to q")
+
+        stream = client.stream("a b")
+        next(stream)
+        time.sleep(0.1)
+        with self.assertRaises(GeminiError):
+            next(stream)
+        self.assertEqual(client.generate("q"), "answer to q")
+
+    def test_closing_the_async_stream_closes_the_upstream_iterator(self):
+        closed = threading.Event()
+
+        def upstream():
+            try:
+                yield from ("one ", "two ", "three")
+            finally:
+                closed.set()
+
+        async def consume_one():
+            stream = iterate_blocking(upstream())
+            await stream.__anext__()
+            await stream.aclose()
+
+        asyncio.run(consume_one())
+        self.assertTrue(closed.is_set())
+
+    def test_token_bucket_spaces_requests(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2.0, capacity=1, clock=lambda: now[0], sleep=lambda s: now.__setitem__(0, now[0] + s))
+        waits = [bucket.acquire() for _ in range(3)]
+        self.assertEqual(waits[0], 0.0)
+        self.assertAlmostEqual(now[0], 1.0)
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    rate_limited = 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        assert self.headers["x-goog-api-key"] == "key" and "key=" not in self.path
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["contents"][0]["parts"][0]["text"]
+        if FakeGeminiHandler.rate_limited:
+            FakeGeminiHandler.rate_limited -= 1
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        chunk = lambda text: {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+        if ":streamGenerateContent" in self.path:
+            payload = "".join(f"data: {json.dumps(chunk(w))}\n\n" for w in ("echo ", prompt)).encode()
+            content_type = "text/event-stream"
+        else:
+            payload = json.dumps(chunk(f"echo {prompt}")).encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class TestHTTPTransport(unittest.TestCase):
+    def setUp(self):
+        FakeGeminiHandler.rate_limited = 1
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGeminiHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1beta"
+        self.client = GeminiClient(transport=HTTPTransport("key", base_url=base_url), sleep=lambda s: None)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_generate_and_stream_against_local_server(self):
+        self.assertEqual(self.client.generate("hi"), "echo hi")
+        self.assertEqual(self.client.stats()["retries"], 1)
+        self.assertEqual(list(self.client.stream("there")), ["echo ", "there"])
+
+    def test_api_key_stays_out_of_errors_and_logs(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        transport = HTTPTransport("SECRET-KEY-123", base_url=f"http://127.0.0.1:{port}/v1beta", timeout=2)
+        client = GeminiClient(transport=transport, max_retries=1, sleep=lambda s: None)
+        with self.assertLogs("app.gemini_client", level="WARNING") as logs:
+            with self.assertRaises(RetryableGeminiError) as ctx:
+                client.generate("hi")
+        self.assertNotIn("SECRET-KEY-123", "\n".join(logs.output))
+        self.assertNotIn("SECRET-KEY-123", str(ctx.exception))
+        self.assertNotIn("SECRET-KEY-123", "".join(traceback.format_exception(ctx.exception)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that are only imported when a model, index or splitter is actually used
+HEAVY = ("torch", "sentence_transformers", "transformers", "pinecone", "langchain", "langchain_text_splitters", "onnxruntime")
+# generous: the import takes ~0.15s, the heavy dependencies several seconds
+BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET", "1.5"))
+
+SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import app.rag, app.rag.pipeline, app.ingestion, app.vectorstore, app.worker
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": sorted(m for m in {HEAVY!r} if m in sys.modules)}}))
+"""
+
+
+class TestImportTime(unittest.TestCase):
+    def test_pipeline_import_defers_heavy_dependencies(self):
+        out = subprocess.run([sys.executable, "-c", SCRIPT], cwd=ROOT, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        self.assertEqual(result["heavy"], [])
+        self.assertLess(result["seconds"], BUDGET_SECONDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from app.ann_index import IVFPQIndex
+from app.ingestion import IngestionPipeline, sync_documents
+from app.lexical_index import BM25Index
+from app.local_index import LocalIndex
+from app.manifest import Manifest, chunk_ids
+from app.reranker import TokenFeatureStore
+
+
+class FakeModel:
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        return np.array([[float(len(t)), 1.0] for t in texts], dtype=np.float32)
+
+
+class FlakyIndex(LocalIndex):
+    """Fails the upsert after `fail_after` successful ones."""
+
+    def __init__(self, fail_after=None):
+        super().__init__(dimension=2)
+        self.fail_after = fail_after
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def upsert(self, vectors):
+        with self.lock:
+            self.calls += 1
+            if self.fail_after is not None and self.calls > self.fail_after:
+                raise ConnectionError("upload failed")
+        return super().upsert(vectors)
+
+
+class TestIngestionPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.docs_dir = os.path.join(self.tmp.name, "docs")
+        os.makedirs(self.docs_dir)
+        for i in range(6):
+            with open(os.path.join(self.docs_dir, f"doc{i}.txt"), "w") as f:
+                f.write(" ".join(f"Sentence {j} of document {i}." for j in range(20)))
+        with open(os.path.join(self.docs_dir, "image.png"), "wb") as f:
+            f.write(b"\x89PNG")
+        self.checkpoint = os.path.join(self.tmp.name, "ingest.ckpt")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def pipeline(self, index, **kwargs):
+        return IngestionPipeline(
+            index, model=FakeModel(), chunk_size=120, overlap=0, embed_batch_size=4, upsert_batch_size=3,
+            queue_size=1, checkpoint_path=self.checkpoint, **kwargs,
+        )
+
+    def test_ingests_all_chunks_with_report(self):
+        index = FlakyIndex()
+        report = self.pipeline(index, chunk_workers=2, upsert_workers=2).run(self.docs_dir)
+        self.assertEqual(report["sources"], 6)
+        self.assertEqual(report["sources_completed"], 6)
+        self.assertEqual(len(index), report["chunks"])
+        self.assertEqual(set(report["stages"]), {"load", "chunk", "embed", "upsert"})
+        self.assertEqual(report["stages"]["embed"]["items"], report["chunks"])
+
+        match = index.query([1.0, 0.0], top_k=1, include_metadata=True)["matches"][0]
+        self.assertTrue(match["id"].startswith(os.path.join(self.docs_dir, "doc")))
+        self.assertIn("text", match["metadata"])
+
+    def test_resume_after_crash_skips_finished_sources(self):
+        with self.assertRaises(ConnectionError):
+            self.pipeline(FlakyIndex(fail_after=8), upsert_workers=1, chunk_workers=1).run(self.docs_dir)
+        finished = self.pipeline(FlakyIndex()).completed_sources()
+        self.assertGreater(len(finished), 0)
+        self.assertLess(len(finished), 6)
+
+        report = self.pipeline(FlakyIndex()).run(self.docs_dir)
+        self.assertEqual(report["sources_skipped"], len(finished))
+        self.assertEqual(report["sources"], 6 - len(finished))
+        self.assertEqual(len(self.pipeline(FlakyIndex()).completed_sources()), 6)
+
+    def test_checkpointed_sources_are_in_the_saved_stores(self):
+        class FlakyANN(IVFPQIndex):
+            calls = 0
+
+            def upsert(self, vectors, **kwargs):
+                FlakyANN.calls += 1
+                if FlakyANN.calls > 8:
+                    raise ConnectionError("upload failed")
+                return super().upsert(vectors, **kwargs)
+
+        paths = {name: os.path.join(self.tmp.name, name) for name in ("ann", "bm25", "features.npz")}
+        with self.assertRaises(ValueError):
+            self.pipeline(LocalIndex(dimension=2), lexical_index=BM25Index())
+        with self.assertRaises(ValueError):
+            self.pipeline(IVFPQIndex(2, m=1))
+
+        with self.assertRaises(ConnectionError):
+            self.pipeline(
+                FlakyANN(2, m=1, path=paths["ann"]), upsert_workers=1, chunk_workers=1, checkpoint_every=1,
+                lexical_index=BM25Index(), lexical_index_path=paths["bm25"],
+                token_features=TokenFeatureStore(), token_features_path=paths["features.npz"],
+            ).run(self.docs_dir)
+
+        finished = self.pipeline(LocalIndex(dimension=2)).completed_sources()
+        self.assertTrue(0 < len(finished) < 6)
+        ann = IVFPQIndex.open(paths["ann"])
+        bm25 = BM25Index.load(paths["bm25"])
+        features = TokenFeatureStore.load(paths["features.npz"])
+        matches = ann.query(vector=[1.0, 1.0], top_k=len(ann), include_metadata=True)["matches"]
+        for source in finished:
+            ids = [m["id"] for m in matches if m["metadata"]["source_id"] == source]
+            self.assertTrue(ids)
+            self.assertTrue(all(features.get(i) is not None for i in ids))
+            self.assertTrue(set(ids) <= set(bm25._ids))
+
+
+class TestSyncDocuments(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.tmp.name, "manifest.json")
+        self.index = LocalIndex(dimension=2)
+        self.corpus = {
+            f"doc{i}": "\n\n".join(f"Paragraph {j} of document {i} with some filler text." for j in range(4))
+            for i in range(3)
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def sync(self):
+        sources = [{"source_id": sid, "text": text} for sid, text in self.corpus.items()]
+        return sync_documents(
+            sources, self.index, Manifest(self.manifest_path), model=FakeModel(), chunk_size=60, overlap=0
+        )
+
+    def test_only_the_delta_is_written(self):
+        first = self.sync()
+        self.assertEqual(first["sources_added"], 3)
+        total = len(self.index)
+        self.assertEqual(first["chunks_upserted"], total)
+
+        again = self.sync()
+        self.assertEqual((again["sources_unchanged"], again["chunks_upserted"], again["chunks_deleted"]), (3, 0, 0))
+
+        self.corpus["doc0"] = self.corpus["doc0"].replace("Paragraph 3", "Rewritten paragraph 3")
+        del self.corpus["doc2"]
+        self.corpus["doc3"] = "A brand new document."
+        delta = self.sync()
+        self.assertEqual((delta["sources_changed"], delta["sources_removed"], delta["sources_added"]), (1, 1, 1))
+        self.assertEqual(delta["chunks_upserted"], 2)
+        self.assertGreater(delta["chunks_kept"], 0)
+
+        manifest = Manifest(self.manifest_path)
+        self.assertEqual(sorted(manifest.sources()), ["doc0", "doc1", "doc3"])
+        expected = {cid for sid in manifest.sources() for cid in manifest.get(sid)["chunks"]}
+        self.assertEqual(len(self.index), len(expected))
+        self.assertEqual(set(self.index.fetch(list(expected))["vectors"]), expected)
+
+    def test_chunk_ids_are_content_based(self):
+        chunks = [{"source_id": "s", "text": "a"}, {"source_id": "s", "text": "b"}, {"source_id": "s", "text": "a"}]
+        ids = chunk_ids(chunks)
+        self.assertEqual(ids, chunk_ids(chunks))
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(chunk_ids(chunks[1:2])[0], ids[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
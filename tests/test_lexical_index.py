@@ -0,0 +1,40 @@
+import tempfile
+import unittest
+
+from app.lexical_index import BM25Index, _encode_varints, decode_varints
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add_documents([
+            {"id": "a", "text": "Error code E1234 means the pump overheated."},
+            {"id": "b", "text": "Restart the pump after cooling down. The pump is fine."},
+            {"id": "c", "text": "Quarterly revenue grew in every region."},
+        ])
+
+    def test_varint_round_trip(self):
+        values = [0, 1, 127, 128, 300, 2**35]
+        self.assertEqual(decode_varints(_encode_varints(values)).tolist(), values)
+
+    def test_exact_terms_rank_first(self):
+        matches = self.index.search("what does E1234 mean", top_k=3)["matches"]
+        self.assertEqual(matches[0]["id"], "a")
+        self.assertNotIn("text", matches[0]["metadata"])
+        pump = self.index.search("pump", top_k=3)["matches"]
+        self.assertEqual([m["id"] for m in pump], ["b", "a"])
+
+    def test_delete_overwrite_and_persistence(self):
+        self.index.delete(["a"])
+        self.assertEqual(self.index.search("E1234")["matches"], [])
+        self.index.add_documents([{"id": "c", "text": "The pump manual"}])
+        with tempfile.TemporaryDirectory() as tmp:
+            self.index.save(tmp)
+            loaded = BM25Index.load(tmp)
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual({m["id"] for m in loaded.search("pump manual")["matches"]}, {"b", "c"})
+        self.assertEqual(loaded.search("revenue")["matches"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from app.local_index import LocalIndex
+
+
+def brute_force(matrix, query, metric, k):
+    if metric == "cosine":
+        m = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        return list(np.argsort(-(m @ (query / np.linalg.norm(query))))[:k])
+    if metric == "dotproduct":
+        return list(np.argsort(-(matrix @ query))[:k])
+    return list(np.argsort(((matrix - query) ** 2).sum(axis=1))[:k])
+
+
+class TestLocalIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.matrix = rng.standard_normal((200, 16)).astype(np.float32)
+        self.ids = [f"v{i}" for i in range(200)]
+
+    def test_top_k_matches_brute_force_for_each_metric(self):
+        query = self.matrix[3] + 0.1
+        for metric in ("cosine", "dotproduct", "euclidean"):
+            index = LocalIndex(metric=metric)
+            index.upsert(vectors=[(vid, row, {"n": i}) for i, (vid, row) in enumerate(zip(self.ids, self.matrix))])
+            resp = index.query(vector=query.tolist(), top_k=5, include_metadata=True)
+            expected = [self.ids[i] for i in brute_force(self.matrix, query, metric, 5)]
+            self.assertEqual([m["id"] for m in resp["matches"]], expected, metric)
+            self.assertEqual(resp["matches"][0]["metadata"]["n"], int(expected[0][1:]))
+
+    def test_batch_query_filter_and_delete(self):
+        index = LocalIndex(metric="cosine")
+        index.upsert(vectors=[(vid, row, {"even": i % 2 == 0}) for i, (vid, row) in enumerate(zip(self.ids, self.matrix))])
+        index.delete(ids=["v0"])
+        responses = index.query_batch(self.matrix[:3], top_k=1)
+        self.assertNotEqual(responses[0]["matches"][0]["id"], "v0")
+        self.assertEqual([r["matches"][0]["id"] for r in responses[1:]], ["v1", "v2"])
+
+        filtered = index.query(vector=self.matrix[1], top_k=3, filter={"even": True}, include_metadata=True)
+        self.assertTrue(all(m["metadata"]["even"] for m in filtered["matches"]))
+
+    def test_persists_appends_deletes_and_compaction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index = LocalIndex(path=tmp, metric="euclidean")
+            index.upsert(vectors=[(vid, row, {}) for vid, row in zip(self.ids[:100], self.matrix[:100])])
+            index.upsert(vectors=[(vid, row, {}) for vid, row in zip(self.ids[100:], self.matrix[100:])])
+            index.upsert(vectors=[("v5", self.matrix[6], {"moved": True})])
+            index.delete(ids=["v7"])
+
+            reopened = LocalIndex(path=tmp, metric="euclidean")
+            self.assertEqual(reopened.describe_index_stats()["total_vector_count"], 199)
+            top = reopened.query(vector=self.matrix[6], top_k=2, include_metadata=True)["matches"]
+            self.assertEqual({m["id"] for m in top}, {"v5", "v6"})
+            self.assertNotIn("v7", [m["id"] for m in reopened.query(vector=self.matrix[7], top_k=3)["matches"]])
+
+            reopened.compact()
+            self.assertEqual(reopened.describe_index_stats()["tombstones"], 0)
+            again = LocalIndex(path=tmp, metric="euclidean")
+            self.assertEqual(len(again), 199)
+            self.assertEqual(again.query(vector=self.matrix[150], top_k=1)["matches"][0]["id"], "v150")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+
+from app.embeddings import EmbeddingModelRegistry, get_embedding_model, get_embedding_registry
+from app.onnx_embeddings import (OnnxEmbeddingModel, cosine_agreement, export_onnx_model, load_onnx_embedding_model,
+                                  onnx_model_dir)
+
+WORDS = ["[UNK]", "pump", "valve", "seal", "motor", "check", "the"]
+
+
+def word_tokenizer():
+    tokenizer = Tokenizer(WordLevel({w: i for i, w in enumerate(WORDS)}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    return tokenizer
+
+
+class _Node:
+    def __init__(self, name, shape=None):
+        self.name = name
+        self.shape = shape
+
+
+class FakeSession:
+    """Embeds each row as (token count, sum of ids) and records the batch shapes."""
+
+    def __init__(self, inputs=("input_ids", "attention_mask")):
+        self.inputs = inputs
+        self.batches = []
+
+    def get_inputs(self):
+        return [_Node(name) for name in self.inputs]
+
+    def get_outputs(self):
+        return [_Node("sentence_embedding", ["batch", 2])]
+
+    def run(self, outputs, feed):
+        self.batches.append(feed["input_ids"].shape)
+        self.feed = feed
+        mask = feed["attention_mask"]
+        return [np.stack([mask.sum(axis=1), (feed["input_ids"] * mask).sum(axis=1)], axis=1).astype(np.float32)]
+
+
+class TestOnnxEmbeddingModel(unittest.TestCase):
+    def test_length_sorted_batches_come_back_in_input_order(self):
+        session = FakeSession(inputs=("input_ids", "attention_mask", "token_type_ids"))
+        model = OnnxEmbeddingModel(session, word_tokenizer(), model_name="tiny", max_length=4)
+        texts = ["pump valve seal motor check", "pump", "the seal", "valve valve valve", "motor"]
+        out = model.encode(texts, batch_size=2)
+
+        self.assertEqual(out.dtype, np.float32)
+        self.assertEqual(out[:, 0].tolist(), [4, 1, 2, 3, 1])  # truncated to max_length
+        self.assertEqual(out[:, 1].tolist(), [10, 1, 9, 6, 4])
+        # batches are padded to their own longest text only
+        self.assertEqual(session.batches, [(2, 1), (2, 3), (1, 4)])
+        self.assertIn("token_type_ids", session.feed)
+        self.assertEqual(model.encode("pump valve").tolist(), [2, 3])
+        self.assertEqual(model.get_sentence_embedding_dimension(), 2)
+        self.assertEqual(model.embedding_model_name, "tiny@onnx-int8")
+
+    def test_cosine_agreement(self):
+        a = np.array([[1.0, 0.0], [0.0, 2.0]])
+        stats = cosine_agreement(a, np.array([[2.0, 0.0], [1.0, 1.0]]))
+        self.assertAlmostEqual(stats["min_cosine"], np.sqrt(0.5), places=5)
+        self.assertAlmostEqual(stats["mean_cosine"], (1 + np.sqrt(0.5)) / 2, places=5)
+
+    @patch("app.embeddings.load_onnx_embedding_model")
+    def test_int8_precision_uses_onnx_backend_on_cpu(self, mock_load):
+        mock_load.return_value = OnnxEmbeddingModel(FakeSession(), word_tokenizer(), model_name="tiny")
+        try:
+            model = get_embedding_model("tiny", device="cuda", precision="int8")
+            self.assertIs(model, mock_load.return_value)
+            mock_load.assert_called_once_with("tiny")
+            self.assertEqual(get_embedding_registry().stats()[0]["device"], "cpu")
+            self.assertEqual(EmbeddingModelRegistry.key("tiny", "cuda", "INT8"), ("tiny", "cpu", "int8"))
+        finally:
+            get_embedding_registry().clear()
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("onnxruntime") and importlib.util.find_spec("onnx"),
+    "onnxruntime and onnx are needed to export",
+)
+class TestOnnxExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.model_path = self._tiny_sentence_transformer(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def _tiny_sentence_transformer(root):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Normalize, Pooling, Transformer
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+
+        bert = os.path.join(root, "bert")
+        os.makedirs(bert)
+        vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS[1:] + list("abcdefghijklmnopqrstuvwxyz.,?")
+        with open(os.path.join(bert, "vocab.txt"), "w") as f:
+            f.write("\n".join(vocab))
+        BertTokenizerFast(vocab_file=os.path.join(bert, "vocab.txt")).save_pretrained(bert)
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                            intermediate_size=64, max_position_embeddings=128)
+        BertModel(config).save_pretrained(bert)
+        model = SentenceTransformer(modules=[Transformer(bert, max_seq_length=64), Pooling(32, "mean"), Normalize()],
+                                    device="cpu")
+        path = os.path.join(root, "st")
+        model.save(path)
+        return path
+
+    def test_int8_export_matches_torch(self):
+        from sentence_transformers import SentenceTransformer
+
+        cache_dir = os.path.join(self.tmp.name, "onnx")
+        model = load_onnx_embedding_model(self.model_path, cache_dir=cache_dir, intra_op_threads=1)
+        self.assertTrue(model.session.get_providers()[0].startswith("CPU"))
+        texts = ["check the pump seal", "valve", "the motor, the valve and the seal " * 3]
+        reference = SentenceTransformer(self.model_path, device="cpu").encode(texts)
+        self.assertGreater(cosine_agreement(reference, model.encode(texts, batch_size=2))["min_cosine"], 0.97)
+
+        # exported once, then reused
+        with patch("app.onnx_embeddings._export_graph") as export:
+            export_onnx_model(self.model_path, output_dir=onnx_model_dir(self.model_path, cache_dir))
+            export.assert_not_called()
+
+        with self.assertRaises(ValueError):
+            export_onnx_model(self.model_path, output_dir=os.path.join(self.tmp.name, "strict"), min_cosine=1.01)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "strict")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,13 @@
+import asyncio
+import json
+import time
 import unittest
 from unittest.mock import MagicMock
 
-from app.rag.pipeline import generate_answer
+from app.chunk_store import ChunkStore
+from app.llm import call_gemini
+from app.rag.answer_cache import SemanticAnswerCache
+from app.rag.pipeline import generate_answer, generate_answer_async, generate_answers, stream_answer_async
 
 
 class TestPipeline(unittest.TestCase):
@@ -24,5 +30,207 @@ class TestPipeline(unittest.TestCase):
         self.assertGreaterEqual(len(out["sources"]), 0)
 
 
+class TestPipelineAsync(unittest.TestCase):
+    def test_concurrent_questions_share_the_event_loop(self):
+        class FakeModel:
+            def encode(self, texts, **kwargs):
+                return [[1.0, 0.0] for _ in texts]
+
+        class FakeIndex:
+            def query(self, *args, **kwargs):
+                return {"matches": [{"id": "doc1", "score": 0.9, "metadata": {"text": "Doc1 text"}}]}
+
+        async def slow_llm(prompt):
+            await asyncio.sleep(0.2)
+            return "async answer"
+
+        async def run():
+            return await asyncio.gather(
+                *(
+                    generate_answer_async(
+                        f"q{i}", index=FakeIndex(), top_k=1, re_rank=False, call_gemini_fn=slow_llm,
+                        embedding_model=FakeModel(),
+                    )
+                    for i in range(100)
+                )
+            )
+
+        start = time.perf_counter()
+        outs = asyncio.run(run())
+        self.assertLess(time.perf_counter() - start, 2.0)
+        self.assertEqual({o["answer"] for o in outs}, {"async answer"})
+        self.assertEqual(outs[0]["sources"][0]["id"], "doc1")
+
+    def test_llm_timeout_cancels(self):
+        class FakeIndex:
+            def query(self, *args, **kwargs):
+                return {"matches": []}
+
+        async def hanging_llm(prompt):
+            await asyncio.sleep(10)
+
+        class FakeModel:
+            def encode(self, texts, **kwargs):
+                return [[1.0] for _ in texts]
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(
+                generate_answer_async(
+                    "q", index=FakeIndex(), re_rank=False, call_gemini_fn=hanging_llm,
+                    embedding_model=FakeModel(), llm_timeout=0.05,
+                )
+            )
+
+
+class TestPipelineStreaming(unittest.TestCase):
+    class FakeModel:
+        def encode(self, texts, **kwargs):
+            return [[1.0, 0.0] for _ in texts]
+
+    class FakeIndex:
+        def query(self, *args, **kwargs):
+            return {"matches": [{"id": "doc1", "score": 0.9, "metadata": {"text": "Doc1 text"}}]}
+
+    def test_stream_yields_sources_then_tokens(self):
+        events = list(
+            generate_answer(
+                "What is X?", index=self.FakeIndex(), top_k=1, re_rank=False, embedding_model=self.FakeModel(),
+                call_gemini_fn=lambda p: call_gemini(p, stream=True, mock=True), stream=True,
+            )
+        )
+        self.assertEqual(events[0]["type"], "sources")
+        self.assertEqual(events[0]["sources"][0]["id"], "doc1")
+        tokens = [e["text"] for e in events if e["type"] == "token"]
+        self.assertGreater(len(tokens), 1)
+        done = events[-1]
+        self.assertEqual(done["answer"], call_gemini("", mock=True))
+        self.assertEqual(done["answer"], "".join(tokens))
+        self.assertLessEqual(done["ttft_ms"], done["total_ms"])
+
+    def test_async_stream(self):
+        async def chunks(prompt):
+            for word in ("async ", "answer"):
+                await asyncio.sleep(0)
+                yield word
+
+        async def run():
+            return [
+                e
+                async for e in stream_answer_async(
+                    "q", index=self.FakeIndex(), re_rank=False, embedding_model=self.FakeModel(), call_gemini_fn=chunks
+                )
+            ]
+
+        events = asyncio.run(run())
+        self.assertEqual([e["type"] for e in events], ["sources", "token", "token", "done"])
+        self.assertEqual(events[-1]["answer"], "async answer")
+        self.assertIsNotNone(events[-1]["ttft_ms"])
+
+    def test_streaming_llm_reranks_with_whole_replies(self):
+        def llm(prompt):
+            if prompt.startswith("You are a relevance scorer"):
+                reply = json.dumps([{"id": "doc1", "score": 0.7, "rationale": "from llm"}])
+            else:
+                reply = "streamed answer"
+            return iter([reply[:5], reply[5:]])
+
+        async def llm_async(prompt):
+            for chunk in llm(prompt):
+                yield chunk
+
+        kwargs = dict(index=self.FakeIndex(), top_k=1, embedding_model=self.FakeModel())
+        events = list(generate_answer("q", call_gemini_fn=llm, stream=True, **kwargs))
+
+        async def run():
+            return [e async for e in stream_answer_async("q", call_gemini_fn=llm_async, **kwargs)]
+
+        for events in (events, asyncio.run(run())):
+            retrieval = events[0]["retrieval"]
+            self.assertEqual(retrieval["rerank"]["backend"], "gemini")
+            self.assertEqual(retrieval["results"][0]["rerank_rationale"], "from llm")
+            self.assertEqual(events[-1]["answer"], "streamed answer")
+
+
+class TestGenerateAnswers(unittest.TestCase):
+    def test_batch_embeds_once_and_runs_llm_in_parallel(self):
+        class CountingModel:
+            calls = 0
+
+            def encode(self, texts, **kwargs):
+                CountingModel.calls += 1
+                return [[float(len(t)), 1.0] for t in texts]
+
+        class FakeIndex:
+            def query(self, *args, **kwargs):
+                return {"matches": [{"id": "doc1", "score": 0.9, "metadata": {"text": "Doc1 text"}}]}
+
+        def slow_llm(prompt):
+            time.sleep(0.2)
+            return prompt.count("Doc1 text")
+
+        queries = [f"question {i}" for i in range(8)]
+        start = time.perf_counter()
+        outs = list(
+            generate_answers(
+                queries, index=FakeIndex(), top_k=1, re_rank=False, call_gemini_fn=slow_llm,
+                embedding_model=CountingModel(), max_concurrency=8,
+            )
+        )
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(CountingModel.calls, 1)
+        self.assertEqual([o["query"] for o in outs], queries)
+        self.assertEqual({o["answer"] for o in outs}, {1})
+        first, second = (o["retrieval"]["results"][0] for o in outs[:2])
+        self.assertIs(first["metadata"], second["metadata"])
+
+        unordered = generate_answers(
+            queries, index=FakeIndex(), top_k=1, re_rank=False, call_gemini_fn=lambda p: "ok",
+            embedding_model=CountingModel(), ordered=False,
+        )
+        self.assertEqual(sorted(o["query_index"] for o in unordered), list(range(8)))
+
+    def test_batch_shares_hydration_reranking_and_the_answer_cache(self):
+        class FakeModel:
+            def encode(self, texts, **kwargs):
+                return [[1.0, 0.0] if "pump" in t else [0.0, 1.0] for t in texts]
+
+        class FakeIndex:
+            def query(self, *args, **kwargs):
+                return {"matches": [{"id": i, "score": 0.5, "metadata": {}} for i in ("a", "b", "c")]}
+
+        class CountingStore(ChunkStore):
+            reads = []
+
+            def get_many(self, ids):
+                self.reads.append(sorted(set(ids)))
+                return super().get_many(ids)
+
+        class CountingReranker:
+            queries = []
+
+            def rerank(self, query, docs, top_k=None):
+                self.queries.append(query)
+                return sorted(docs, key=lambda d: d["text"])[:top_k]
+
+        store = CountingStore()
+        store.add_documents([{"text": "pump c"}, {"text": "pump a"}, {"text": "pump b"}], ["a", "b", "c"])
+        prompts = []
+        cache = SemanticAnswerCache()
+        args = dict(
+            index=FakeIndex(), top_k=2, call_gemini_fn=lambda p: prompts.append(p) or "answer",
+            embedding_model=FakeModel(), reranker=CountingReranker(), chunk_store=store, answer_cache=cache,
+        )
+        outs = list(generate_answers(["pump?", "valve?", "pump?"], **args))
+        self.assertEqual(store.reads, [["a", "b", "c"]])
+        self.assertEqual(sorted(CountingReranker.queries), ["pump?", "valve?"])
+        self.assertEqual(len(prompts), 2)
+        self.assertEqual([o["query_index"] for o in outs], [0, 1, 2])
+        self.assertEqual([d["id"] for d in outs[2]["retrieval"]["results"]], ["b", "c"])
+
+        again = list(generate_answers(["pump?", "valve?"], **args))
+        self.assertTrue(all(o["cache"]["hit"] for o in again))
+        self.assertEqual(len(prompts), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
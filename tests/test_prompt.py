@@ -0,0 +1,73 @@
+import unittest
+
+from app.rag.prompt import build_prompt, drop_near_duplicates, merge_adjacent
+from app.rag.utils import chunk_text
+
+
+class TestBuildPrompt(unittest.TestCase):
+    def setUp(self):
+        self.text = " ".join(f"Step {i} services the pump valve." for i in range(60))
+        chunks = chunk_text(self.text, chunk_size=200, overlap=50, source_id="manual")
+        self.chunks = [dict(c, id=f"manual:{c['position']}", score=1.0) for c in chunks]
+
+    def test_adjacent_chunks_merge_without_overlap(self):
+        merged, saved = merge_adjacent([self.chunks[2], self.chunks[0], self.chunks[1], self.chunks[5]])
+        self.assertEqual(len(merged), 2)
+        self.assertEqual(merged[0]["text"], self.text[self.chunks[0]["start"]:self.chunks[2]["end"]])
+        self.assertEqual(merged[0]["id"], "manual:2")
+        self.assertEqual(merged[0]["merged_ids"], ["manual:0", "manual:1", "manual:2"])
+        self.assertGreater(saved, 0)
+        self.assertEqual(merged[1]["id"], "manual:5")
+
+        # without offsets, consecutive positions are merged by text overlap
+        bare = [{"id": c["id"], "source_id": "manual", "position": c["position"], "text": c["text"]} for c in self.chunks[:2]]
+        self.assertEqual(merge_adjacent(bare)[0][0]["text"], self.text[self.chunks[0]["start"]:self.chunks[1]["end"]])
+
+    def test_near_duplicates_are_dropped(self):
+        passage = self.text[:800]
+        a = {"id": "a", "text": passage}
+        b = {"id": "b", "text": passage.replace("Step 1 ", "Stage 1 ")}
+        c = {"id": "c", "text": "Completely different text about hiring and onboarding new engineers."}
+        kept, dropped = drop_near_duplicates([a, b, c])
+        self.assertEqual([d["id"] for d in kept], ["a", "c"])
+        self.assertEqual([d["id"] for d in dropped], ["b"])
+
+    def test_packs_by_score_per_token_and_reports_savings(self):
+        big = {"id": "big", "text": "x " * 2000, "score": 0.9}
+        small = [{"id": f"s{i}", "text": f"Short relevant fact number {i}.", "score": 0.5} for i in range(3)]
+        dup = {"id": "dup", "text": self.chunks[0]["text"], "score": 0.4}
+        out = build_prompt("pump?", [big] + small + [self.chunks[0], self.chunks[1], dup], token_budget=300)
+
+        ids = [c["id"] for c in out["used_contexts"]]
+        self.assertNotIn("big", ids)
+        self.assertEqual(ids[:3], ["s0", "s1", "s2"])
+        self.assertIn("manual:0", ids)
+        self.assertNotIn("dup", ids)
+        self.assertLessEqual(out["tokens_used"], 300)
+        self.assertGreater(out["tokens_saved"], 0)
+        self.assertEqual(out["packing"]["merged"], 1)
+        self.assertEqual(out["packing"]["duplicates"], 1)
+        self.assertEqual(out["packing"]["skipped"], 1)
+        self.assertIn("[Source: s0]", out["prompt"])
+        self.assertTrue(out["prompt"].endswith("USER QUERY:\npump?\n"))
+
+        exact = build_prompt("pump?", small, token_budget=300, tokenizer=lambda t: len(t.split()))
+        self.assertEqual(exact["tokens_used"], len(exact["prompt"].split()))
+
+    def test_merged_passage_that_does_not_fit_falls_back_to_its_best_chunk(self):
+        top = dict(self.chunks[1], score=0.9)
+        contexts = [top, dict(self.chunks[0], score=0.3), dict(self.chunks[2], score=0.2)]
+        budget = len(top["text"]) // 4 + 40
+        out = build_prompt("pump?", contexts, token_budget=budget)
+        self.assertEqual([c["id"] for c in out["used_contexts"]], ["manual:1"])
+        self.assertEqual(out["used_contexts"][0]["text"], top["text"])
+        self.assertEqual(out["packing"]["split"], 1)
+        self.assertLessEqual(out["tokens_used"], budget)
+
+        roomy = build_prompt("pump?", contexts, token_budget=2048)
+        self.assertEqual(roomy["used_contexts"][0]["merged_ids"], ["manual:0", "manual:1", "manual:2"])
+        self.assertEqual(roomy["packing"]["split"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+import functools
+import json
+import os
+import re
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from app.rag.retriever import retrieve_documents
+from app.cache import LRUCache
+from app.vectorstore import bump_corpus_version
+from app.reranker import (
+    CrossEncoderReranker,
+    TokenFeatureStore,
+    lexical_scores,
+    rerank_documents_with_gemini,
+    rerank_lexical,
+)
+
+
+DOCS = [
+    {"id": "a", "text": "Quarterly revenue grew in every region."},
+    {"id": "b", "text": "Restart the pump after it cools down."},
+    {"id": "c", "text": "The pump overheated; restart the pump."},
+]
+
+
+class TestLexicalReranker(unittest.TestCase):
+    def test_scores_count_unique_overlapping_tokens(self):
+        scores = lexical_scores("restart the PUMP", DOCS)
+        self.assertEqual(scores.tolist(), [0.0, 3.0, 3.0])
+
+    def test_fallback_keeps_order_format_and_copies_only_top_k(self):
+        out = rerank_documents_with_gemini("pump restart", DOCS, top_k=2)
+        self.assertEqual([d["id"] for d in out], ["b", "c"])
+        self.assertEqual(out[0]["rerank_rationale"], "lexical_overlap=2")
+        self.assertNotIn("rerank_score", DOCS[1])
+
+    def test_precomputed_features_are_used_and_persisted(self):
+        store = TokenFeatureStore()
+        store.add_documents(DOCS, ids=["a", "b", "c"])
+        # texts are stripped: scores must come from the stored hashes
+        bare = [{"id": d["id"]} for d in DOCS]
+        results = rerank_lexical("revenue region", bare, features=store)
+        self.assertEqual(results[0].doc["id"], "a")
+        self.assertEqual(results[0].score, 2.0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "features.npz")
+            store.save(path)
+            loaded = TokenFeatureStore.load(path)
+            # a file with pickled (object) ids is refused rather than unpickled
+            np.savez(path, hashes=np.zeros(0, dtype=np.uint32), lengths=np.zeros(1, dtype=np.int64),
+                     ids=np.array(["a"], dtype=object))
+            with self.assertRaises(ValueError):
+                TokenFeatureStore.load(path)
+        self.assertEqual(len(loaded), 3)
+        self.assertEqual(lexical_scores("pump", bare, features=loaded).tolist(), [0.0, 1.0, 1.0])
+
+
+class TestShardedGeminiRerank(unittest.TestCase):
+    def setUp(self):
+        self.prompts = []
+
+    def fake_gemini(self, prompt):
+        self.prompts.append(prompt)
+        ids = re.findall(r"^ID: (\S+)", prompt, flags=re.M)
+        if "b" in ids:
+            return "not json"
+        return json.dumps([{"id": i, "score": 0.9 if i == "a" else 0.1, "rationale": "r"} for i in ids])
+
+    def test_shards_merge_partial_results_and_cache_scores(self):
+        cache = LRUCache(100)
+        out = rerank_documents_with_gemini(
+            "restart pump now", DOCS, call_gemini=self.fake_gemini, shard_size=1, score_cache=cache
+        )
+        self.assertEqual(len(self.prompts), 3)
+        by_id = {d["id"]: d for d in out}
+        self.assertEqual([d["id"] for d in out], ["a", "b", "c"])
+        self.assertEqual(by_id["c"]["rerank_rationale"], "r")
+        # the failed shard is scored lexically instead of discarding the others
+        self.assertEqual(by_id["b"]["rerank_rationale"], "lexical_overlap=2")
+
+        rerank_documents_with_gemini(
+            "restart pump now", DOCS, call_gemini=self.fake_gemini, shard_size=1, score_cache=cache
+        )
+        self.assertEqual(len(self.prompts), 4)
+        self.assertNotIn("ID: a", self.prompts[-1])
+
+    def test_cached_scores_are_scoped_to_scorer_text_and_corpus(self):
+        docs = DOCS[:1]
+        cache = LRUCache(100)
+        rerank_documents_with_gemini("q", docs, call_gemini=self.fake_gemini, score_cache=cache)
+        rerank_documents_with_gemini("q", docs, call_gemini=self.fake_gemini, score_cache=cache)
+        self.assertEqual(len(self.prompts), 1)
+
+        wrapped = functools.partial(self.fake_gemini)
+        rerank_documents_with_gemini("q", docs, call_gemini=lambda p: self.fake_gemini(p), score_cache=cache)
+        rerank_documents_with_gemini("q", docs, call_gemini=wrapped, score_cache=cache)
+        edited = [{"id": "a", "text": "Quarterly revenue fell."}]
+        rerank_documents_with_gemini("q", edited, call_gemini=self.fake_gemini, score_cache=cache)
+        self.assertEqual(len(self.prompts), 4)
+
+        # the process-wide cache is emptied when the corpus changes
+        rerank_documents_with_gemini("q", docs, call_gemini=self.fake_gemini)
+        rerank_documents_with_gemini("q", docs, call_gemini=self.fake_gemini)
+        self.assertEqual(len(self.prompts), 5)
+        bump_corpus_version()
+        rerank_documents_with_gemini("q", docs, call_gemini=self.fake_gemini)
+        self.assertEqual(len(self.prompts), 6)
+
+    def test_passages_are_truncated(self):
+        docs = [{"id": "x", "text": "y" * 5000}]
+        rerank_documents_with_gemini(
+            "q", docs, call_gemini=self.fake_gemini, max_passage_chars=100, score_cache=LRUCache(10)
+        )
+        self.assertIn("y" * 100 + "\n---", self.prompts[0])
+        self.assertNotIn("y" * 101, self.prompts[0])
+
+
+class FakeCrossEncoder:
+    """Scores a pair by how often 'pump' occurs in the passage."""
+
+    def __init__(self):
+        self.pairs = []
+
+    def predict(self, pairs, batch_size=32):
+        self.pairs.extend(pairs)
+        return [p.lower().count("pump") for _, p in pairs]
+
+
+class TestCrossEncoderReranker(unittest.TestCase):
+    def test_scores_sort_and_cache_by_query_and_doc(self):
+        model = FakeCrossEncoder()
+        reranker = CrossEncoderReranker(model=model)
+        out = reranker.rerank("pump", DOCS, top_k=2)
+        self.assertEqual([d["id"] for d in out], ["c", "b"])
+        self.assertEqual(out[0]["rerank_score"], 2.0)
+        self.assertEqual(out[0]["rerank_rationale"], "cross_encoder")
+
+        reranker.rerank("pump", DOCS + [{"id": "d", "text": "pump"}])
+        self.assertEqual(len(model.pairs), 4)
+        stats = reranker.stats()
+        self.assertEqual((stats["calls"], stats["pairs_scored"], stats["cache_hits"]), (2, 4, 3))
+
+    def test_edited_docs_and_corpus_changes_are_rescored(self):
+        model = FakeCrossEncoder()
+        reranker = CrossEncoderReranker(model=model)
+        self.assertEqual(reranker.score("q", [{"id": "a", "text": "pump"}]).tolist(), [1.0])
+        edited = reranker.score("q", [{"id": "a", "text": "pump and a second pump"}])
+        self.assertEqual(edited.tolist(), [2.0])
+        reranker.score("q", [{"id": "a", "text": "pump and a second pump"}])
+        self.assertEqual(len(model.pairs), 2)
+        bump_corpus_version()
+        reranker.score("q", [{"id": "a", "text": "pump and a second pump"}])
+        self.assertEqual(len(model.pairs), 3)
+
+    def test_long_passages_are_truncated(self):
+        model = FakeCrossEncoder()
+        reranker = CrossEncoderReranker(model=model, max_length=32)
+        reranker.rerank("q", [{"id": "long", "text": "word " * 1000}])
+        self.assertEqual(len(model.pairs[0][1].split()), 31)
+
+    def test_plugs_into_retrieve_documents(self):
+        class FakeModel:
+            def encode(self, texts, **kwargs):
+                return [[1.0, 0.0] for _ in texts]
+
+        class FakeIndex:
+            def query(self, *args, **kwargs):
+                return {"matches": [{"id": d["id"], "score": 0.5, "metadata": {"text": d["text"]}} for d in DOCS]}
+
+        out = retrieve_documents(
+            "pump",
+            index=FakeIndex(),
+            top_k=1,
+            embedding_model=FakeModel(),
+            reranker=CrossEncoderReranker(model=FakeCrossEncoder()),
+        )
+        self.assertEqual(out["results"][0]["id"], "c")
+        self.assertEqual(out["rerank"]["backend"], "CrossEncoderReranker")
+        self.assertEqual(out["rerank"]["candidates"], 3)
+
+        # RERANKER_BACKEND=cross_encoder applies only when no call_gemini is given
+        default = CrossEncoderReranker(model=FakeCrossEncoder())
+        def fake_gemini(prompt):
+            return json.dumps([{"id": "a", "score": 1.0, "rationale": "gemini"}])
+
+        with patch("app.rag.retriever.get_default_reranker", return_value=default):
+            args = dict(index=FakeIndex(), top_k=1, embedding_model=FakeModel())
+            self.assertEqual(retrieve_documents("pump", **args)["rerank"]["backend"], "CrossEncoderReranker")
+            out = retrieve_documents("pump", call_gemini=fake_gemini, **args)
+            self.assertEqual(out["rerank"]["backend"], "gemini")
+            self.assertEqual(out["results"][0]["rerank_rationale"], "gemini")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,11 @@
+import asyncio
+import json
+import re
 import unittest
 from unittest.mock import MagicMock
 
-from app.rag.retriever import retrieve_documents
+from app.lexical_index import BM25Index
+from app.rag.retriever import fuse_results, retrieve_documents, retrieve_documents_async
 
 
 class TestRetriever(unittest.TestCase):
@@ -16,6 +20,70 @@ class TestRetriever(unittest.TestCase):
         self.assertIn("results", out)
         self.assertIsInstance(out["results"], list)
 
+    def test_fuse_results_rrf_and_weighted(self):
+        dense = [{"id": "a", "score": 0.9, "text": "A"}, {"id": "b", "score": 0.5, "text": "B"}]
+        lexical = [{"id": "b", "score": 7.0, "text": "B"}, {"id": "c", "score": 3.0, "text": "C"}]
+        rrf = fuse_results([dense, lexical])
+        self.assertEqual([d["id"] for d in rrf], ["b", "a", "c"])
+        self.assertEqual(rrf[0]["fused_scores"], [0.5, 7.0])
+        weighted = fuse_results([dense, lexical], method="weighted", weights=[0.9, 0.1], top_k=2)
+        self.assertEqual([d["id"] for d in weighted], ["a", "b"])
+
+    def test_hybrid_retrieval_recovers_exact_terms(self):
+        class FakeModel:
+            def encode(self, texts, **kwargs):
+                return [[1.0, 0.0] for _ in texts]
+
+        class FakeIndex:
+            def query(self, *args, **kwargs):
+                return {"matches": [{"id": "dense", "score": 0.8, "metadata": {"text": "general pump advice"}}]}
+
+        lexical = BM25Index()
+        lexical.add_documents([{"id": "code", "text": "E1234 means overheating"}])
+        out = retrieve_documents(
+            "E1234", index=FakeIndex(), top_k=2, re_rank=False, embedding_model=FakeModel(), lexical_index=lexical
+        )
+        self.assertEqual({d["id"] for d in out["results"]}, {"dense", "code"})
+        self.assertIn("lexical_response", out)
+
+
+class TestRetrieverAsync(unittest.TestCase):
+    class FakeModel:
+        def encode(self, texts, **kwargs):
+            return [[1.0, 0.0] for _ in texts]
+
+    class FakeIndex:
+        def query(self, *args, **kwargs):
+            matches = [{"id": f"d{i}", "score": 0.5, "metadata": {"text": f"pump note {i}"}} for i in range(6)]
+            return {"matches": matches}
+
+    def test_async_gemini_rerank_shards(self):
+        async def fake_gemini(prompt):
+            ids = re.findall(r"^ID: (\S+)", prompt, flags=re.M)
+            return json.dumps([{"id": i, "score": int(i[1:]) / 10, "rationale": ""} for i in ids])
+
+        out = asyncio.run(
+            retrieve_documents_async(
+                "pump", index=self.FakeIndex(), top_k=2, call_gemini=fake_gemini, embedding_model=self.FakeModel()
+            )
+        )
+        self.assertEqual([d["id"] for d in out["results"]], ["d5", "d4"])
+        self.assertEqual(out["rerank"]["backend"], "gemini")
+
+    def test_rerank_timeout_falls_back_to_lexical(self):
+        async def slow_gemini(prompt):
+            await asyncio.sleep(10)
+
+        out = asyncio.run(
+            retrieve_documents_async(
+                "pump note", index=self.FakeIndex(), top_k=3, call_gemini=slow_gemini,
+                embedding_model=self.FakeModel(), rerank_timeout=0.05,
+            )
+        )
+        self.assertTrue(out["rerank"]["timed_out"])
+        self.assertEqual(len(out["results"]), 3)
+        self.assertTrue(out["results"][0]["rerank_rationale"].startswith("lexical_overlap="))
+
 
 if __name__ == "__main__":
     unittest.main()
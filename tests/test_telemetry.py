@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from app.llm import call_gemini
+from app.rag.pipeline import generate_answer, generate_answer_async
+from app.reranker import CrossEncoderReranker
+from app.telemetry import (
+    BufferedSink,
+    configure_telemetry,
+    current_span,
+    get_metrics_registry,
+    prometheus_metrics,
+    span,
+)
+
+
+class FakeModel:
+    def encode(self, texts, **kwargs):
+        return [[1.0, 0.0] for _ in texts]
+
+
+class FakeIndex:
+    def query(self, *args, **kwargs):
+        return {"matches": [{"id": f"doc{i}", "score": 0.9, "metadata": {"text": f"pump manual {i}"}} for i in range(4)]}
+
+
+class TestTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        get_metrics_registry().clear()
+
+    def tearDown(self):
+        configure_telemetry(enabled=True, sink=None)
+        self.tmp.cleanup()
+
+    def test_pipeline_stages_are_traced(self):
+        sink = BufferedSink(os.path.join(self.tmp.name, "spans.jsonl"))
+        configure_telemetry(sink=sink)
+        generate_answer(
+            "pump?", index=FakeIndex(), top_k=2, embedding_model=FakeModel(),
+            call_gemini_fn=lambda p: call_gemini(p, mock=True),
+        )
+        sink.close()
+
+        with open(sink.path) as f:
+            spans = {r["name"]: r for r in map(json.loads, f)}
+        self.assertTrue({"generate_answer", "retrieve_documents", "query_pinecone", "embed_texts", "rerank", "call_gemini"} <= set(spans))
+        root = spans["generate_answer"]
+        self.assertIsNone(root["parent"])
+        self.assertEqual(spans["retrieve_documents"]["parent"], root["span"])
+        self.assertEqual({r["trace"] for r in spans.values()}, {root["trace"]})
+        self.assertEqual(spans["embed_texts"]["attrs"]["texts"], 1)
+        self.assertEqual(spans["rerank"]["attrs"]["candidates"], 4)
+        self.assertGreater(root["attrs"]["prompt_chars"], 0)
+        self.assertEqual(get_metrics_registry().snapshot()["generate_answer"]["count"], 1)
+
+    def test_blocking_stages_of_the_async_pipeline_nest_in_one_trace(self):
+        class FakeCrossEncoder:
+            def predict(self, pairs, batch_size=32):
+                return [len(p) for _, p in pairs]
+
+        sink = BufferedSink(os.path.join(self.tmp.name, "spans.jsonl"))
+        configure_telemetry(sink=sink)
+        asyncio.run(
+            generate_answer_async(
+                "pump?", index=FakeIndex(), top_k=2, embedding_model=FakeModel(),
+                reranker=CrossEncoderReranker(model=FakeCrossEncoder()), call_gemini_fn=lambda p: "answer",
+            )
+        )
+        sink.close()
+
+        with open(sink.path) as f:
+            spans = {r["name"]: r for r in map(json.loads, f)}
+        root = spans["generate_answer"]
+        self.assertEqual({r["trace"] for r in spans.values()}, {root["trace"]})
+        self.assertEqual(spans["rerank"]["parent"], spans["retrieve_documents"]["span"])
+        self.assertEqual(spans["embed_texts"]["parent"], spans["query_pinecone"]["span"])
+
+    def test_prometheus_export_and_errors(self):
+        for i in range(100):
+            with span("stage", batch=2) as s:
+                s.set(cache_hit=i % 4 == 0)
+        with self.assertRaises(KeyError):
+            with span("stage"):
+                raise KeyError("boom")
+        current_span().set(ignored=True)
+
+        text = prometheus_metrics()
+        self.assertIn('rag_span_seconds{span="stage",quantile="0.95"}', text)
+        self.assertIn('rag_span_seconds_count{span="stage"} 101', text)
+        self.assertIn('rag_span_errors_total{span="stage"} 1', text)
+        self.assertIn('rag_span_attribute_total{span="stage",attribute="batch"} 200.0', text)
+        self.assertIn('rag_span_attribute_total{span="stage",attribute="cache_hit"} 25.0', text)
+
+    def test_sink_batches_rotates_and_bounds_memory(self):
+        path = os.path.join(self.tmp.name, "log.jsonl")
+        sink = BufferedSink(path, max_bytes=2000, backups=2, batch_size=10, flush_interval=0.01)
+        for i in range(200):
+            self.assertTrue(sink.write({"i": i, "pad": "x" * 40}))
+        self.assertTrue(sink.flush(timeout=5))
+        stats = sink.stats()
+        self.assertEqual(stats["written"], 200)
+        self.assertGreater(stats["rotations"], 0)
+        self.assertTrue(os.path.exists(path + ".2"))
+        self.assertFalse(os.path.exists(path + ".3"))
+        sink.close()
+        self.assertFalse(sink.write({"late": True}))
+
+        tiny = BufferedSink(os.path.join(self.tmp.name, "tiny.jsonl"), max_buffer=5, flush_interval=60, batch_size=100)
+        accepted = sum(tiny.write({"i": i}) for i in range(50))
+        self.assertLessEqual(accepted, 10)
+        self.assertGreaterEqual(tiny.stats()["dropped"], 40)
+        tiny.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from app.local_index import LocalIndex
+from app.vectorstore import init_index, query_pinecone, query_pinecone_async, upsert_documents
+
+
+class FakeModel:
+    def encode(self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        return np.array([[float(len(t)), 1.0] for t in texts], dtype=np.float32)
+
+
+class RecordingIndex:
+    accepts_numpy = False
+
+    def __init__(self):
+        self.upserts = []
+        self.queries = []
+
+    def upsert(self, vectors):
+        self.upserts.append(vectors)
+
+    def query(self, vector, top_k, include_metadata):
+        self.queries.append(vector)
+        return {"matches": []}
+
+
+class TestVectorstore(unittest.TestCase):
+    def test_upsert_batches_convert_to_lists_for_client(self):
+        index = RecordingIndex()
+        docs = [{"id": f"d{i}", "text": "x" * i, "metadata": {"i": i}} for i in range(5)]
+        ids = upsert_documents(docs, index, model=FakeModel(), batch_size=2)
+
+        self.assertEqual(ids, ["d0", "d1", "d2", "d3", "d4"])
+        self.assertEqual([len(b) for b in index.upserts], [2, 2, 1])
+        vid, values, meta = index.upserts[1][0]
+        self.assertEqual((vid, values, meta), ("d2", [2.0, 1.0], {"i": 2}))
+
+    def test_numpy_indexes_receive_arrays(self):
+        index = RecordingIndex()
+        index.accepts_numpy = True
+        upsert_documents([{"id": "a", "text": "abc"}], index, model=FakeModel())
+        query_pinecone("hello", index, model=FakeModel())
+
+        self.assertIsInstance(index.upserts[0][0][1], np.ndarray)
+        self.assertIsInstance(index.queries[0], np.ndarray)
+
+    def test_local_backend_round_trip(self):
+        index = init_index("kb", dimension=2, metric="cosine", backend="local")
+        self.assertIsInstance(index, LocalIndex)
+        docs = [{"id": "short", "text": "a", "metadata": {"text": "a"}}, {"id": "long", "text": "a" * 9}]
+        upsert_documents(docs, index, model=FakeModel())
+        resp = query_pinecone("a" * 8, index, top_k=1, model=FakeModel())
+        self.assertEqual(resp["matches"][0]["id"], "long")
+
+    def test_async_query_uses_the_batcher_only_when_enabled(self):
+        batcher = MagicMock()
+        batcher.embed.return_value = np.array([9.0, 1.0], dtype=np.float32)
+
+        async def embed_async(text):
+            return batcher.embed(text)
+
+        batcher.embed_async = embed_async
+        index = RecordingIndex()
+        with patch("app.vectorstore.get_default_batcher", return_value=batcher) as default, \
+                patch("app.vectorstore.get_embedding_model", return_value=FakeModel()), \
+                patch("app.embeddings.get_embedding_model", return_value=FakeModel()):
+            for flag, expected in (("", [5.0, 1.0]), ("1", [9.0, 1.0])):
+                with patch.dict(os.environ, {"EMBEDDING_MICROBATCH": flag}):
+                    asyncio.run(query_pinecone_async("hello", index))
+                    query_pinecone("hello", index)
+                self.assertEqual(index.queries[-2:], [expected, expected])
+            self.assertEqual(default.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from app.async_utils import get_blocking_executor
+from app.config import Config
+from app.embeddings import embed_texts_array, get_embedding_registry
+from app.local_index import LocalIndex
+from app.worker import preload, serve
+
+
+class FakeModel:
+    def encode(self, texts, **kwargs):
+        return np.tile(np.array([[1.0, 0.0, 0.0]], dtype=np.float32), (len(texts), 1))
+
+    def get_sentence_embedding_dimension(self):
+        return 3
+
+
+def make_config(**overrides):
+    values = dict(
+        gemini_api_key="key",
+        pinecone_api_key=None,
+        pinecone_environment=None,
+        pinecone_index="worker-test",
+        hf_embedding_model="fake-model",
+        hf_api_key=None,
+        pinecone_metric="cosine",
+        embedding_device="cpu",
+        vector_backend="local",
+    )
+    values.update(overrides)
+    return Config(**values)
+
+
+class TestWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = patch("app.embeddings.load_embedding_model", return_value=FakeModel())
+        self.load = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        get_embedding_registry().clear()
+        self.tmp.cleanup()
+
+    def test_forked_workers_share_preloaded_model_and_index(self):
+        preloaded = preload(config=make_config())
+        self.assertEqual(self.load.call_count, 1)
+        self.assertIsInstance(preloaded.index, LocalIndex)
+        preloaded.index.upsert([("doc1", [1.0, 0.0, 0.0], {"text": "pump"})])
+        # a pool whose threads exist only in the parent
+        self.assertEqual(get_blocking_executor().submit(lambda: 1).result(), 1)
+
+        def target(pre, worker_id):
+            vector = embed_texts_array(["pump?"], model=pre.model)[0]
+            result = {
+                "pid": os.getpid(),
+                "model": id(pre.model),
+                "match": pre.index.query(vector=vector.tolist(), top_k=1)["matches"][0]["id"],
+                "executor": get_blocking_executor().submit(lambda: worker_id).result(timeout=5),
+            }
+            with open(os.path.join(self.tmp.name, f"{worker_id}.json"), "w") as f:
+                json.dump(result, f)
+
+        self.assertEqual(serve(target, preloaded, workers=2, respawn=False), 0)
+        results = []
+        for worker_id in range(2):
+            with open(os.path.join(self.tmp.name, f"{worker_id}.json")) as f:
+                results.append(json.load(f))
+        self.assertEqual({r["model"] for r in results}, {id(preloaded.model)})
+        self.assertEqual([r["match"] for r in results], ["doc1", "doc1"])
+        self.assertEqual([r["executor"] for r in results], [0, 1])
+        self.assertNotIn(os.getpid(), {r["pid"] for r in results})
+        self.assertEqual(self.load.call_count, 1)
+
+    def test_failing_worker_is_reported_and_cuda_is_refused(self):
+        preloaded = preload(config=make_config(), warm=False)
+
+        def target(pre, worker_id):
+            raise RuntimeError("boom")
+
+        with patch("sys.stderr"):
+            self.assertNotEqual(serve(target, preloaded, workers=1, min_uptime=60), 0)
+        with self.assertRaises(ValueError):
+            preload(config=make_config(embedding_device="cuda"))
+
+
+if __name__ == "__main__":
+    unittest.main()